@@ -0,0 +1,107 @@
+import json
+import os
+import re
+from typing import Dict, List, NamedTuple, Optional, Pattern, Tuple
+
+# Keyword phrases per intent; matched on word boundaries, case-insensitively
+DEFAULT_RULES: Dict[str, List[str]] = {
+    "image": [
+        "generate image", "generate an image", "create image", "create an image",
+        "make a picture", "draw", "photo", "visualize", "image of", "picture of",
+        # Forms the word-boundary match no longer catches as substrings
+        "drawing", "photograph", "photorealistic", "visualise",
+    ],
+}
+
+# Templates that imply an intent on their own
+DEFAULT_TEMPLATE_INTENTS: Dict[str, str] = {
+    "image": "image",
+    "photo": "image",
+}
+
+TEMPLATE_TAG = re.compile(r"\s*@(\w+)")
+
+
+class Route(NamedTuple):
+    intent: str
+    template_name: str
+    body: str
+
+
+class IntentRouter:
+    """Classifies prompts into intents with a compiled multi-pattern matcher.
+
+    Phrases are indexed by their first word. A prompt is lowercased once,
+    candidate positions are found with C-speed substring search on those
+    anchor words, and each candidate is confirmed with a precompiled
+    word-boundary pattern, so "withdrawal" never matches "draw". The
+    earliest confirmed phrase decides the intent. An explicit @template
+    tag decides the intent on its own.
+    """
+
+    def __init__(
+        self,
+        rules: Dict[str, List[str]] = None,
+        template_intents: Dict[str, str] = None,
+        default_intent: str = "text",
+    ):
+        self.rules = rules if rules is not None else DEFAULT_RULES
+        self.template_intents = (
+            template_intents if template_intents is not None else DEFAULT_TEMPLATE_INTENTS
+        )
+        self.default_intent = default_intent
+        self._anchors: Dict[str, List[Tuple[Pattern, str]]] = {}
+        for intent, phrases in self.rules.items():
+            for phrase in phrases:
+                words = phrase.lower().split()
+                self._anchors.setdefault(words[0], []).append((self._compile(words), intent))
+        for candidates in self._anchors.values():
+            # Longest phrases first so "draw" never shadows a longer match
+            candidates.sort(key=lambda candidate: len(candidate[0].pattern), reverse=True)
+
+    @staticmethod
+    def _compile(words: List[str]) -> Pattern:
+        # Any run of whitespace between words and an optional plural on the last one
+        return re.compile(r"\s+".join(re.escape(word) for word in words) + r"s?\b")
+
+    @classmethod
+    def from_env(cls) -> "IntentRouter":
+        """Build a router from the JSON file at INTENT_RULES_FILE, if set"""
+        path = os.getenv("INTENT_RULES_FILE")
+        if not path:
+            return cls()
+        with open(path, encoding="utf-8") as f:
+            config = json.load(f)
+        return cls(
+            rules=config.get("rules"),
+            template_intents=config.get("template_intents"),
+            default_intent=config.get("default_intent", "text"),
+        )
+
+    def _first_intent(self, text: str) -> Optional[str]:
+        best_pos, best_intent = len(text), None
+        for anchor, candidates in self._anchors.items():
+            pos = text.find(anchor, 0, best_pos)
+            while pos != -1:
+                if pos == 0 or not (text[pos - 1].isalnum() or text[pos - 1] == "_"):
+                    intent = next(
+                        (intent for pattern, intent in candidates if pattern.match(text, pos)),
+                        None,
+                    )
+                    if intent is not None:
+                        best_pos, best_intent = pos, intent
+                        break
+                pos = text.find(anchor, pos + 1, best_pos)
+        return best_intent
+
+    def classify(self, prompt: str, template_name: str = None) -> Route:
+        """Route a prompt; a template, given explicitly or as an @template tag, decides the intent on its own"""
+        tag = TEMPLATE_TAG.match(prompt)
+        if tag is not None:
+            template_name = template_name or tag.group(1).lower()
+            prompt = prompt[tag.end():].lstrip()
+        if template_name:
+            intent = self.template_intents.get(template_name.lower(), self.default_intent)
+            return Route(intent, template_name, prompt)
+        intent = self._first_intent(prompt.lower())
+        return Route(intent or self.default_intent, "", prompt)
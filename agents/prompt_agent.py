@@ -1,6 +1,9 @@
+import asyncio
 import logging
 import os
 import sys
+import time
+from contextlib import aclosing
 from typing import AsyncIterator, Dict, Any
 from dotenv import load_dotenv
 
@@ -9,15 +12,30 @@ sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Fallback implementation since sentient-agent-framework 0.1.1 doesn't have the expected classes
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Tuple
 
 class Session:
     def __init__(self, session_id: str = None):
         self.session_id = session_id
 
 class Query:
-    def __init__(self, prompt: str = ""):
+    def __init__(
+        self,
+        prompt: str = "",
+        image_count: int = 1,
+        template_name: Optional[str] = None,
+        hedge: Optional[bool] = None,
+        deadline: Optional["Deadline"] = None,
+        timing: bool = False,
+        max_tokens: int = 1000,
+    ):
         self.prompt = prompt
+        self.image_count = image_count
+        self.template_name = template_name
+        self.hedge = hedge
+        self.deadline = deadline
+        self.timing = timing
+        self.max_tokens = max_tokens
 
 class ResponseHandler:
     def __init__(self):
@@ -48,6 +66,20 @@ class StreamEventEmitter:
     async def complete(self):
         print(f"[{self.type} COMPLETE]")
 
+class TimingResponseHandler:
+    """Forwards to a handler, sending the request's trace as a TIMING event just before it completes"""
+
+    def __init__(self, handler: ResponseHandler, trace):
+        self._handler = handler
+        self._trace = trace
+
+    def __getattr__(self, name):
+        return getattr(self._handler, name)
+
+    async def complete(self):
+        await self._handler.emit_json("TIMING", self._trace.summary())
+        await self._handler.complete()
+
 class AbstractAgent(ABC):
     def __init__(self, name: str):
         self.name = name
@@ -57,24 +89,69 @@ class AbstractAgent(ABC):
         pass
 
 # Import providers using absolute path
+from providers.client_pool import ClientPool
 from providers.model_provider import ModelProvider
-from providers.prompt_provider import PromptProvider
+from providers.prompt_provider import CompiledTemplate, PromptProvider
+from providers.resilience import Deadline, ProviderError
+from agents.intent_router import IntentRouter, Route
+from monitoring import metrics, tracing
+from monitoring.tracing import Tracer
+from agents.session_store import SessionStore
 
 load_dotenv()
 logger = logging.getLogger(__name__)
 
 class PromptAgent(AbstractAgent):
-    def __init__(self, name: str = "Fireworks Prompt Agent"):
+    def __init__(
+        self,
+        name: str = "Fireworks Prompt Agent",
+        client_pool: ClientPool = None,
+        session_store: SessionStore = None,
+        tracer: Tracer = None,
+        prompt_provider: PromptProvider = None,
+    ):
         super().__init__(name)
         
         # Initialize model provider with Fireworks
         api_key = os.getenv("FIREWORKS_API_KEY")
         if not api_key:
             raise ValueError("FIREWORKS_API_KEY is not set")
-        self._model_provider = ModelProvider(api_key=api_key)
+        self._model_provider = ModelProvider(api_key=api_key, client_pool=client_pool)
         
         # Initialize prompt provider
-        self._prompt_provider = PromptProvider()
+        self._prompt_provider = prompt_provider or PromptProvider()
+
+        # Intent and @template routing
+        self._router = IntentRouter.from_env()
+
+        # Conversation history for non-default sessions
+        self._sessions = session_store or SessionStore.from_env()
+
+        # Per-request stage timings and sampled profiles
+        self._tracer = tracer or Tracer.from_env()
+
+    @property
+    def prompt_provider(self) -> PromptProvider:
+        return self._prompt_provider
+
+    async def prewarm(self):
+        """Warm provider clients in the background after startup"""
+        await self._model_provider.prewarm()
+
+    async def maintain(self, interval: float = 300):
+        """Purge the on-disk completion cache and prune the image store periodically until cancelled"""
+        jobs = []
+        if self._model_provider.cache is not None:
+            jobs.append(self._model_provider.cache.run(interval))
+        if self._model_provider.image_provider.image_store is not None:
+            jobs.append(self._model_provider.image_provider.image_store.run(interval))
+        await asyncio.gather(*jobs)
+
+    def close(self):
+        """Release resources held by the providers"""
+        self._model_provider.close()
+        self._sessions.close()
+        self._tracer.close()
 
     async def assist(
         self,
@@ -82,52 +159,96 @@ class PromptAgent(AbstractAgent):
         query: Query,
         response_handler: ResponseHandler
     ):
-        """Process user query with prompt templates using Fireworks AI"""
+        """Process user query with prompt templates using Fireworks AI.
+
+        query.timing appends the request's stage timings as a TIMING event.
+        """
+        with self._tracer.trace("assist", force=query.timing, session_id=session.session_id) as trace:
+            with tracing.span("intent"):
+                route = self._router.classify(query.prompt, query.template_name)
+            if trace is not None:
+                trace.attrs["intent"] = route.intent
+                if query.timing:
+                    response_handler = TimingResponseHandler(response_handler, trace)
+            metrics.STREAMS_IN_FLIGHT.inc("request")
+            try:
+                with metrics.timed(metrics.REQUEST_DURATION, route.intent):
+                    await self._process(session, query, route, response_handler)
+            finally:
+                metrics.STREAMS_IN_FLIGHT.dec("request")
+
+    async def _process(
+        self,
+        session: Session,
+        query: Query,
+        route: Route,
+        response_handler: ResponseHandler
+    ):
         try:
             # Check if this is an image generation request
-            if self._is_image_request(query.prompt):
-                await self._handle_image_generation(query.prompt, response_handler)
+            if route.intent == "image":
+                await self._handle_image_generation(route.body, response_handler, n=query.image_count)
                 return
 
-            # Extract template name if provided
-            template_name = self._extract_template_name(query.prompt)
-            
             # Get or create prompt template
             await response_handler.emit_text_block(
                 "PROCESSING", "🚀 Preparing prompt template with Fireworks AI..."
             )
             
-            if template_name:
-                prompt_template = await self._prompt_provider.get_template(template_name)
-                formatted_prompt = prompt_template.format(prompt=query.prompt)
+            template_name, formatted_prompt, prompt_template = await self._format_prompt(query, route)
+            if prompt_template is not None:
                 await response_handler.emit_json(
                     "TEMPLATE_INFO", 
                     {
                         "template_name": template_name,
-                        "template_format": prompt_template
+                        "template_format": prompt_template.source
+                    }
+                )
+
+            with tracing.span("history"):
+                history = await self._sessions.history(session.session_id, formatted_prompt)
+
+            # Filled by query_stream with the cache outcome and the backend that served
+            served = {}
+
+            async def emit_details():
+                # Sent with the first chunk: only then is it known which backend served it
+                await response_handler.emit_json(
+                    "PROMPT_DETAILS", 
+                    {
+                        "original_prompt": query.prompt,
+                        "formatted_prompt": formatted_prompt,
+                        "template_used": template_name or "none",
+                        "model_provider": served.get("provider", self._model_provider.provider),
+                        **{key: served[key] for key in ("cache", "cache_similarity") if key in served},
+                        "history_turns": len(history)
                     }
                 )
-            else:
-                formatted_prompt = query.prompt
-
-            # Show formatted prompt
-            await response_handler.emit_json(
-                "PROMPT_DETAILS", 
-                {
-                    "original_prompt": query.prompt,
-                    "formatted_prompt": formatted_prompt,
-                    "template_used": template_name or "none",
-                    "model_provider": os.getenv("MODEL_PROVIDER", "fireworks")
-                }
-            )
 
             # Stream response from Fireworks AI
             response_stream = response_handler.create_text_stream("AI_RESPONSE")
             
-            async for chunk in self._model_provider.query_stream(formatted_prompt):
-                await response_stream.emit_chunk(chunk)
+            response_parts = []
+            # Closed on exit, so a cancelled request tears down the upstream stream immediately
+            async with aclosing(self._model_provider.query_stream(
+                formatted_prompt, query.max_tokens, history=history, hedge=query.hedge,
+                deadline=query.deadline, template=template_name, text=route.body, served=served
+            )) as chunks:
+                async for chunk in chunks:
+                    if not response_parts:
+                        tracing.mark("first_chunk")
+                        await emit_details()
+                    response_parts.append(chunk)
+                    await response_stream.emit_chunk(chunk)
+            if not response_parts:
+                await emit_details()
             
             await response_stream.complete()
+            await self._sessions.record(session.session_id, formatted_prompt, "".join(response_parts))
+            await response_handler.complete()
+
+        except ProviderError as e:
+            await response_handler.emit_error("ERROR", e.to_dict())
             await response_handler.complete()
 
         except Exception as e:
@@ -137,45 +258,130 @@ class PromptAgent(AbstractAgent):
             )
             await response_handler.complete()
 
-    def _extract_template_name(self, prompt: str) -> str:
-        """Extract template name from prompt if specified with @ prefix"""
-        if prompt.startswith("@"):
-            parts = prompt.split(" ", 1)
-            return parts[0][1:].lower()  # Remove @ symbol and convert to lowercase
-        return ""
+    async def respond(self, session: Session, query: Query) -> Dict[str, Any]:
+        """Answer a text query in one piece with the backend's non-streaming call.
+
+        Returns the response text with template, provider, model, cache and
+        token usage details; query.timing adds the request's trace. Upstream
+        failures are raised as ProviderError. Image prompts are not handled
+        here; stream them through assist.
+        """
+        with self._tracer.trace("respond", force=query.timing, session_id=session.session_id) as trace:
+            with tracing.span("intent"):
+                route = self._router.classify(query.prompt, query.template_name)
+            metrics.STREAMS_IN_FLIGHT.inc("request")
+            try:
+                with metrics.timed(metrics.REQUEST_DURATION, route.intent):
+                    template_name, formatted_prompt, _ = await self._format_prompt(query, route)
+                    with tracing.span("history"):
+                        history = await self._sessions.history(session.session_id, formatted_prompt)
+                    result = await self._model_provider.complete(
+                        formatted_prompt, query.max_tokens, history=history,
+                        deadline=query.deadline, template=template_name, text=route.body,
+                    )
+                    await self._sessions.record(session.session_id, formatted_prompt, result["text"])
+            finally:
+                metrics.STREAMS_IN_FLIGHT.dec("request")
+
+        response = {
+            "response": result.pop("text"),
+            "template_used": template_name or "none",
+            "history_turns": len(history),
+            **result,
+        }
+        if trace is not None and query.timing:
+            response["trace"] = trace.summary()
+        return response
+
+    async def _format_prompt(self, query: Query, route: Route) -> Tuple[Optional[str], str, Optional[CompiledTemplate]]:
+        """Apply the route's template: the explicit one, else the @template tag if provided"""
+        template_name = route.template_name
+        if not template_name:
+            return None, query.prompt, None
+        with tracing.span("template", template=template_name):
+            prompt_template = await self._prompt_provider.get_template(template_name)
+            return template_name, prompt_template.render(route.body), prompt_template
 
-    def _is_image_request(self, prompt: str) -> bool:
-        """Check if the prompt is requesting image generation"""
-        image_keywords = ['generate image', 'create image', 'make a picture', 'draw', 'photo', 'visualize', 'image of', 'picture of']
-        prompt_lower = prompt.lower()
-        return any(keyword in prompt_lower for keyword in image_keywords)
+    def route(self, prompt: str, template_name: str = None) -> Route:
+        """Intent and template a prompt will be routed to"""
+        return self._router.classify(prompt, template_name)
 
-    async def _handle_image_generation(self, prompt: str, response_handler: ResponseHandler):
+    def intent(self, prompt: str, template_name: str = None) -> str:
+        """Intent a prompt will be routed to ("image" or "text")"""
+        return self.route(prompt, template_name).intent
+
+    def backends(self) -> Dict[str, dict]:
+        """Routing state of each text backend"""
+        return self._model_provider.router.snapshot()
+
+    def provider_name(self, prompt: str, template_name: str = None) -> str:
+        """Name of the upstream backend a prompt will be served by"""
+        if self.intent(prompt, template_name) == "image":
+            return "fireworks_image"
+        # The router's current pick; a hedge may still end up on another backend
+        return self._model_provider.router.ranked()[0]
+
+    async def _handle_image_generation(self, prompt: str, response_handler: ResponseHandler, n: int = 1):
         """Handle image generation requests"""
+        image_provider = self._model_provider.image_provider
+        n = max(1, min(n, int(os.getenv("IMAGE_MAX_VARIANTS", 4))))
         try:
             await response_handler.emit_text_block(
                 "PROCESSING", "🎨 Generating image prompt..."
             )
             
-            # Generate image using the image provider
-            image_result = await self._model_provider.image_provider.generate_image_from_text(prompt)
-            
-            if image_result and image_result.get("success"):
-                await response_handler.emit_json(
-                    "IMAGE_GENERATED", 
-                    {
-                        "image_url": image_result["url"],
-                        "prompt": image_result["prompt"],
-                        "type": "image"
-                    }
-                )
-            else:
-                error_msg = image_result.get("error", "Unknown error occurred") if image_result else "Failed to generate image"
+            # Stage 1: expand the user text into a detailed image prompt
+            expanded = await image_provider.expand_prompt(prompt)
+            if not expanded:
                 await response_handler.emit_error(
                     "IMAGE_ERROR", 
-                    {"message": f"Image generation failed: {error_msg}"}
+                    {"message": "Image generation failed: Failed to generate image prompt"}
                 )
-                
+                await response_handler.complete()
+                return
+
+            progress = {
+                "stage": "prompt_ready",
+                "prompt": expanded["prompt"],
+                "cached": expanded["cached"],
+                "variants": n
+            }
+            if "similarity" in expanded:
+                progress["similarity"] = expanded["similarity"]
+            await response_handler.emit_json("IMAGE_PROGRESS", progress)
+
+            # Stage 2: generate the variants concurrently, reporting each as it lands
+            variants = [
+                asyncio.create_task(image_provider.generate_image(expanded["prompt"], variant=i))
+                for i in range(n)
+            ]
+            started = time.monotonic()
+            try:
+                for next_result in asyncio.as_completed(variants):
+                    image_result = await next_result
+                    if image_result and image_result.get("success"):
+                        await response_handler.emit_json(
+                            "IMAGE_GENERATED", 
+                            {
+                                "image_url": image_result["url"],
+                                "prompt": image_result["prompt"],
+                                "variant": image_result["variant"],
+                                "cached": image_result["cached"],
+                                "type": "image"
+                            }
+                        )
+                    else:
+                        error_msg = image_result.get("error", "Unknown error occurred") if image_result else "Failed to generate image"
+                        await response_handler.emit_error(
+                            "IMAGE_ERROR", 
+                            {"message": f"Image generation failed: {error_msg}"}
+                        )
+            finally:
+                # Variants nobody is waiting for any more are abandoned
+                for variant in variants:
+                    variant.cancel()
+                tracing.record("image_variants", started, variants=n)
+
         except Exception as e:
             logger.error(f"Image generation error: {e}")
             await response_handler.emit_error(
@@ -183,4 +389,4 @@ class PromptAgent(AbstractAgent):
                 {"message": f"Image generation failed: {str(e)}"}
             )
         
-        await response_handler.complete()
\ No newline at end of file
+        await response_handler.complete()
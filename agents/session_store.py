@@ -0,0 +1,226 @@
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Tuple
+
+# Turns are stored as compact (role, content) tuples
+Turn = Tuple[str, str]
+
+# Session ids that are shared by anonymous clients and must never keep history
+STATELESS_SESSIONS = {"", "default"}
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token for English text)"""
+    return len(text) // 4 + 1
+
+
+class MemorySessionStore:
+    """In-memory conversation history with bounded turns and idle eviction"""
+
+    def __init__(self, max_turns: int = 20, max_chars: int = 12000, max_sessions: int = 50000, idle_ttl: float = 1800):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        # session_id -> (last_access, turns); ordered oldest access first
+        self._sessions: "OrderedDict[str, Tuple[float, deque]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def get_turns(self, session_id: str) -> List[Turn]:
+        entry = self._sessions.get(session_id)
+        if entry is None:
+            return []
+        self._sessions[session_id] = (time.time(), entry[1])
+        self._sessions.move_to_end(session_id)
+        return list(entry[1])
+
+    def extend(self, session_id: str, turns: List[Turn]):
+        now = time.time()
+        entry = self._sessions.get(session_id)
+        stored = entry[1] if entry is not None else deque(maxlen=self.max_turns)
+        stored.extend(turns)
+        # Drop the oldest turns once the session holds more than max_chars
+        chars = sum(len(content) for _, content in stored)
+        while chars > self.max_chars:
+            chars -= len(stored.popleft()[1])
+        self._sessions[session_id] = (now, stored)
+        self._sessions.move_to_end(session_id)
+        self.evict_idle(now)
+
+    def evict_idle(self, now: Optional[float] = None):
+        now = now or time.time()
+        while self._sessions:
+            session_id, (last_access, _) = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self.max_sessions and now - last_access < self.idle_ttl:
+                break
+            del self._sessions[session_id]
+
+    def close(self):
+        pass
+
+
+class SqliteSessionStore:
+    """Local sqlite conversation history with the same bounds as the memory store.
+
+    Calls block on disk, so SessionStore runs them in a worker thread.
+    """
+
+    def __init__(self, path: str, max_turns: int = 20, max_chars: int = 12000, idle_ttl: float = 1800):
+        self.max_turns = max_turns
+        self.max_chars = max_chars
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "session_id TEXT NOT NULL, seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session ON turns (session_id, seq)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions (session_id TEXT PRIMARY KEY, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_last_access ON sessions (last_access)")
+        # Databases written before the sessions table existed
+        self._conn.execute(
+            "INSERT OR IGNORE INTO sessions (session_id, last_access) "
+            "SELECT session_id, MAX(created_at) FROM turns GROUP BY session_id"
+        )
+        self._writes = 0
+
+    def get_turns(self, session_id: str) -> List[Turn]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT role, content FROM turns WHERE session_id = ? ORDER BY seq DESC LIMIT ?",
+                (session_id, self.max_turns),
+            ).fetchall()
+        return [(role, content) for role, content in reversed(rows)]
+
+    def extend(self, session_id: str, turns: List[Turn]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO turns (session_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                    [(session_id, role, content, now) for role, content in turns],
+                )
+                # Keep the newest turns within both max_turns and max_chars
+                self._conn.execute(
+                    "DELETE FROM turns WHERE seq IN (SELECT seq FROM ("
+                    "SELECT seq, ROW_NUMBER() OVER newest AS turn, SUM(LENGTH(content)) OVER newest AS chars "
+                    "FROM turns WHERE session_id = ? WINDOW newest AS (ORDER BY seq DESC)"
+                    ") WHERE turn > ? OR chars > ?)",
+                    (session_id, self.max_turns, self.max_chars),
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO sessions (session_id, last_access) VALUES (?, ?)",
+                    (session_id, now),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._writes += 1
+        if self._writes % 100 == 0:
+            self.evict_idle(now)
+
+    def evict_idle(self, now: Optional[float] = None):
+        cutoff = (now or time.time()) - self.idle_ttl
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM turns WHERE session_id IN "
+                    "(SELECT session_id FROM sessions WHERE last_access < ?)",
+                    (cutoff,),
+                )
+                self._conn.execute("DELETE FROM sessions WHERE last_access < ?", (cutoff,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class SessionStore:
+    """Conversation history keyed by session_id, assembled within a token budget.
+
+    Only about 4 characters per budget token can ever be sent upstream, so
+    backends keep at most that many characters per session.
+    """
+
+    def __init__(self, backend=None, token_budget: int = 3000):
+        self.backend = backend if backend is not None else MemorySessionStore(max_chars=token_budget * 4)
+        self.token_budget = token_budget
+
+    @classmethod
+    def from_env(cls) -> "SessionStore":
+        token_budget = int(os.getenv("SESSION_TOKEN_BUDGET", 3000))
+        max_turns = int(os.getenv("SESSION_MAX_TURNS", 20))
+        max_chars = int(os.getenv("SESSION_MAX_CHARS", token_budget * 4))
+        idle_ttl = float(os.getenv("SESSION_IDLE_TTL", 1800))
+        if os.getenv("SESSION_STORE", "memory") == "sqlite":
+            backend = SqliteSessionStore(
+                os.getenv("SESSION_DB_PATH", "sessions.db"),
+                max_turns=max_turns, max_chars=max_chars, idle_ttl=idle_ttl,
+            )
+        else:
+            backend = MemorySessionStore(
+                max_turns=max_turns,
+                max_chars=max_chars,
+                max_sessions=int(os.getenv("SESSION_MAX_SESSIONS", 50000)),
+                idle_ttl=idle_ttl,
+            )
+        return cls(backend, token_budget=token_budget)
+
+    @staticmethod
+    def is_stateful(session_id: Optional[str]) -> bool:
+        return session_id not in STATELESS_SESSIONS and session_id is not None
+
+    async def _call(self, method, *args):
+        # sqlite blocks on disk; the memory store is cheaper than a thread hop
+        if isinstance(self.backend, SqliteSessionStore):
+            return await asyncio.to_thread(method, *args)
+        return method(*args)
+
+    async def history(self, session_id: Optional[str], prompt: str) -> List[Dict[str, str]]:
+        """Return the most recent turns that fit in the budget alongside prompt"""
+        if not self.is_stateful(session_id):
+            return []
+        budget = self.token_budget - estimate_tokens(prompt)
+        selected = []
+        for role, content in reversed(await self._call(self.backend.get_turns, session_id)):
+            budget -= estimate_tokens(content)
+            if budget < 0:
+                break
+            selected.append({"role": role, "content": content})
+        selected.reverse()
+        # A conversation sent upstream must open with a user turn
+        while selected and selected[0]["role"] != "user":
+            selected.pop(0)
+        return selected
+
+    async def record(self, session_id: Optional[str], prompt: str, response: str):
+        """Store one completed exchange in a single write"""
+        if not self.is_stateful(session_id):
+            return
+        # No single turn longer than the whole budget could ever be sent back
+        limit = self.token_budget * 4
+        await self._call(
+            self.backend.extend, session_id, [("user", prompt[:limit]), ("assistant", response[:limit])]
+        )
+
+    def close(self):
+        self.backend.close()
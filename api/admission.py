@@ -0,0 +1,222 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional
+
+from monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+# Lower value is served first when requests queue for a slot
+PRIORITIES = {
+    ("interactive", "text"): 0,
+    ("interactive", "image"): 1,
+    ("batch", "text"): 2,
+    ("batch", "image"): 3,
+}
+
+
+class AdmissionRejected(Exception):
+    """Request shed before it reached the agent; surfaced as 429 with Retry-After"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"Request rejected ({reason}), retry after {retry_after:.1f}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class TokenBucket:
+    """Refills rate tokens per second up to burst"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Take cost tokens; returns 0 on success, else seconds until they are available"""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+
+class Ticket:
+    """An admitted request's slot; release() hands it to the next waiter"""
+
+    def __init__(self, controller: "AdmissionController"):
+        self._controller = controller
+        self._started = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._controller._release(time.monotonic() - self._started)
+
+
+class AdmissionController:
+    """Global in-flight limit, rate limits and a priority wait queue.
+
+    Requests past the in-flight limit wait in a bounded queue ordered by
+    priority class. A request is shed immediately when the queue is full or
+    when its estimated wait, based on the average time a slot is held,
+    exceeds max_wait.
+
+    The per-client rate limit is off unless client_rate is set: behind a
+    proxy every request shares the proxy's address. List the proxies in
+    trusted_proxies and clients are identified by X-Forwarded-For instead.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 64,
+        max_queue: int = 256,
+        max_wait: float = 10,
+        session_rate: float = 2,
+        session_burst: float = 10,
+        client_rate: float = 0,
+        client_burst: float = 40,
+        trusted_proxies: Iterable[str] = (),
+        max_buckets: int = 10000,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self.session_rate = session_rate
+        self.session_burst = session_burst
+        self.client_rate = client_rate
+        self.client_burst = client_burst
+        self.trusted_proxies = frozenset(trusted_proxies)
+        self.max_buckets = max_buckets
+        self.in_flight = 0
+        self._waiters = []
+        self._sequence = itertools.count()
+        self._buckets: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        # Running estimate of how long an admitted request holds its slot
+        self._hold_time = 1.0
+
+    @classmethod
+    def from_env(cls) -> "AdmissionController":
+        return cls(
+            max_in_flight=int(os.getenv("ADMISSION_MAX_IN_FLIGHT", 64)),
+            max_queue=int(os.getenv("ADMISSION_MAX_QUEUE", 256)),
+            max_wait=float(os.getenv("ADMISSION_MAX_WAIT", 10)),
+            session_rate=float(os.getenv("ADMISSION_SESSION_RATE", 2)),
+            session_burst=float(os.getenv("ADMISSION_SESSION_BURST", 10)),
+            client_rate=float(os.getenv("ADMISSION_CLIENT_RATE", 0)),
+            client_burst=float(os.getenv("ADMISSION_CLIENT_BURST", 40)),
+            trusted_proxies=[
+                address.strip() for address in os.getenv("ADMISSION_TRUSTED_PROXIES", "").split(",")
+                if address.strip()
+            ],
+        )
+
+    def client_id(self, peer: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+        """Address to rate limit: the peer, or the nearest untrusted X-Forwarded-For hop behind a trusted proxy"""
+        if peer in self.trusted_proxies and forwarded_for:
+            # Hops are appended left to right, so only the rightmost untrusted one can't be spoofed
+            for hop in reversed(forwarded_for.split(",")):
+                hop = hop.strip()
+                if hop and hop not in self.trusted_proxies:
+                    return hop
+        return peer
+
+    def _bucket(self, key: str, rate: float, burst: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate, burst)
+            if len(self._buckets) > self.max_buckets:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+    def check_rate(self, session_id: Optional[str] = None, client: Optional[str] = None):
+        """Charge one request to the session and client buckets or raise AdmissionRejected"""
+        checks = []
+        if client and self.client_rate > 0:
+            checks.append(("client_rate", self._bucket(f"client:{client}", self.client_rate, self.client_burst)))
+        # The shared "default" session is not a real client identity
+        if session_id and session_id != "default" and self.session_rate > 0:
+            checks.append(("session_rate", self._bucket(f"session:{session_id}", self.session_rate, self.session_burst)))
+        for reason, bucket in checks:
+            wait = bucket.take()
+            if wait:
+                metrics.ADMISSION.inc(reason)
+                raise AdmissionRejected(reason, wait)
+
+    def estimated_wait(self) -> float:
+        """Expected queueing time for a request joining the back of the queue"""
+        return (len(self._waiters) + 1) / self.max_in_flight * self._hold_time
+
+    async def acquire(self, priority: int = 0) -> Ticket:
+        """Wait for an in-flight slot, or raise AdmissionRejected when overloaded"""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self.in_flight += 1
+            metrics.ADMISSION.inc("admitted")
+            return Ticket(self)
+
+        wait = self.estimated_wait()
+        if len(self._waiters) >= self.max_queue:
+            metrics.ADMISSION.inc("queue_full")
+            raise AdmissionRejected("queue_full", wait)
+        if wait > self.max_wait:
+            metrics.ADMISSION.inc("overloaded")
+            raise AdmissionRejected("overloaded", wait)
+
+        future = asyncio.get_running_loop().create_future()
+        entry = [priority, next(self._sequence), future]
+        heapq.heappush(self._waiters, entry)
+        metrics.ADMISSION_QUEUE.set(value=len(self._waiters))
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.max_wait)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if future.done() and not future.cancelled():
+                # The slot was handed over just as we gave up; pass it on
+                self._release(None)
+            else:
+                future.cancel()
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            metrics.ADMISSION_QUEUE.set(value=len(self._waiters))
+            if isinstance(e, asyncio.CancelledError):
+                raise
+            metrics.ADMISSION.inc("timeout")
+            raise AdmissionRejected("timeout", self.estimated_wait())
+        metrics.ADMISSION.inc("queued")
+        return Ticket(self)
+
+    def _release(self, held: Optional[float]):
+        if held is not None:
+            self._hold_time = 0.8 * self._hold_time + 0.2 * held
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                # Hand the slot straight to the next waiter; in_flight is unchanged
+                future.set_result(None)
+                metrics.ADMISSION_QUEUE.set(value=len(self._waiters))
+                return
+        metrics.ADMISSION_QUEUE.set(value=0)
+        self.in_flight -= 1
+
+    def snapshot(self) -> dict:
+        """Current load, for /health"""
+        return {
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "estimated_wait": round(self.estimated_wait(), 3),
+        }
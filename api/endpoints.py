@@ -1,102 +1,296 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, WebSocket
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import asyncio
 import json
-from typing import AsyncGenerator
 import sys
 import os
+import time
+from typing import Optional
 
 # Add project root to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 # Use absolute import
 try:
-    from agents.prompt_agent import PromptAgent
+    from agents.prompt_agent import PromptAgent, Session, Query
 except ImportError:
     # Fallback
-    from sentient_image_agent.agents.prompt_agent import PromptAgent
+    from sentient_image_agent.agents.prompt_agent import PromptAgent, Session, Query
+
+from api.admission import PRIORITIES, AdmissionController, AdmissionRejected
+from api.multiplex import MultiplexConnection
+from api.streaming import FRAME_FORMATS, CollectingResponseHandler, SSEResponseHandler, StreamRegistry
+from models.schemas import BatchRequest, ChatRequest, ChatResponse
+from monitoring import metrics
+from providers.resilience import CircuitOpenError, Deadline, DeadlineExceeded, ProviderError
 
 router = APIRouter()
-agent = PromptAgent(name="Fireworks Chat Agent")
 
-@router.post("/chat")
-async def chat_endpoint(request: dict):
-    """Simple chat endpoint (non-streaming)"""
-    try:
-        prompt = request.get("prompt", "")
-        session_id = request.get("session_id", "default")
-        
-        # For demo purposes - in real implementation, use the agent properly
-        return {"response": "Streaming endpoint available at /stream"}
-    
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
 
-@router.get("/stream")
-async def stream_response(prompt: str, session_id: str = "default"):
-    """SSE endpoint for streaming responses"""
-    async def event_generator():
-        try:
-            # Initialize the agent
-            agent = PromptAgent(name="Fireworks Chat Agent")
-            
-            # Create mock session and query
-            session = Session(session_id=session_id)
-            query = Query(prompt=prompt)
-            
-            # Create custom response handler for SSE
-            class SSEResponseHandler:
-                def __init__(self):
-                    pass
-                
-                async def emit_text_block(self, type: str, text: str):
-                    yield f"data: {json.dumps({'type': type, 'data': text})}\n\n"
-                
-                async def emit_json(self, type: str, data: dict):
-                    yield f"data: {json.dumps({'type': type, 'data': data})}\n\n"
-                
-                async def emit_error(self, type: str, data: dict):
-                    yield f"data: {json.dumps({'type': type, 'data': data})}\n\n"
-                
-                def create_text_stream(self, type: str):
-                    return SSEStreamEmitter(type)
-                
-                async def complete(self):
-                    yield f"data: {json.dumps({'type': 'DONE', 'data': {}})}\n\n"
-            
-            class SSEStreamEmitter:
-                def __init__(self, type: str):
-                    self.type = type
-                
-                async def emit_chunk(self, chunk: str):
-                    yield f"data: {json.dumps({'type': 'AI_RESPONSE_CHUNK', 'data': chunk})}\n\n"
-                
-                async def complete(self):
-                    pass
-            
-            # Process the query with real agent
-            handler = SSEResponseHandler()
-            await agent.assist(session, query, handler)
-            
-        except Exception as e:
-            yield f"data: {json.dumps({'type': 'ERROR', 'data': {'message': str(e)}})}\n\n"
-    
+def get_agent(request: Request) -> PromptAgent:
+    """Return the shared agent created in the app lifespan"""
+    agent = request.app.state.agent
+    if agent is None:
+        raise HTTPException(status_code=503, detail="Agent is not configured")
+    return agent
+
+
+def get_admission(request: Request) -> AdmissionController:
+    """Return the worker's admission controller"""
+    return request.app.state.admission
+
+
+def client_address(request: Request) -> Optional[str]:
+    peer = request.client.host if request.client else None
+    return get_admission(request).client_id(peer, request.headers.get("x-forwarded-for"))
+
+
+def rejected(e: AdmissionRejected) -> HTTPException:
+    return HTTPException(
+        status_code=429,
+        detail={"message": str(e), "reason": e.reason},
+        headers={"Retry-After": e.retry_after_header},
+    )
+
+
+def provider_failed(e: ProviderError) -> HTTPException:
+    if isinstance(e, DeadlineExceeded):
+        status_code = 504
+    elif isinstance(e, CircuitOpenError):
+        status_code = 503
+    else:
+        status_code = 502
+    return HTTPException(status_code=status_code, detail=e.to_dict())
+
+
+def get_streams(request: Request) -> StreamRegistry:
+    """Return the registry of resumable streams"""
+    return request.app.state.streams
+
+
+def sse_response(frames, stream_id: str) -> StreamingResponse:
     return StreamingResponse(
-        event_generator(),
+        frames,
         media_type="text/event-stream",
         headers={
             "Cache-Control": "no-cache",
             "Connection": "keep-alive",
+            "X-Stream-ID": stream_id,
         }
     )
 
+@router.post("/chat", response_model=ChatResponse, response_model_exclude_none=True)
+async def chat_endpoint(
+    request: ChatRequest,
+    http_request: Request,
+    agent: PromptAgent = Depends(get_agent),
+    admission: AdmissionController = Depends(get_admission),
+):
+    """Non-streaming chat: the whole answer as one JSON document.
+
+    Text prompts use the backend's non-streaming completion call, with no
+    SSE framing and no connection held open per token; image prompts run
+    the image pipeline and return its images. timing=true adds the
+    per-stage spans to the timing field.
+    """
+    started = time.monotonic()
+    if request.template_name and not await agent.prompt_provider.has_template(request.template_name):
+        raise HTTPException(status_code=422, detail=f"Unknown template: {request.template_name}")
+
+    # Same routing as the agent: an explicit template decides the intent on its own
+    route = agent.route(request.prompt, request.template_name)
+    intent = route.intent
+    try:
+        admission.check_rate(request.session_id, client_address(http_request))
+        ticket = await admission.acquire(PRIORITIES[("interactive", intent)])
+    except AdmissionRejected as e:
+        raise rejected(e)
+    admitted = time.monotonic()
+
+    session = Session(session_id=request.session_id)
+    query = Query(
+        prompt=request.prompt,
+        image_count=request.image_count,
+        template_name=request.template_name,
+        deadline=Deadline.from_env(total=request.timeout),
+        timing=request.timing,
+        max_tokens=request.max_tokens,
+    )
+    try:
+        if intent == "image":
+            handler = CollectingResponseHandler()
+            await agent.assist(session, query, handler)
+            if not handler.images:
+                raise HTTPException(status_code=502, detail=handler.errors or "No image was generated")
+            # Variants that failed are reported next to the ones that succeeded
+            result = {
+                "images": handler.images,
+                "errors": handler.errors or None,
+                "template_used": route.template_name or "none",
+            }
+            if handler.trace is not None:
+                result["trace"] = handler.trace
+        else:
+            result = await agent.respond(session, query)
+    except ProviderError as e:
+        raise provider_failed(e)
+    finally:
+        ticket.release()
+
+    finished = time.monotonic()
+    timing = {
+        "queue_ms": round((admitted - started) * 1000, 3),
+        "total_ms": round((finished - started) * 1000, 3),
+    }
+    trace = result.pop("trace", None)
+    if trace is not None:
+        timing["spans"] = trace["spans"]
+    return ChatResponse(session_id=request.session_id, timing=timing, **result)
+
+@router.get("/stream")
+async def stream_response(
+    request: Request,
+    prompt: str,
+    session_id: str = "default",
+    image_count: int = 1,
+    hedge: Optional[bool] = None,
+    connect_timeout: Optional[float] = None,
+    first_token_timeout: Optional[float] = None,
+    timeout: Optional[float] = None,
+    frames: str = "coalesced",
+    timing: bool = False,
+    last_event_id: Optional[str] = None,
+    agent: PromptAgent = Depends(get_agent),
+    admission: AdmissionController = Depends(get_admission),
+    streams: StreamRegistry = Depends(get_streams),
+):
+    """SSE endpoint for streaming responses
+
+    frames=token sends one frame per model delta instead of coalescing them.
+    timing=true ends the stream with a TIMING event breaking down where the time went.
+    A reconnect carrying Last-Event-ID (header or last_event_id parameter)
+    resumes the original generation rather than starting a new one.
+    """
+    if frames not in FRAME_FORMATS:
+        raise HTTPException(status_code=422, detail=f"frames must be one of {', '.join(FRAME_FORMATS)}")
+
+    last_event_id = request.headers.get("last-event-id") or last_event_id
+    if last_event_id:
+        try:
+            stream_id, last_seq = StreamRegistry.parse_event_id(last_event_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Malformed Last-Event-ID")
+        handler = streams.get(stream_id)
+        if handler is not None and handler.can_resume(last_seq):
+            metrics.STREAM_RESUMES.inc("resumed")
+            return sse_response(
+                handler.subscribe(last_seq, is_disconnected=request.is_disconnected, frame_format=frames),
+                stream_id,
+            )
+        # Expired or evicted: fall through and generate the response again
+        metrics.STREAM_RESUMES.inc("expired")
+    session = Session(session_id=session_id)
+    query = Query(
+        prompt=prompt,
+        image_count=image_count,
+        hedge=hedge,
+        deadline=Deadline.from_env(connect_timeout, first_token_timeout, timeout),
+        timing=timing,
+    )
+
+    # Shed load before any work starts; the slot is held until generation ends
+    try:
+        admission.check_rate(session_id, client_address(request))
+        ticket = await admission.acquire(PRIORITIES[("interactive", agent.intent(prompt))])
+    except AdmissionRejected as e:
+        raise rejected(e)
+
+    # The agent records numbered events that this and any resumed connection follow
+    handler = streams.register(SSEResponseHandler(frame_format=frames))
+    handler.start(agent.assist(session, query, handler)).add_done_callback(lambda _: ticket.release())
+
+    return sse_response(
+        handler.subscribe(0, is_disconnected=request.is_disconnected),
+        handler.stream_id,
+    )
+
+@router.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket):
+    """Multiplex many concurrent prompts over one WebSocket; see MultiplexConnection"""
+    agent = websocket.app.state.agent
+    if agent is None:
+        await websocket.close(code=1013, reason="Agent is not configured")
+        return
+    await MultiplexConnection(websocket, agent, websocket.app.state.admission).run()
+
+@router.post("/batch")
+async def batch_endpoint(
+    request: BatchRequest,
+    http_request: Request,
+    agent: PromptAgent = Depends(get_agent),
+    admission: AdmissionController = Depends(get_admission),
+):
+    """Run many prompts concurrently and stream results as NDJSON in completion order.
+
+    Items are independent: running concurrently, they neither read nor
+    extend the session's history, which would make results depend on
+    scheduling. session_id only identifies the caller for rate limiting.
+    """
+    max_items = int(os.getenv("BATCH_MAX_ITEMS", 500))
+    if len(request.prompts) > max_items:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {max_items} prompts")
+    # The batch is charged once; its items then queue behind interactive traffic
+    try:
+        admission.check_rate(request.session_id, client_address(http_request))
+    except AdmissionRejected as e:
+        raise rejected(e)
+
+    concurrency = int(os.getenv("BATCH_CONCURRENCY", 8))
+    limits = {}
+
+    async def run_item(index: int, item) -> dict:
+        # Each upstream backend gets its own concurrency cap
+        provider = agent.provider_name(item.prompt, item.template_name)
+        semaphore = limits.setdefault(provider, asyncio.Semaphore(concurrency))
+        async with semaphore:
+            try:
+                ticket = await admission.acquire(PRIORITIES[("batch", agent.intent(item.prompt, item.template_name))])
+            except AdmissionRejected as e:
+                return {
+                    "index": index,
+                    "status": "error",
+                    "errors": [{"type": "REJECTED", "message": str(e), "retry_after": e.retry_after}],
+                }
+            try:
+                handler = CollectingResponseHandler()
+                await agent.assist(
+                    Session(),
+                    Query(prompt=item.prompt, template_name=item.template_name),
+                    handler,
+                )
+            finally:
+                ticket.release()
+        return {"index": index, **handler.result()}
+
+    async def results():
+        tasks = [
+            asyncio.create_task(run_item(index, item))
+            for index, item in enumerate(request.prompts)
+        ]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                yield json.dumps(await next_result) + "\n"
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @router.get("/templates")
-async def list_templates():
+async def list_templates(request: Request, agent: PromptAgent = Depends(get_agent)):
     """Get available prompt templates"""
-    return {
-        "templates": {
-            "creative": "Creative writing template",
-            "technical": "Technical explanation template",
-            "simple": "Simple direct response",
-            "detailed": "Detailed analysis template"
-        }
-    }
\ No newline at end of file
+    templates = await agent.prompt_provider.catalog()
+    etag = agent.prompt_provider.etag
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return JSONResponse({"templates": templates}, headers={"ETag": etag})
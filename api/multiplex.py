@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import os
+from contextlib import aclosing
+from typing import Dict, Optional
+
+from fastapi import WebSocket, WebSocketDisconnect
+from pydantic import ValidationError
+
+from agents.prompt_agent import PromptAgent, Query, Session
+from api.admission import PRIORITIES, AdmissionController, AdmissionRejected
+from api.streaming import FRAME_FORMATS, SSEResponseHandler, encode_json
+from models.schemas import StreamRequest
+from monitoring import metrics
+from providers.resilience import Deadline
+
+logger = logging.getLogger(__name__)
+
+
+class MultiplexConnection:
+    """Serves many concurrent prompts over one WebSocket.
+
+    Client messages are JSON objects with an "op":
+      {"op": "prompt", "id": ..., "prompt": ..., ...}  start a request
+      {"op": "cancel", "id": ...}                      cancel one request
+    Every server message is {"id", "seq", "type", "data"}, using the same
+    event types as the SSE endpoint; a request ends with DONE, CANCELLED
+    or REJECTED; a prompt that is invalid or reuses a live id is REJECTED.
+    Any other message that cannot be handled (binary, not JSON, no string
+    id, unknown op) gets an ERROR reply and the connection stays open.
+
+    Outgoing frames from all requests share one bounded send queue, so a
+    slow socket applies backpressure to every request on it and through
+    them to the upstream reads.
+    """
+
+    def __init__(self, websocket: WebSocket, agent: PromptAgent, admission: AdmissionController):
+        self.websocket = websocket
+        self.agent = agent
+        self.admission = admission
+        self.max_requests = int(os.getenv("WS_MAX_REQUESTS", 16))
+        self._outgoing: asyncio.Queue = asyncio.Queue(maxsize=int(os.getenv("WS_SEND_QUEUE", 256)))
+        self._requests: Dict[str, asyncio.Task] = {}
+
+    @property
+    def client(self) -> Optional[str]:
+        peer = self.websocket.client.host if self.websocket.client else None
+        return self.admission.client_id(peer, self.websocket.headers.get("x-forwarded-for"))
+
+    async def _send(self, request_id: Optional[str], type: str, data, seq: int = 0):
+        await self._outgoing.put(encode_json({"id": request_id, "seq": seq, "type": type, "data": data}))
+
+    async def _write(self):
+        while True:
+            frame = await self._outgoing.get()
+            await self.websocket.send_text(frame.decode())
+
+    async def run(self):
+        await self.websocket.accept()
+        metrics.STREAMS_IN_FLIGHT.inc("websocket")
+        writer = asyncio.create_task(self._write())
+        try:
+            while True:
+                frame = await self.websocket.receive()
+                if frame["type"] == "websocket.disconnect":
+                    break
+                if frame.get("text") is None:
+                    await self._send(None, "ERROR", {"message": "Binary frames are not supported"})
+                    continue
+                try:
+                    message = json.loads(frame["text"])
+                except ValueError:
+                    await self._send(None, "ERROR", {"message": "Messages must be JSON objects"})
+                    continue
+                try:
+                    await self._dispatch(message)
+                except Exception as e:
+                    # One bad message must not take down the other requests on this socket
+                    logger.warning(f"Rejected malformed WebSocket message: {e}")
+                    await self._send(None, "ERROR", {"message": "Malformed message"})
+        except WebSocketDisconnect:
+            pass
+        finally:
+            for task in self._requests.values():
+                task.cancel()
+            writer.cancel()
+            metrics.STREAMS_IN_FLIGHT.dec("websocket")
+
+    async def _dispatch(self, message):
+        if not isinstance(message, dict):
+            await self._send(None, "ERROR", {"message": "Messages must be JSON objects"})
+            return
+        op = message.get("op")
+        request_id = message.get("id")
+        if not isinstance(request_id, str):
+            await self._send(None, "ERROR", {"message": "Messages need a string id"})
+            return
+        if op == "cancel":
+            task = self._requests.get(request_id)
+            if task is not None:
+                task.cancel()
+            return
+        if op != "prompt":
+            await self._send(request_id, "ERROR", {"message": f"Unknown op: {op}"})
+            return
+
+        # A prompt that never starts still ends with REJECTED, like one refused by admission
+        try:
+            request = StreamRequest(**message)
+        except ValidationError as e:
+            await self._send(request_id, "REJECTED", {
+                "message": "Invalid prompt request", "reason": "invalid_request", "errors": e.errors(),
+            })
+            return
+        if request.frames not in FRAME_FORMATS:
+            await self._send(request.id, "REJECTED", {
+                "message": f"frames must be one of {', '.join(FRAME_FORMATS)}", "reason": "invalid_request",
+            })
+        elif request.id in self._requests:
+            await self._send(request.id, "REJECTED", {
+                "message": "Request id is already in use", "reason": "duplicate_id",
+            })
+        elif len(self._requests) >= self.max_requests:
+            await self._send(request.id, "REJECTED", {
+                "message": f"At most {self.max_requests} concurrent requests per connection",
+                "reason": "connection_limit",
+            })
+        else:
+            self._requests[request.id] = asyncio.create_task(self._serve(request))
+
+    async def _serve(self, request: StreamRequest):
+        handler = None
+        try:
+            try:
+                self.admission.check_rate(request.session_id, self.client)
+                ticket = await self.admission.acquire(
+                    PRIORITIES[("interactive", self.agent.intent(request.prompt, request.template_name))]
+                )
+            except AdmissionRejected as e:
+                await self._send(request.id, "REJECTED", {
+                    "message": str(e), "reason": e.reason, "retry_after": e.retry_after,
+                })
+                return
+
+            # No reconnect can resume a socket request, so stop as soon as it is abandoned
+            handler = SSEResponseHandler(frame_format=request.frames, resume_grace=0)
+            query = Query(
+                prompt=request.prompt,
+                image_count=request.image_count,
+                template_name=request.template_name,
+                hedge=request.hedge,
+                deadline=Deadline.from_env(total=request.timeout),
+                timing=request.timing,
+            )
+            handler.start(
+                self.agent.assist(Session(session_id=request.session_id), query, handler)
+            ).add_done_callback(lambda _: ticket.release())
+            last_type, last_seq = None, 0
+            async with aclosing(handler.events()) as events:
+                async for last_seq, last_type, data in events:
+                    await self._send(request.id, last_type, data, last_seq)
+            if last_type != "DONE":
+                # The producer failed outside the agent; still tell the client this request is over
+                await self._send(request.id, "DONE", {}, last_seq + 1)
+        except asyncio.CancelledError:
+            if handler is not None:
+                handler.cancel()
+            try:
+                # The socket may already be gone; never block on a full queue here
+                self._outgoing.put_nowait(encode_json({"id": request.id, "seq": 0, "type": "CANCELLED", "data": {}}))
+            except asyncio.QueueFull:
+                pass
+        except Exception as e:
+            logger.error(f"WebSocket request {request.id} failed: {e}")
+            await self._send(request.id, "ERROR", {"message": str(e)})
+            await self._send(request.id, "DONE", {})
+        finally:
+            self._requests.pop(request.id, None)
@@ -0,0 +1,472 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Tuple
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from monitoring import metrics
+
+logger = logging.getLogger(__name__)
+
+# Frame formats a client can ask for: deltas merged per window, or one frame per delta
+FRAME_FORMATS = ("coalesced", "token")
+
+
+def encode_json(data) -> bytes:
+    """Compact JSON encoding, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(data)
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False).encode()
+
+
+# Pre-encoded `data: {"type":"...","data":` prefixes, one per event type
+_ENVELOPES: Dict[str, bytes] = {}
+
+
+def encode_frame(type: str, data) -> bytes:
+    envelope = _ENVELOPES.get(type)
+    if envelope is None:
+        envelope = _ENVELOPES[type] = b'data: {"type":' + encode_json(type) + b',"data":'
+    return envelope + encode_json(data) + b"}\n\n"
+
+
+class SSEResponseHandler:
+    """Response handler that records a generation as numbered SSE events.
+
+    The agent runs as a producer task appending to a bounded ring buffer;
+    each connection follows it with its own cursor, so every emit reaches
+    the client as soon as it is made. While clients are attached the
+    producer waits once it is max_queue_size events ahead of the slowest
+    of them, which in turn slows the upstream read. A client whose next
+    event has already left the buffer gets an ERROR event and is ended.
+
+    Every frame carries an `id: <stream_id>:<seq>` field. A client that
+    reconnects with that id resumes from the buffer, or follows the
+    generation if it is still running, instead of starting a new one. A
+    generation nobody is attached to is cancelled after resume_grace;
+    meanwhile it stays paced by the last cursor that left, so it pauses
+    rather than reading the rest of the upstream response.
+
+    Text deltas are merged into one frame per coalesce window or byte
+    threshold; the first delta of a connection is always sent on its own.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int = None,
+        frame_format: str = "coalesced",
+        coalesce_window: float = None,
+        coalesce_bytes: int = None,
+        stream_id: str = None,
+        max_events: int = None,
+        resume_grace: float = None,
+    ):
+        if max_queue_size is None:
+            max_queue_size = int(os.getenv("SSE_QUEUE_SIZE", 64))
+        if coalesce_window is None:
+            coalesce_window = float(os.getenv("SSE_COALESCE_MS", 20)) / 1000
+        if coalesce_bytes is None:
+            coalesce_bytes = int(os.getenv("SSE_COALESCE_BYTES", 2048))
+        if max_events is None:
+            max_events = int(os.getenv("STREAM_BUFFER_EVENTS", 2048))
+        if resume_grace is None:
+            resume_grace = float(os.getenv("STREAM_RESUME_GRACE", 10))
+        if frame_format not in FRAME_FORMATS:
+            raise ValueError(f"Unknown SSE frame format: {frame_format}")
+        self.stream_id = stream_id or uuid.uuid4().hex
+        self._id_prefix = f"id: {self.stream_id}:".encode()
+        self.max_queue_size = max_queue_size
+        self.frame_format = frame_format
+        self.coalesce_window = coalesce_window
+        self.coalesce_bytes = coalesce_bytes
+        self.resume_grace = resume_grace
+        self.disconnect_poll = float(os.getenv("SSE_DISCONNECT_POLL", 1.0))
+        # (seq, type, data, chunk), oldest first; seq starts at 1
+        self._events: deque = deque(maxlen=max(max_events, max_queue_size))
+        self._next_seq = 1
+        # Last seq handed to each attached connection
+        self._cursors: Dict[object, int] = {}
+        # Backpressure bound while nobody is attached and the stream waits to be resumed
+        self._parked: Optional[int] = None
+        self._appended = asyncio.Event()
+        self._consumed = asyncio.Event()
+        self._closed = False
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+        self.task: Optional[asyncio.Task] = None
+        self.finished_at: Optional[float] = None
+        self.cancelled = False
+
+    @property
+    def done(self) -> bool:
+        return self._closed
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._cursors)
+
+    def _notify(self, event_name: str):
+        # Wake everyone waiting on the current event and arm a fresh one
+        event = getattr(self, event_name)
+        setattr(self, event_name, asyncio.Event())
+        event.set()
+
+    async def _put(self, type: str, data, chunk: bool = False) -> None:
+        if self._closed:
+            return
+        while True:
+            slowest = min(self._cursors.values()) if self._cursors else self._parked
+            if slowest is None or self._next_seq - 1 - slowest < self.max_queue_size:
+                break
+            await self._consumed.wait()
+            if self._closed:
+                return
+        self._append(type, data, chunk)
+
+    def _append(self, type: str, data, chunk: bool = False):
+        self._events.append((self._next_seq, type, data, chunk))
+        self._next_seq += 1
+        self._notify("_appended")
+
+    async def emit_text_block(self, type: str, text: str):
+        await self._put(type, text)
+
+    async def emit_json(self, type: str, data: dict):
+        await self._put(type, data)
+
+    async def emit_error(self, type: str, data: dict):
+        await self._put(type, data)
+
+    def create_text_stream(self, type: str):
+        return SSEStreamEmitter(self, type)
+
+    async def complete(self):
+        if self._closed:
+            return
+        await self._put("DONE", {})
+        await self._close()
+
+    async def _close(self):
+        if not self._closed:
+            self._closed = True
+            self.finished_at = time.monotonic()
+            self._notify("_appended")
+            self._notify("_consumed")
+
+    async def _run(self, producer: Awaitable) -> None:
+        try:
+            await producer
+        except Exception as e:
+            logger.error(f"Stream producer error: {e}")
+            await self._put("ERROR", {"message": str(e)})
+        except asyncio.CancelledError:
+            if not self._closed:
+                self.cancelled = True
+                # Never end a truncated answer silently; backpressure no longer applies
+                self._append("ERROR", {"message": "The response was cancelled before it finished", "code": "stream_abandoned"})
+            raise
+        finally:
+            await self._close()
+
+    def start(self, producer: Awaitable) -> asyncio.Task:
+        """Run producer in the background, recording everything it emits"""
+        self.task = asyncio.create_task(self._run(producer))
+        if self.resume_grace > 0:
+            # Also covers a client that never attaches at all
+            self._parked = 0
+            self._abandon_handle = asyncio.get_running_loop().call_later(self.resume_grace, self._abandon)
+        return self.task
+
+    def cancel(self):
+        if self.task is not None and not self.task.done():
+            self.task.cancel()
+
+    def can_resume(self, last_seq: int) -> bool:
+        """Whether every event after last_seq is still buffered and the generation was not cancelled"""
+        if self.cancelled:
+            return False
+        first_seq = self._events[0][0] if self._events else self._next_seq
+        return first_seq - 1 <= last_seq < self._next_seq
+
+    def _lagged(self, cursor: int) -> bool:
+        """Whether the event following cursor has already been evicted"""
+        return bool(self._events) and cursor + 1 < self._events[0][0]
+
+    def _event_after(self, cursor: int):
+        """Buffered event following cursor, or None if it has not been emitted yet.
+
+        Callers check _lagged first; an evicted cursor has no next event.
+        """
+        if cursor + 1 >= self._next_seq:
+            return None
+        return self._events[cursor + 1 - self._events[0][0]]
+
+    def _frame(self, seq: int, type: str, data) -> bytes:
+        return self._id_prefix + str(seq).encode() + b"\n" + encode_frame(type, data)
+
+    def _attach(self, token: object, cursor: int):
+        self._cursors[token] = cursor
+        self._parked = None
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+
+    def _detach(self, token: object):
+        cursor = self._cursors.pop(token, None)
+        if cursor is None:
+            return
+        self._notify("_consumed")
+        if self.subscribers or self._closed:
+            return
+        if self.resume_grace > 0:
+            self._parked = cursor
+            self._abandon_handle = asyncio.get_running_loop().call_later(self.resume_grace, self._abandon)
+        else:
+            self._abandon()
+
+    def _abandon(self):
+        self._abandon_handle = None
+        if not self.subscribers and not self._closed:
+            logger.info(f"Nobody resumed stream {self.stream_id}; cancelling it")
+            self.cancel()
+
+    async def _watch(
+        self, token: object, gone: asyncio.Event, is_disconnected: Callable[[], Awaitable[bool]]
+    ):
+        """Detach this connection as soon as its client has gone away"""
+        while not self._closed:
+            await asyncio.sleep(self.disconnect_poll)
+            if await is_disconnected():
+                logger.info(f"Client disconnected from stream {self.stream_id}")
+                metrics.CLIENT_DISCONNECTS.inc("stream")
+                # Detach now; the response generator may be stuck in a write for a while
+                gone.set()
+                self._detach(token)
+                self._notify("_appended")
+                return
+
+    async def _wait(self, gone: asyncio.Event, deadline: float = None) -> bool:
+        """Wait for the next event; False if the deadline passed first"""
+        timeout = None if deadline is None else deadline - time.monotonic()
+        if timeout is not None and timeout <= 0:
+            return False
+        waiter = self._appended
+        if gone.is_set() or self._closed:
+            return True
+        try:
+            if hasattr(asyncio, "timeout"):
+                # Unlike wait_for on 3.11, never swallows a cancel of this task
+                async with asyncio.timeout(timeout):
+                    await waiter.wait()
+            else:
+                await asyncio.wait_for(waiter.wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def events(
+        self,
+        last_seq: int = 0,
+        is_disconnected: Callable[[], Awaitable[bool]] = None,
+        frame_format: str = None,
+    ) -> AsyncIterator[Tuple[int, str, Any]]:
+        """Yield (seq, type, data) for every event after last_seq, following the live tail.
+
+        is_disconnected (e.g. Request.is_disconnected) is polled so a
+        dropped connection detaches promptly rather than on its next write.
+        """
+        coalesce = (frame_format or self.frame_format) == "coalesced" and self.coalesce_window > 0
+        gone = asyncio.Event()
+        token = object()
+        self._attach(token, last_seq)
+        watcher = asyncio.create_task(self._watch(token, gone, is_disconnected)) if is_disconnected else None
+        cursor = last_seq
+        last_flush: Dict[str, float] = {}
+        try:
+            while not gone.is_set():
+                if self._lagged(cursor):
+                    logger.warning(f"Subscriber of stream {self.stream_id} fell out of the buffer at {cursor}")
+                    yield cursor, "ERROR", {
+                        "message": "Stream buffer overrun; events were dropped before they could be sent",
+                        "code": "stream_lagged",
+                    }
+                    break
+                event = self._event_after(cursor)
+                if event is None:
+                    if self._closed:
+                        break
+                    await self._wait(gone)
+                    continue
+                seq, type, data, chunk = event
+                cursor = seq
+                if chunk and coalesce and type in last_flush:
+                    parts = [data]
+                    size = len(data)
+                    deadline = last_flush[type] + self.coalesce_window
+                    while size < self.coalesce_bytes and not gone.is_set() and not self._lagged(cursor):
+                        following = self._event_after(cursor)
+                        if following is None:
+                            if self._closed or not await self._wait(gone, deadline):
+                                break
+                            continue
+                        if not following[3] or following[1] != type:
+                            break
+                        cursor = following[0]
+                        parts.append(following[2])
+                        size += len(following[2])
+                    data = "".join(parts)
+                if chunk:
+                    # The first delta goes out immediately so time-to-first-token is unchanged
+                    last_flush[type] = time.monotonic()
+                if token in self._cursors:
+                    self._cursors[token] = cursor
+                    self._notify("_consumed")
+                yield cursor, type, data
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self._detach(token)
+
+    async def subscribe(
+        self,
+        last_seq: int = 0,
+        is_disconnected: Callable[[], Awaitable[bool]] = None,
+        frame_format: str = None,
+    ) -> AsyncIterator[bytes]:
+        """SSE frames for every event after last_seq, following the live tail"""
+        async with aclosing(self.events(last_seq, is_disconnected, frame_format)) as events:
+            async for seq, type, data in events:
+                yield self._frame(seq, type, data)
+
+
+class StreamRegistry:
+    """Recent streams by id, so dropped connections can resume them.
+
+    Finished streams stay resumable for ttl seconds. Past max_streams the
+    oldest are forgotten; they keep running but can no longer be resumed.
+    """
+
+    def __init__(self, ttl: float = 60, max_streams: int = 1000):
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self._streams: "OrderedDict[str, SSEResponseHandler]" = OrderedDict()
+
+    @classmethod
+    def from_env(cls) -> "StreamRegistry":
+        return cls(
+            ttl=float(os.getenv("STREAM_RESUME_TTL", 60)),
+            max_streams=int(os.getenv("STREAM_MAX_RESUMABLE", 1000)),
+        )
+
+    def __len__(self) -> int:
+        return len(self._streams)
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [
+            stream_id for stream_id, handler in self._streams.items()
+            if handler.finished_at is not None and now - handler.finished_at > self.ttl
+        ]
+        for stream_id in expired:
+            del self._streams[stream_id]
+        while len(self._streams) > self.max_streams:
+            self._streams.popitem(last=False)
+
+    def register(self, handler: SSEResponseHandler) -> SSEResponseHandler:
+        self._streams[handler.stream_id] = handler
+        self._purge()
+        return handler
+
+    def get(self, stream_id: str) -> Optional[SSEResponseHandler]:
+        self._purge()
+        return self._streams.get(stream_id)
+
+    @staticmethod
+    def parse_event_id(event_id: str) -> Tuple[str, int]:
+        """Split a `<stream_id>:<seq>` event id; raises ValueError if malformed"""
+        stream_id, _, seq = event_id.strip().rpartition(":")
+        if not stream_id:
+            raise ValueError(f"Malformed event id: {event_id}")
+        return stream_id, int(seq)
+
+
+class SSEStreamEmitter:
+    def __init__(self, handler: SSEResponseHandler, type: str):
+        self._handler = handler
+        self.type = type
+
+    async def emit_chunk(self, chunk: str):
+        await self._handler._put(f"{self.type}_CHUNK", chunk, chunk=True)
+
+    async def complete(self):
+        pass
+
+
+class CollectingResponseHandler:
+    """Response handler that aggregates a whole response in memory"""
+
+    def __init__(self):
+        self.text_parts = []
+        self.details = {}
+        self.images = []
+        self.errors = []
+        self.trace = None
+        self.completed = False
+
+    async def emit_text_block(self, type: str, text: str):
+        pass
+
+    async def emit_json(self, type: str, data: dict):
+        if type == "PROMPT_DETAILS":
+            self.details = data
+        elif type == "IMAGE_GENERATED":
+            self.images.append(data)
+        elif type == "TIMING":
+            self.trace = data
+
+    async def emit_error(self, type: str, data: dict):
+        self.errors.append({"type": type, **data})
+
+    def create_text_stream(self, type: str):
+        return CollectingStreamEmitter(self)
+
+    async def complete(self):
+        self.completed = True
+
+    @property
+    def text(self) -> str:
+        return "".join(self.text_parts)
+
+    def result(self) -> dict:
+        result = {"status": "error" if self.errors else "ok"}
+        if self.text_parts:
+            result["response"] = self.text
+        if self.images:
+            result["images"] = self.images
+        if self.details:
+            result["template_used"] = self.details.get("template_used")
+            result["cache"] = self.details.get("cache")
+            if "cache_similarity" in self.details:
+                result["cache_similarity"] = self.details["cache_similarity"]
+        if self.errors:
+            result["errors"] = self.errors
+        return result
+
+
+class CollectingStreamEmitter:
+    def __init__(self, handler: CollectingResponseHandler):
+        self._handler = handler
+
+    async def emit_chunk(self, chunk: str):
+        self._handler.text_parts.append(chunk)
+
+    async def complete(self):
+        pass
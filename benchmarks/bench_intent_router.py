@@ -0,0 +1,50 @@
+"""Micro-benchmark: compiled intent router vs the old per-keyword scan.
+
+Run with: python -m benchmarks.bench_intent_router
+"""
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents.intent_router import IntentRouter
+
+OLD_KEYWORDS = ['generate image', 'create image', 'make a picture', 'draw', 'photo', 'visualize', 'image of', 'picture of']
+
+
+def keyword_scan(prompt: str) -> bool:
+    """The previous _is_image_request implementation"""
+    prompt_lower = prompt.lower()
+    return any(keyword in prompt_lower for keyword in OLD_KEYWORDS)
+
+
+def build_prompts():
+    filler = "Explain the tradeoffs of eventual consistency in distributed databases. "
+    return {
+        "short_text": "@technical explain withdrawal limits",
+        "long_text_10kb": filler * 140,
+        "long_image_tail_10kb": filler * 140 + "then draw a diagram",
+        "long_image_head_10kb": "picture of a lighthouse at dusk. " + filler * 140,
+    }
+
+
+def main(number: int = 2000):
+    router = IntentRouter()
+    results = {}
+    for name, prompt in build_prompts().items():
+        old = min(timeit.repeat(lambda: keyword_scan(prompt), number=number, repeat=5)) / number
+        new = min(timeit.repeat(lambda: router.classify(prompt), number=number, repeat=5)) / number
+        results[name] = {
+            "chars": len(prompt),
+            "keyword_scan_us": round(old * 1e6, 2),
+            "router_us": round(new * 1e6, 2),
+            "router_intent": router.classify(prompt).intent,
+            "keyword_scan_image": keyword_scan(prompt),
+        }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
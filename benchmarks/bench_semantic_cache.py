@@ -0,0 +1,80 @@
+"""Micro-benchmark: semantic cache lookups against a large index.
+
+Fills the index with synthetic prompts, then times lookups for
+near-duplicates (reordered, re-cased, extra punctuation) and for unrelated
+prompts, and reports the hit rate for each.
+
+Run with: python -m benchmarks.bench_semantic_cache --entries 100000
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from providers.semantic_cache import SemanticCache
+
+
+def make_vocabulary(rng: random.Random, size: int = 5000):
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    return ["".join(rng.choice(letters) for _ in range(rng.randint(3, 9))) for _ in range(size)]
+
+
+def perturb(rng: random.Random, prompt: str) -> str:
+    """A near-duplicate: shuffled word order, random casing and punctuation"""
+    words = prompt.split()
+    rng.shuffle(words)
+    words = [word.upper() if rng.random() < 0.2 else word for word in words]
+    return "  ".join(words) + rng.choice(["", "!", "?", "."])
+
+
+def time_lookups(cache: SemanticCache, queries):
+    timings, hits = [], 0
+    for query in queries:
+        started = time.perf_counter()
+        match = cache.lookup("bench", query)
+        timings.append(time.perf_counter() - started)
+        hits += match is not None
+    timings.sort()
+    return {
+        "hit_rate": round(hits / len(queries), 3),
+        "p50_us": round(statistics.median(timings) * 1e6, 1),
+        "p99_us": round(timings[int(len(timings) * 0.99)] * 1e6, 1),
+        "mean_us": round(statistics.fmean(timings) * 1e6, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--threshold", type=float, default=0.85)
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    vocabulary = make_vocabulary(rng)
+    prompts = [" ".join(rng.choices(vocabulary, k=rng.randint(4, 14))) for _ in range(args.entries)]
+
+    cache = SemanticCache(threshold=args.threshold, max_entries=args.entries)
+    started = time.perf_counter()
+    for index, prompt in enumerate(prompts):
+        cache.add("bench", prompt, str(index))
+    build = time.perf_counter() - started
+
+    near = [perturb(rng, rng.choice(prompts)) for _ in range(args.queries)]
+    unrelated = [" ".join(rng.choices(vocabulary, k=rng.randint(4, 14))) for _ in range(args.queries)]
+    report = {
+        "entries": len(cache),
+        "build_us_per_entry": round(build / args.entries * 1e6, 1),
+        "near_duplicates": time_lookups(cache, near),
+        "unrelated": time_lookups(cache, unrelated),
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
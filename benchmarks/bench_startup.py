@@ -0,0 +1,102 @@
+"""Cold-start benchmark: import time, time to healthy, and time to first token.
+
+Each run starts a fresh interpreter, so nothing is shared between samples.
+Run with: python -m benchmarks.bench_startup --runs 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+from benchmarks.load_test import PROJECT_ROOT, free_port, start_process, wait_ready
+
+
+def import_time() -> float:
+    """Seconds to import the app module in a fresh interpreter"""
+    code = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True, check=True,
+        env={"FIREWORKS_API_KEY": "benchmark", "PATH": ""},
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+async def first_token(base_url: str) -> float:
+    started = time.perf_counter()
+    async with httpx.AsyncClient(timeout=60) as client:
+        async with client.stream("GET", f"{base_url}/api/stream", params={"prompt": "startup probe"}) as response:
+            async for line in response.aiter_lines():
+                if '"AI_RESPONSE_CHUNK"' in line:
+                    return time.perf_counter() - started
+    raise RuntimeError("stream ended without a token")
+
+
+async def server_start(provider_port: int, prewarm: bool) -> dict:
+    """Seconds from spawning the server until /health answers, then until the first token"""
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = start_process(
+        ["-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        {
+            "FIREWORKS_API_KEY": "benchmark",
+            "FIREWORKS_BASE_URL": f"http://127.0.0.1:{provider_port}",
+            "MODEL_PROVIDER": "fireworks",
+            "MODEL_PROVIDERS": "",
+            "COMPLETION_CACHE": "false",
+            "PREWARM_CLIENTS": "true" if prewarm else "false",
+            "IMAGE_STORE_DIR": "",
+        },
+    )
+    try:
+        await wait_ready(f"{base_url}/health", interval=0.01)
+        healthy = time.perf_counter() - started
+        return {"healthy": healthy, "first_token": healthy + await first_token(base_url)}
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+
+def summary(values) -> dict:
+    return {"median": round(statistics.median(values), 4), "min": round(min(values), 4), "max": round(max(values), 4)}
+
+
+async def run(args) -> dict:
+    report = {"import_main": summary([import_time() for _ in range(args.runs)])}
+    provider_port = free_port()
+    provider = start_process(
+        ["-m", "benchmarks.fake_provider", "--port", str(provider_port), "--ttft", "0", "--tokens", "5"], {}
+    )
+    try:
+        await wait_ready(f"http://127.0.0.1:{provider_port}/docs")
+        for prewarm in (False, True):
+            samples = [await server_start(provider_port, prewarm) for _ in range(args.runs)]
+            label = "prewarm" if prewarm else "cold"
+            report[f"{label}_healthy"] = summary([s["healthy"] for s in samples])
+            report[f"{label}_first_token"] = summary([s["first_token"] for s in samples])
+    finally:
+        provider.terminate()
+        provider.wait(timeout=10)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""Local stand-in for the Fireworks/OpenAI-compatible chat and image APIs.
+
+Streams synthetic tokens with a configurable time-to-first-token, token
+rate and error rate so the serving path can be benchmarked offline.
+
+Run with: python -m benchmarks.fake_provider --port 9100 --ttft 0.2 --token-rate 50
+Point the app at it with FIREWORKS_BASE_URL=http://127.0.0.1:9100 or
+OPENAI_BASE_URL=http://127.0.0.1:9100/v1.
+"""
+import argparse
+import asyncio
+import base64
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 1x1 transparent PNG
+PIXEL_PNG = base64.b64encode(
+    bytes.fromhex(
+        "89504e470d0a1a0a0000000d49484452000000010000000108060000001f15c489"
+        "0000000d49444154789c63000100000500010d0a2db40000000049454e44ae426082"
+    )
+).decode()
+
+
+class FakeProviderConfig:
+    def __init__(self, ttft: float = 0.2, token_rate: float = 50, tokens: int = 100,
+                 error_rate: float = 0.0, image_latency: float = 1.0):
+        self.ttft = ttft
+        self.token_rate = token_rate
+        self.tokens = tokens
+        self.error_rate = error_rate
+        self.image_latency = image_latency
+
+
+def create_app(config: FakeProviderConfig) -> FastAPI:
+    app = FastAPI(title="Fake provider")
+
+    def injected_error():
+        if config.error_rate and random.random() < config.error_rate:
+            return JSONResponse(
+                {"error": {"message": "injected failure", "type": "server_error"}}, status_code=503
+            )
+        return None
+
+    def chunk(completion_id: str, model: str, content: str = None, finish: str = None) -> str:
+        delta = {"content": content} if content is not None else {}
+        payload = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish}],
+        }
+        return f"data: {json.dumps(payload)}\n\n"
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        model = body.get("model", "fake-model")
+        tokens = min(config.tokens, body.get("max_tokens") or config.tokens)
+        completion_id = f"fake-{random.getrandbits(32):08x}"
+
+        if not body.get("stream"):
+            await asyncio.sleep(config.ttft + tokens / config.token_rate)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": " ".join(f"tok{i}" for i in range(tokens))},
+                    "finish_reason": "length",
+                }],
+                "usage": {"prompt_tokens": 10, "completion_tokens": tokens, "total_tokens": tokens + 10},
+            }
+
+        async def events():
+            await asyncio.sleep(config.ttft)
+            interval = 1 / config.token_rate if config.token_rate else 0
+            for i in range(tokens):
+                yield chunk(completion_id, model, f"tok{i} ")
+                if interval:
+                    await asyncio.sleep(interval)
+            yield chunk(completion_id, model, finish="length")
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def image_generations(request: Request):
+        await request.json()
+        error = injected_error()
+        if error is not None:
+            return error
+        await asyncio.sleep(config.image_latency)
+        return {"created": int(time.time()), "data": [{"b64_json": PIXEL_PNG}]}
+
+    for prefix in ("/v1", "/inference/v1"):
+        app.add_api_route(f"{prefix}/chat/completions", chat_completions, methods=["POST"])
+        app.add_api_route(f"{prefix}/images/generations", image_generations, methods=["POST"])
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--ttft", type=float, default=0.2, help="seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=50, help="tokens per second")
+    parser.add_argument("--tokens", type=int, default=100, help="tokens per completion")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests answered with 503")
+    parser.add_argument("--image-latency", type=float, default=1.0, help="seconds per image")
+    args = parser.parse_args()
+    config = FakeProviderConfig(args.ttft, args.token_rate, args.tokens, args.error_rate, args.image_latency)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
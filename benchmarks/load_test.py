@@ -0,0 +1,331 @@
+"""Offline load test of the serving path against the local fake provider.
+
+Starts benchmarks.fake_provider and the app in subprocesses, drives the
+chosen endpoint with N concurrent clients and prints a JSON report with
+throughput, latency percentiles, and server CPU/memory per stream.
+
+Run with: python -m benchmarks.load_test --clients 50 --requests 500
+Save a baseline with --output baseline.json and check a later run against
+it with --compare baseline.json (exits non-zero on regression).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List, Optional
+
+import httpx
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metrics where a larger value is a regression, and those where smaller is
+LOWER_IS_BETTER = ("ttft_p50", "ttft_p99", "total_p50", "total_p99", "cpu_ms_per_stream", "rss_mb")
+HIGHER_IS_BETTER = ("requests_per_sec", "chunks_per_sec")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+def process_usage(pid: int) -> Dict[str, float]:
+    """CPU seconds and resident memory of a process, read from /proc (Linux only)"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return {"cpu_seconds": cpu, "rss_mb": rss_kb / 1024}
+    except (OSError, StopIteration, ValueError):
+        return {}
+
+
+async def wait_ready(url: str, timeout: float = 20, interval: float = 0.1):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            try:
+                await client.get(url)
+                return
+            except httpx.TransportError:
+                await asyncio.sleep(interval)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def start_process(args: List[str], env: Dict[str, str]) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, *args], cwd=PROJECT_ROOT, env={**os.environ, **env},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def stream_once(client: httpx.AsyncClient, base_url: str, prompt: str, frames: str) -> Dict[str, float]:
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    errors = 0
+    async with client.stream("GET", f"{base_url}/api/stream", params={"prompt": prompt, "frames": frames}) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith("data: "):
+                continue
+            event = json.loads(line[6:])
+            if event["type"] == "AI_RESPONSE_CHUNK":
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks += 1
+            elif event["type"] == "ERROR":
+                errors += 1
+    return {"ttft": ttft, "total": time.perf_counter() - started, "chunks": chunks, "errors": errors}
+
+
+async def chat_once(client: httpx.AsyncClient, base_url: str, prompt: str) -> Dict[str, float]:
+    started = time.perf_counter()
+    response = await client.post(f"{base_url}/api/chat", json={"prompt": prompt})
+    elapsed = time.perf_counter() - started
+    ok = response.status_code == 200
+    # The whole answer arrives at once, so its first token is the response time
+    return {"ttft": elapsed if ok else None, "total": elapsed, "chunks": 1 if ok else 0, "errors": 0 if ok else 1}
+
+
+class WsConnection:
+    """One multiplexed /api/ws socket shared by several workers; routes replies by request id"""
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pending: Dict[str, asyncio.Queue] = {}
+        self.reader = asyncio.create_task(self._read())
+
+    async def _read(self):
+        try:
+            async for raw in self.websocket:
+                message = json.loads(raw)
+                queue = self.pending.get(message["id"])
+                if queue is not None:
+                    queue.put_nowait(message)
+        finally:
+            # Fail whatever is still waiting rather than hanging the run
+            for queue in self.pending.values():
+                queue.put_nowait({"type": "CLOSED"})
+
+    async def close(self):
+        await self.websocket.close()
+        await self.reader
+
+
+async def ws_once(connection: WsConnection, prompt: str, frames: str) -> Dict[str, float]:
+    request_id = uuid.uuid4().hex
+    queue = connection.pending[request_id] = asyncio.Queue()
+    started = time.perf_counter()
+    ttft = None
+    chunks = 0
+    errors = 0
+    try:
+        await connection.websocket.send(
+            json.dumps({"op": "prompt", "id": request_id, "prompt": prompt, "frames": frames})
+        )
+        while True:
+            message = await queue.get()
+            if message["type"] == "AI_RESPONSE_CHUNK":
+                if ttft is None:
+                    ttft = time.perf_counter() - started
+                chunks += 1
+            elif message["type"] in ("ERROR", "REJECTED", "CLOSED"):
+                errors += 1
+            if message["type"] in ("DONE", "CANCELLED", "REJECTED", "CLOSED"):
+                break
+    finally:
+        del connection.pending[request_id]
+    return {"ttft": ttft, "total": time.perf_counter() - started, "chunks": chunks, "errors": errors}
+
+
+async def batch_once(client: httpx.AsyncClient, base_url: str, prompts: List[str]) -> List[Dict[str, float]]:
+    started = time.perf_counter()
+    results = []
+    body = {"prompts": [{"prompt": prompt} for prompt in prompts]}
+    async with client.stream("POST", f"{base_url}/api/batch", json=body) as response:
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            item = json.loads(line)
+            elapsed = time.perf_counter() - started
+            results.append({
+                "ttft": elapsed,
+                "total": elapsed,
+                "chunks": 1 if item.get("response") else 0,
+                "errors": 0 if item["status"] == "ok" else 1,
+            })
+    return results
+
+
+async def drive(args, base_url: str, clients: int, requests: int) -> List[Dict[str, float]]:
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    queue: asyncio.Queue = asyncio.Queue()
+    # Unique prompts so the completion cache and single-flight never short-circuit
+    run_id = random.getrandbits(32)
+    for i in range(requests):
+        queue.put_nowait(f"benchmark {run_id} request {i}")
+    results: List[Dict[str, float]] = []
+    connections: List[WsConnection] = []
+    if args.mode == "ws":
+        import websockets
+
+        ws_url = base_url.replace("http://", "ws://", 1) + "/api/ws"
+        for _ in range(min(clients, args.ws_connections)):
+            connections.append(WsConnection(await websockets.connect(ws_url, max_size=None)))
+
+    async with httpx.AsyncClient(timeout=120, limits=limits) as client:
+        async def worker(index: int):
+            while not queue.empty():
+                if args.mode == "ws":
+                    connection = connections[index % len(connections)]
+                    results.append(await ws_once(connection, queue.get_nowait(), args.frames))
+                elif args.mode == "batch":
+                    prompts = [queue.get_nowait() for _ in range(min(args.batch_size, queue.qsize()))]
+                    results.extend(await batch_once(client, base_url, prompts))
+                elif args.mode == "chat":
+                    results.append(await chat_once(client, base_url, queue.get_nowait()))
+                else:
+                    results.append(await stream_once(client, base_url, queue.get_nowait(), args.frames))
+
+        try:
+            await asyncio.gather(*(worker(index) for index in range(clients)))
+        finally:
+            for connection in connections:
+                await connection.close()
+    return results
+
+
+def summarize(results: List[Dict[str, float]], elapsed: float, usage_before: dict, usage_after: dict) -> dict:
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    totals = [r["total"] for r in results]
+    report = {
+        "requests": len(results),
+        "errors": sum(1 for r in results if r["errors"] or r["ttft"] is None),
+        "elapsed_sec": round(elapsed, 3),
+        "requests_per_sec": round(len(results) / elapsed, 2),
+        "chunks_per_sec": round(sum(r["chunks"] for r in results) / elapsed, 2),
+    }
+    for name, values in (("ttft", ttfts), ("total", totals)):
+        for p in (50, 90, 99):
+            value = percentile(values, p)
+            report[f"{name}_p{p}"] = round(value, 4) if value is not None else None
+    if usage_before and usage_after:
+        cpu = usage_after["cpu_seconds"] - usage_before["cpu_seconds"]
+        report["cpu_ms_per_stream"] = round(cpu * 1000 / max(1, len(results)), 3)
+        report["rss_mb"] = round(usage_after["rss_mb"], 1)
+        report["rss_mb_per_stream"] = round(
+            max(0.0, usage_after["rss_mb"] - usage_before["rss_mb"]) / max(1, len(results)), 4
+        )
+    return report
+
+
+def compare(report: dict, baseline: dict, tolerance: float) -> List[str]:
+    regressions = []
+    for key in LOWER_IS_BETTER:
+        if report.get(key) is not None and baseline.get(key):
+            if report[key] > baseline[key] * (1 + tolerance):
+                regressions.append(f"{key}: {report[key]} > baseline {baseline[key]}")
+    for key in HIGHER_IS_BETTER:
+        if report.get(key) is not None and baseline.get(key):
+            if report[key] < baseline[key] * (1 - tolerance):
+                regressions.append(f"{key}: {report[key]} < baseline {baseline[key]}")
+    return regressions
+
+
+async def run(args) -> dict:
+    provider_port, app_port = free_port(), free_port()
+    provider = start_process([
+        "-m", "benchmarks.fake_provider", "--port", str(provider_port),
+        "--ttft", str(args.ttft), "--token-rate", str(args.token_rate),
+        "--tokens", str(args.tokens), "--error-rate", str(args.error_rate),
+    ], {})
+    app = start_process(
+        ["-m", "uvicorn", "main:app", "--port", str(app_port), "--log-level", "warning"],
+        {
+            "FIREWORKS_API_KEY": "benchmark",
+            "FIREWORKS_BASE_URL": f"http://127.0.0.1:{provider_port}",
+            "OPENAI_BASE_URL": f"http://127.0.0.1:{provider_port}/v1",
+            "MODEL_PROVIDER": "fireworks",
+            "MODEL_PROVIDERS": "",
+            "COMPLETION_CACHE": "false",
+            "SESSION_STORE": "memory",
+            "IMAGE_STORE_DIR": "",
+        },
+    )
+    base_url = f"http://127.0.0.1:{app_port}"
+    try:
+        await wait_ready(f"http://127.0.0.1:{provider_port}/docs")
+        await wait_ready(f"{base_url}/health")
+        # Warm up connections and imports before measuring
+        await drive(args, base_url, min(4, args.clients), min(8, args.requests))
+        usage_before = process_usage(app.pid)
+        started = time.perf_counter()
+        results = await drive(args, base_url, args.clients, args.requests)
+        elapsed = time.perf_counter() - started
+        usage_after = process_usage(app.pid)
+    finally:
+        for process in (app, provider):
+            process.terminate()
+            process.wait(timeout=10)
+
+    report = summarize(results, elapsed, usage_before, usage_after)
+    report["config"] = {
+        key: getattr(args, key)
+        for key in (
+            "mode", "frames", "clients", "requests", "batch_size", "ws_connections",
+            "ttft", "token_rate", "tokens", "error_rate",
+        )
+    }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mode", choices=("stream", "batch", "chat", "ws"), default="stream")
+    parser.add_argument("--frames", choices=("coalesced", "token"), default="coalesced")
+    parser.add_argument("--clients", type=int, default=20, help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=200, help="total prompts")
+    parser.add_argument("--batch-size", type=int, default=50, help="prompts per /api/batch call")
+    parser.add_argument(
+        "--ws-connections", type=int, default=4, help="sockets the ws mode multiplexes its clients over"
+    )
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--token-rate", type=float, default=200)
+    parser.add_argument("--tokens", type=int, default=100)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    parser.add_argument("--compare", help="baseline JSON report to check against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,75 @@
+// Runs many prompts concurrently over one WebSocket (see /api/ws)
+class MultiplexClient {
+  constructor(url) {
+    this.url = url;
+    this.ready = null;
+    this.requests = new Map();
+    this.nextId = 1;
+  }
+
+  connect() {
+    if (this.ready) return this.ready;
+
+    this.ready = new Promise((resolve, reject) => {
+      const socket = new WebSocket(this.url);
+      socket.onopen = () => resolve(socket);
+      socket.onerror = () => reject(new Error("WebSocket connection failed"));
+      socket.onmessage = (message) => this.dispatch(JSON.parse(message.data));
+      socket.onclose = () => {
+        this.ready = null;
+        for (const request of this.requests.values()) {
+          request.reject(new Error("WebSocket closed"));
+        }
+        this.requests.clear();
+      };
+    });
+    this.ready.catch(() => {
+      this.ready = null;
+    });
+    return this.ready;
+  }
+
+  dispatch(frame) {
+    const request = this.requests.get(frame.id);
+    if (!request) {
+      if (frame.type === "ERROR") console.error("WebSocket error:", frame.data);
+      return;
+    }
+
+    if (frame.type === "CANCELLED" || frame.type === "REJECTED") {
+      this.requests.delete(frame.id);
+      request.reject(new Error(frame.data.message || frame.type));
+      return;
+    }
+
+    request.onEvent(frame);
+    if (frame.type === "DONE") {
+      this.requests.delete(frame.id);
+      request.resolve();
+    }
+  }
+
+  // Resolves once the request is done; frames have the same {type, data} shape as SSE events
+  async request(params, onEvent) {
+    const socket = await this.connect();
+    const id = String(this.nextId++);
+
+    return new Promise((resolve, reject) => {
+      this.requests.set(id, { onEvent, resolve, reject });
+      socket.send(JSON.stringify({ op: "prompt", id, ...params }));
+    });
+  }
+
+  async cancel(id) {
+    const socket = await this.connect();
+    socket.send(JSON.stringify({ op: "cancel", id }));
+  }
+}
+
 class SentientChat {
   constructor() {
     this.apiBase = "http://localhost:8000";
+    this.socket = new MultiplexClient(`${this.apiBase.replace(/^http/, "ws")}/api/ws`);
     this.init();
   }
 
@@ -55,49 +124,36 @@ class SentientChat {
       // Show loading state
       const loadingMessage = this.addMessage("ai", "Thinking...", true);
 
-      // Call API
-      const response = await fetch(
-        `${this.apiBase}/api/stream?prompt=${encodeURIComponent(prompt)}`
-      );
-
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`);
-      }
-
-      // Process streaming response
-      const reader = response.body.getReader();
-      const decoder = new TextDecoder();
       let aiResponse = "";
       let isImageResponse = false;
 
-      while (true) {
-        const { done, value } = await reader.read();
-        if (done) break;
-
-        const chunk = decoder.decode(value);
-        const lines = chunk.split("\n\n");
-
-        for (const line of lines) {
-          if (line.startsWith("data: ")) {
-            try {
-              const data = JSON.parse(line.slice(6));
-
-              // Check if this is an image response
-              if (this.processChunkData(data)) {
-                isImageResponse = true;
-                loadingMessage.remove();
-                continue;
-              }
+      const onEvent = (data) => {
+        // Check if this is an image response
+        if (this.processChunkData(data)) {
+          isImageResponse = true;
+          loadingMessage.remove();
+          return;
+        }
 
-              if (data.type === "AI_RESPONSE_CHUNK") {
-                aiResponse += data.data;
-                this.updateLastMessage(aiResponse);
-              }
-            } catch (e) {
-              console.log("Raw chunk:", line);
-            }
-          }
+        if (data.type === "AI_RESPONSE_CHUNK") {
+          aiResponse += data.data;
+          this.updateLastMessage(aiResponse);
         }
+      };
+
+      // Share one WebSocket between concurrent prompts; fall back to SSE if it is unavailable
+      let socketReady = false;
+      try {
+        await this.socket.connect();
+        socketReady = true;
+      } catch (e) {
+        console.warn("WebSocket unavailable, using SSE:", e);
+      }
+      if (socketReady) {
+        await this.socket.request({ prompt }, onEvent);
+      } else {
+        // Resume from the last event id if the connection drops mid-stream
+        await this.streamEvents(prompt, onEvent);
       }
 
       // If it was a text response and we have content, remove loading
@@ -113,6 +169,65 @@ class SentientChat {
     }
   }
 
+  async streamEvents(prompt, onEvent, maxRetries = 3) {
+    let lastEventId = null;
+    let finished = false;
+
+    for (let attempt = 0; !finished; attempt++) {
+      let url = `${this.apiBase}/api/stream?prompt=${encodeURIComponent(prompt)}`;
+      if (lastEventId) {
+        url += `&last_event_id=${encodeURIComponent(lastEventId)}`;
+      }
+
+      try {
+        const response = await fetch(url);
+        if (!response.ok) {
+          throw new Error(`HTTP error! status: ${response.status}`);
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = "";
+
+        while (true) {
+          const { done, value } = await reader.read();
+          if (done) break;
+
+          // Events end with a blank line; keep any partial event for the next read
+          buffer += decoder.decode(value, { stream: true });
+          const events = buffer.split("\n\n");
+          buffer = events.pop();
+
+          for (const event of events) {
+            let data = null;
+            for (const line of event.split("\n")) {
+              if (line.startsWith("id: ")) {
+                lastEventId = line.slice(4);
+              } else if (line.startsWith("data: ")) {
+                data = line.slice(6);
+              }
+            }
+            if (data === null) continue;
+
+            try {
+              const parsed = JSON.parse(data);
+              if (parsed.type === "DONE") finished = true;
+              onEvent(parsed);
+            } catch (e) {
+              console.log("Raw chunk:", data);
+            }
+          }
+        }
+        // A stream that closed cleanly without DONE is treated as complete
+        finished = true;
+      } catch (error) {
+        if (!lastEventId || attempt >= maxRetries) throw error;
+        console.warn("Stream interrupted, resuming:", error);
+        await new Promise((resolve) => setTimeout(resolve, 500 * (attempt + 1)));
+      }
+    }
+  }
+
   processChunkData(data) {
     if (data.type === "IMAGE_GENERATED") {
       this.displayImage(data.data);
@@ -131,7 +246,7 @@ class SentientChat {
             <div class="message-content">
                 <p><strong>Image Generated Successfully!</strong></p>
                 <div class="generated-image">
-                    <img src="${imageData.image_url}" alt="${imageData.prompt}" 
+                    <img src="${this.resolveUrl(imageData.image_url)}" alt="${imageData.prompt}" 
                          style="max-width: 100%; border-radius: 10px; margin-top: 10px;">
                     <div class="image-info">
                         <p class="image-prompt"><strong>Prompt:</strong> ${this.escapeHtml(
@@ -146,6 +261,11 @@ class SentientChat {
     messagesContainer.scrollTop = messagesContainer.scrollHeight;
   }
 
+  resolveUrl(url) {
+    // Locally stored images come back as paths on the API server
+    return url && url.startsWith("/") ? `${this.apiBase}${url}` : url;
+  }
+
   addMessage(role, content, isTemp = false) {
     const messagesContainer = document.getElementById("chatMessages");
     const messageDiv = document.createElement("div");
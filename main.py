@@ -1,10 +1,22 @@
+import asyncio
+import importlib
 import logging
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
+from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
 from dotenv import load_dotenv
+from api.admission import AdmissionController
 from api.endpoints import router as api_router
+from api.streaming import StreamRegistry
+from agents.prompt_agent import PromptAgent
+from providers.client_pool import PREWARM_MODULES, ClientPool
+from providers.prompt_provider import PromptProvider
+from monitoring import metrics
+from monitoring.shared_metrics import SharedMetrics
 
 # Load environment variables
 load_dotenv()
@@ -13,8 +25,59 @@ load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One client pool and agent per worker, shared by every request
+    app.state.client_pool = ClientPool()
+    app.state.admission = AdmissionController.from_env()
+    app.state.streams = StreamRegistry.from_env()
+    app.state.shared_metrics = SharedMetrics.from_env()
+    background = [asyncio.create_task(metrics.monitor_event_loop_lag())]
+    if app.state.shared_metrics is not None:
+        background.append(asyncio.create_task(
+            app.state.shared_metrics.run(float(os.getenv("METRICS_SHARED_INTERVAL", 5)))
+        ))
+    try:
+        app.state.agent = PromptAgent(
+            name="Fireworks Chat Agent",
+            client_pool=app.state.client_pool,
+            # Loaded before the fork in multi-worker mode
+            prompt_provider=getattr(app.state, "prompt_provider", None),
+        )
+    except ValueError as e:
+        # Keep serving health checks; agent routes answer 503 until configured
+        logger.error(f"Agent unavailable: {e}")
+        app.state.agent = None
+    if app.state.agent is not None and os.getenv("PREWARM_CLIENTS", "true").lower() not in ("0", "false", "no", "off"):
+        background.append(asyncio.create_task(app.state.agent.prewarm()))
+    if app.state.agent is not None:
+        background.append(asyncio.create_task(
+            app.state.agent.maintain(float(os.getenv("COMPLETION_CACHE_PURGE_INTERVAL", 300)))
+        ))
+    try:
+        yield
+    finally:
+        for task in background:
+            task.cancel()
+        logger.info("Closing provider clients")
+        if app.state.agent is not None:
+            app.state.agent.close()
+        await app.state.client_pool.aclose()
+        if app.state.shared_metrics is not None:
+            await app.state.shared_metrics.publish()
+            app.state.shared_metrics.close()
+
+def preload():
+    """Do the shareable startup work in the parent before workers are forked"""
+    for module in sorted(set(PREWARM_MODULES.values())):
+        try:
+            importlib.import_module(module)
+        except ImportError as e:
+            logger.warning(f"Could not preload {module}: {e}")
+    app.state.prompt_provider = PromptProvider()
+
 # Create FastAPI app
-app = FastAPI(title="Fireworks AI Agent API", version="1.0.0")
+app = FastAPI(title="Fireworks AI Agent API", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware - SỬA ĐOẠN NÀY
 app.add_middleware(
@@ -28,13 +91,33 @@ app.add_middleware(
 # Include API routes
 app.include_router(api_router, prefix="/api")
 
+# Generated images are served from the local content-addressed store
+image_store_dir = os.getenv("IMAGE_STORE_DIR", "data/images")
+if image_store_dir:
+    os.makedirs(image_store_dir, exist_ok=True)
+    app.mount("/images", StaticFiles(directory=image_store_dir), name="images")
+
 @app.get("/")
 async def root():
     return {"message": "Fireworks AI Agent API is running", "status": "healthy"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """Prometheus metrics, summed over all workers in multi-worker mode"""
+    shared = getattr(app.state, "shared_metrics", None)
+    body = await shared.render() if shared is not None else metrics.REGISTRY.render()
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "model_provider": os.getenv("MODEL_PROVIDER", "fireworks")}
+    agent = getattr(app.state, "agent", None)
+    admission = getattr(app.state, "admission", None)
+    return {
+        "status": "healthy" if agent is not None else "degraded",
+        "model_provider": os.getenv("MODEL_PROVIDER", "fireworks"),
+        "backends": agent.backends() if agent is not None else {},
+        "admission": admission.snapshot() if admission is not None else None,
+    }
 
 if __name__ == "__main__":
     port = int(os.getenv("PORT", 8000))
@@ -43,4 +126,12 @@ if __name__ == "__main__":
     logger.info(f"Starting server on {host}:{port}")
     logger.info(f"Using model provider: {os.getenv('MODEL_PROVIDER', 'fireworks')}")
     
-    uvicorn.run(app, host=host, port=port)
\ No newline at end of file
+    # WORKERS=N forks N workers from a preloaded parent; 0 means one per core
+    if int(os.getenv("WORKERS", 1)) != 1:
+        from supervisor import WorkerSupervisor
+        WorkerSupervisor.from_env(app, host, port, preload=preload).run()
+    else:
+        uvicorn.run(
+            app, host=host, port=port,
+            timeout_graceful_shutdown=float(os.getenv("WORKER_DRAIN_TIMEOUT", 30)),
+        )
\ No newline at end of file
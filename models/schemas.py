@@ -1,14 +1,37 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import Optional, List, Dict, Any
 
 class ChatRequest(BaseModel):
-    prompt: str
+    prompt: str = Field(min_length=1)
     session_id: Optional[str] = "default"
-    template_name: Optional[str] = None
+    template_name: Optional[str] = Field(None, pattern=r"^[A-Za-z0-9_.-]+$", max_length=64)
+    max_tokens: int = Field(1000, ge=1, le=8192)
+    image_count: int = Field(1, ge=1)
+    timeout: Optional[float] = Field(None, gt=0)
+    timing: bool = False
+
+class Usage(BaseModel):
+    prompt_tokens: int
+    completion_tokens: int
+    total_tokens: int
 
 class ChatResponse(BaseModel):
-    type: str
-    data: Dict[str, Any]
+    """A whole /chat answer; images are set instead of response for image prompts.
+
+    errors lists the image variants that failed when others succeeded.
+    """
+    response: Optional[str] = None
+    images: Optional[List[Dict[str, Any]]] = None
+    errors: Optional[List[Dict[str, Any]]] = None
+    session_id: Optional[str] = "default"
+    template_used: str = "none"
+    provider: Optional[str] = None
+    model: Optional[str] = None
+    cache: Optional[str] = None
+    cache_similarity: Optional[float] = None
+    history_turns: int = 0
+    usage: Optional[Usage] = None
+    timing: Dict[str, Any]
 
 class ErrorResponse(BaseModel):
     error: str
@@ -17,4 +40,25 @@ class ErrorResponse(BaseModel):
 class TemplateInfo(BaseModel):
     name: str
     description: str
-    format: str
\ No newline at end of file
+    format: str
+
+class BatchItem(BaseModel):
+    prompt: str
+    template_name: Optional[str] = None
+
+class BatchRequest(BaseModel):
+    prompts: List[BatchItem]
+    # Rate limiting only; batch items never use session history
+    session_id: Optional[str] = "default"
+
+class StreamRequest(BaseModel):
+    """A prompt submitted over the multiplexed WebSocket"""
+    id: str
+    prompt: str
+    session_id: Optional[str] = "default"
+    template_name: Optional[str] = None
+    image_count: int = 1
+    hedge: Optional[bool] = None
+    frames: str = "coalesced"
+    timeout: Optional[float] = None
+    timing: bool = False
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from typing import Dict, List, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Updates are plain arithmetic on preallocated per-label slots: no locks on the
+# hot path. Everything runs on the event loop, and the few updates from
+# executor threads are single operations under the GIL.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+RATE_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 400, 800)
+SIMILARITY_BUCKETS = (0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95, 0.99, 1)
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+
+
+def _format_labels(names: Sequence[str], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self, values: Dict[Tuple[str, ...], float] = None) -> List[str]:
+        values = self._values if values is None else values
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {value}"
+            for labels, value in values.items()
+        ]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels: str, value: float):
+        self._values[labels] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [bucket counts..., +Inf count, sum]
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, *labels: str):
+        slots = self._values.get(labels)
+        if slots is None:
+            slots = self._values[labels] = [0] * (len(self.buckets) + 2)
+        slots[bisect_left(self.buckets, value)] += 1
+        slots[-1] += value
+
+    def samples(self, values: Dict[Tuple[str, ...], List[float]] = None) -> List[str]:
+        values = self._values if values is None else values
+        lines = []
+        for labels, slots in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), slots):
+                cumulative += count
+                le = _format_labels(self.labelnames, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {slots[-1]}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def snapshot(self) -> Dict[str, list]:
+        """Raw values of every metric as JSON-friendly [labels, value] rows"""
+        return {
+            metric.name: [[list(labels), value] for labels, value in metric._values.items()]
+            for metric in self._metrics
+        }
+
+    @staticmethod
+    def merge(snapshots: Sequence[Dict[str, list]]) -> Dict[str, dict]:
+        """Sum snapshots from several processes: counters, gauges and histogram slots add up"""
+        merged: Dict[str, dict] = {}
+        for snapshot in snapshots:
+            for name, rows in snapshot.items():
+                values = merged.setdefault(name, {})
+                for labels, value in rows:
+                    labels = tuple(labels)
+                    current = values.get(labels)
+                    if current is None:
+                        values[labels] = list(value) if isinstance(value, list) else value
+                    elif isinstance(value, list):
+                        values[labels] = [a + b for a, b in zip(current, value)]
+                    else:
+                        values[labels] = current + value
+        return merged
+
+    def render(self, snapshots: Sequence[Dict[str, list]] = None) -> str:
+        """Prometheus text exposition format.
+
+        With snapshots (one per worker, see snapshot()) the exposition is
+        their sum instead of this process's values.
+        """
+        merged = self.merge(snapshots) if snapshots is not None else None
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.samples(None if merged is None else merged.get(metric.name, {})))
+        lines.extend(self._cache_ratios(None if merged is None else merged.get(CACHE_LOOKUPS.name, {})))
+        return "\n".join(lines) + "\n"
+
+    def _cache_ratios(self, values: Dict[Tuple[str, ...], float] = None) -> List[str]:
+        values = CACHE_LOOKUPS._values if values is None else values
+        totals: Dict[str, List[float]] = {}
+        for (cache, result), value in values.items():
+            hits_and_total = totals.setdefault(cache, [0, 0])
+            hits_and_total[1] += value
+            if result == "hit":
+                hits_and_total[0] += value
+        lines = [
+            "# HELP cache_hit_ratio Share of cache lookups that were hits",
+            "# TYPE cache_hit_ratio gauge",
+        ]
+        for cache, (hits, total) in totals.items():
+            lines.append(f'cache_hit_ratio{{cache="{cache}"}} {hits / total if total else 0}')
+        return lines
+
+
+REGISTRY = Registry()
+
+TTFT = REGISTRY.register(Histogram(
+    "llm_time_to_first_token_seconds", "Time from upstream request to first token",
+    ("provider", "model"),
+))
+STREAM_DURATION = REGISTRY.register(Histogram(
+    "llm_stream_duration_seconds", "Total upstream stream duration",
+    ("provider", "model"),
+))
+TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "llm_tokens_per_second", "Streamed chunks per second after the first token",
+    ("provider", "model"), buckets=RATE_BUCKETS,
+))
+UPSTREAM_ERRORS = REGISTRY.register(Counter(
+    "llm_upstream_errors_total", "Upstream stream failures", ("provider", "code"),
+))
+STREAMS_IN_FLIGHT = REGISTRY.register(Gauge(
+    "streams_in_flight", "Streams currently open", ("kind",),
+))
+REQUEST_DURATION = REGISTRY.register(Histogram(
+    "agent_request_duration_seconds", "PromptAgent.assist duration", ("intent",),
+))
+COMPLETION_DURATION = REGISTRY.register(Histogram(
+    "completion_duration_seconds", "Non-streaming upstream completion latency", ("provider", "model"),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "cache_lookups_total", "Cache lookups by result", ("cache", "result"),
+))
+SEMANTIC_SIMILARITY = REGISTRY.register(Histogram(
+    "semantic_cache_similarity", "Similarity of semantic cache hits", ("cache",), buckets=SIMILARITY_BUCKETS,
+))
+IMAGE_STAGE = REGISTRY.register(Histogram(
+    "image_stage_duration_seconds", "Image pipeline stage latency", ("stage",),
+))
+CLIENT_DISCONNECTS = REGISTRY.register(Counter(
+    "client_disconnects_total", "Responses abandoned by the client before completion", ("kind",),
+))
+STREAM_RESUMES = REGISTRY.register(Counter(
+    "stream_resumes_total", "Reconnects carrying Last-Event-ID, by outcome", ("result",),
+))
+ADMISSION = REGISTRY.register(Counter(
+    "admission_decisions_total", "Admission controller outcomes", ("result",),
+))
+ADMISSION_QUEUE = REGISTRY.register(Gauge(
+    "admission_queue_depth", "Requests waiting for an in-flight slot",
+))
+EVENT_LOOP_LAG = REGISTRY.register(Histogram(
+    "event_loop_lag_seconds", "Delay between a scheduled wake-up and when it ran",
+    buckets=LAG_BUCKETS,
+))
+
+
+async def monitor_event_loop_lag(interval: float = 0.5):
+    """Sample event-loop lag until cancelled"""
+    loop = asyncio.get_running_loop()
+    while True:
+        scheduled = loop.time() + interval
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - scheduled))
+
+
+class timed:
+    """Context manager observing elapsed seconds into a histogram"""
+
+    __slots__ = ("histogram", "labels", "started")
+
+    def __init__(self, histogram: Histogram, *labels: str):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labels)
+        return False
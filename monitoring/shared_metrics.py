@@ -0,0 +1,95 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SharedMetrics:
+    """Metrics aggregated across worker processes through a local sqlite file.
+
+    Each worker periodically writes a snapshot of its own registry to one
+    row, keyed by worker id, of a WAL-mode database. A scrape served by
+    any worker publishes that worker's latest values first and then
+    renders the sum of every row. A restarted worker overwrites its
+    predecessor's row, so its counters restart from zero as they would
+    in a single process.
+    """
+
+    def __init__(self, path: str, worker_id: str, registry: metrics.Registry = None):
+        self.path = path
+        self.worker_id = worker_id
+        self.registry = registry or metrics.REGISTRY
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS worker_metrics "
+            "(worker TEXT PRIMARY KEY, snapshot TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional["SharedMetrics"]:
+        """Enabled by METRICS_SHARED_PATH, which the multi-worker supervisor sets"""
+        path = os.getenv("METRICS_SHARED_PATH")
+        if not path:
+            return None
+        return cls(path, os.getenv("WORKER_ID", str(os.getpid())))
+
+    @staticmethod
+    def reset(path: str):
+        """Drop rows left by a previous run, e.g. one with more workers"""
+        conn = sqlite3.connect(path)
+        try:
+            conn.execute("DROP TABLE IF EXISTS worker_metrics")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _write(self, snapshot: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO worker_metrics (worker, snapshot, updated_at) VALUES (?, ?, ?)",
+                (self.worker_id, snapshot, time.time()),
+            )
+
+    def _read(self) -> List[Dict[str, list]]:
+        with self._lock:
+            rows = self._conn.execute("SELECT snapshot FROM worker_metrics").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    async def publish(self):
+        # Snapshot on the loop, where the metrics are mutated; write off it
+        snapshot = json.dumps(self.registry.snapshot())
+        try:
+            await asyncio.to_thread(self._write, snapshot)
+        except sqlite3.Error as e:
+            logger.warning(f"Publishing worker metrics failed: {e}")
+
+    async def render(self) -> str:
+        """Prometheus exposition summed over all workers"""
+        await self.publish()
+        try:
+            snapshots = await asyncio.to_thread(self._read)
+        except sqlite3.Error as e:
+            logger.warning(f"Reading worker metrics failed, serving this worker's only: {e}")
+            return self.registry.render()
+        return self.registry.render(snapshots)
+
+    async def run(self, interval: float = 5):
+        """Publish this worker's metrics every interval seconds until cancelled"""
+        while True:
+            await asyncio.sleep(interval)
+            await self.publish()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
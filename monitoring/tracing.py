@@ -0,0 +1,223 @@
+import asyncio
+import cProfile
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# The trace of the request being served. Tasks copy it when they are
+# created, so image variants and single-flight fills report into the
+# request that started them.
+_current: ContextVar[Optional["Trace"]] = ContextVar("trace", default=None)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """Timed spans of one request, relative to when it started (milliseconds)"""
+
+    __slots__ = ("trace_id", "name", "attrs", "started", "spans", "duration")
+
+    def __init__(self, name: str, trace_id: str = None, **attrs: Any):
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.name = name
+        self.attrs = attrs
+        self.started = time.monotonic()
+        self.spans: List[Dict[str, Any]] = []
+        self.duration: Optional[float] = None
+
+    def record(self, name: str, started: float, ended: float = None, **attrs: Any):
+        """Add a span from monotonic timestamps; ended defaults to now"""
+        ended = time.monotonic() if ended is None else ended
+        self.spans.append({
+            "name": name,
+            "start_ms": round((started - self.started) * 1000, 3),
+            "duration_ms": round((ended - started) * 1000, 3),
+            **attrs,
+        })
+
+    def mark(self, name: str, **attrs: Any):
+        """Add an instant event, e.g. the first token"""
+        now = time.monotonic()
+        self.record(name, now, now, **attrs)
+
+    def finish(self):
+        if self.duration is None:
+            self.duration = time.monotonic() - self.started
+
+    def summary(self) -> Dict[str, Any]:
+        elapsed = self.duration if self.duration is not None else time.monotonic() - self.started
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "total_ms": round(elapsed * 1000, 3),
+            **self.attrs,
+            "spans": self.spans,
+        }
+
+
+class _Span:
+    __slots__ = ("trace", "name", "attrs", "started")
+
+    def __init__(self, trace: Trace, name: str, attrs: Dict[str, Any]):
+        self.trace = trace
+        self.name = name
+        self.attrs = attrs
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.attrs["error"] = exc_type.__name__
+        self.trace.record(self.name, self.started, **self.attrs)
+        return False
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+def span(name: str, **attrs: Any):
+    """Context manager timing a stage of the current request; a no-op outside a trace"""
+    trace = _current.get()
+    if trace is None:
+        return _NO_SPAN
+    return _Span(trace, name, attrs)
+
+
+def record(name: str, started: float, ended: float = None, **attrs: Any):
+    """Record a span from monotonic timestamps on the current trace, if any"""
+    trace = _current.get()
+    if trace is not None:
+        trace.record(name, started, ended, **attrs)
+
+
+def mark(name: str, **attrs: Any):
+    trace = _current.get()
+    if trace is not None:
+        trace.mark(name, **attrs)
+
+
+class Tracer:
+    """Starts request traces, writes them to a rotating JSONL file and samples profiles.
+
+    A request is traced when the file is configured, when the caller asks
+    for the timings (force), or when it is picked for profiling; otherwise
+    trace() yields None and every span() is a shared no-op.
+
+    Every profile_every-th request runs under cProfile and the stats are
+    dumped to profile_dir/<trace_id>.prof. cProfile sees the whole thread,
+    so a profile also contains whatever else the event loop ran meanwhile;
+    only one request is profiled at a time.
+    """
+
+    def __init__(
+        self,
+        path: str = None,
+        max_bytes: int = 10 * 1024 * 1024,
+        backups: int = 5,
+        profile_every: int = 0,
+        profile_dir: str = "data/profiles",
+    ):
+        self.path = path
+        self.profile_every = profile_every
+        self.profile_dir = profile_dir
+        self._counter = itertools.count(1)
+        self._profiling = False
+        self._listener = None
+        self._log = None
+        if path:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+            handler.setFormatter(logging.Formatter("%(message)s"))
+            # File writes and rotation happen on the listener thread, not the event loop
+            records = queue.SimpleQueue()
+            self._listener = logging.handlers.QueueListener(records, handler)
+            self._listener.start()
+            self._log = logging.getLogger(f"{__name__}.spans")
+            self._log.propagate = False
+            self._log.setLevel(logging.INFO)
+            self._log.handlers = [logging.handlers.QueueHandler(records)]
+        if profile_every:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> "Tracer":
+        enabled = os.getenv("TRACING", "false").lower() in ("1", "true", "yes", "on")
+        path = os.getenv("TRACE_PATH", "data/traces.jsonl") if enabled else None
+        worker_id = os.getenv("WORKER_ID")
+        if path and worker_id:
+            # Rotation is per process, so each worker gets its own file
+            root, ext = os.path.splitext(path)
+            path = f"{root}-{worker_id}{ext}"
+        return cls(
+            path=path,
+            max_bytes=int(os.getenv("TRACE_MAX_BYTES", 10 * 1024 * 1024)),
+            backups=int(os.getenv("TRACE_BACKUPS", 5)),
+            profile_every=int(os.getenv("PROFILE_SAMPLE_RATE", 0)),
+            profile_dir=os.getenv("PROFILE_DIR", "data/profiles"),
+        )
+
+    def _sampled(self) -> bool:
+        return bool(self.profile_every) and next(self._counter) % self.profile_every == 0
+
+    def _start_profile(self) -> Optional[cProfile.Profile]:
+        if self._profiling:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler is already attached to this thread
+            return None
+        self._profiling = True
+        return profile
+
+    def _dump_profile(self, profile: cProfile.Profile, trace: Trace):
+        path = os.path.join(self.profile_dir, f"{trace.trace_id}.prof")
+        trace.attrs["profile"] = path
+        try:
+            asyncio.get_running_loop().run_in_executor(None, profile.dump_stats, path)
+        except RuntimeError:
+            profile.dump_stats(path)
+
+    @contextmanager
+    def trace(self, name: str, force: bool = False, **attrs: Any) -> Iterator[Optional[Trace]]:
+        """Trace the enclosed request; yields None when it is not traced"""
+        sampled = self._sampled()
+        if not (self._log or force or sampled):
+            yield None
+            return
+
+        trace = Trace(name, **attrs)
+        token = _current.set(trace)
+        profile = self._start_profile() if sampled else None
+        try:
+            yield trace
+        except BaseException as e:
+            trace.attrs["error"] = type(e).__name__
+            raise
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                self._dump_profile(profile, trace)
+            _current.reset(token)
+            trace.finish()
+            if self._log:
+                self._log.info(json.dumps(trace.summary(), default=str))
+
+    def close(self):
+        if self._listener is not None:
+            self._listener.stop()
+            self._listener = None
@@ -0,0 +1,155 @@
+import os
+import sys
+import asyncio
+import time
+import inspect
+import importlib
+import logging
+from typing import Any, Dict, Iterable, Optional
+import httpx
+from .executor import BoundedExecutor
+
+logger = logging.getLogger(__name__)
+
+# SDK module behind each lazily built client
+PREWARM_MODULES = {
+    "fireworks": "fireworks.client",
+    "fireworks_async": "fireworks.client",
+    "openai": "openai",
+    "anthropic": "anthropic",
+}
+
+
+class ClientPool:
+    """Process-wide provider SDK clients sharing tuned HTTP connection pools.
+
+    Clients are built once on first use and reused by every request, so
+    TLS handshakes and client setup are paid once per worker rather than
+    once per request. Async clients are used wherever the SDK offers one;
+    the remaining blocking calls go through the bounded executor. SDK-level
+    retries are disabled on the streaming clients because ModelProvider
+    retries only before the first token.
+    """
+
+    def __init__(self, api_key: Optional[str] = None):
+        self.api_key = api_key or os.getenv("FIREWORKS_API_KEY")
+        self.limits = dict(
+            max_connections=int(os.getenv("HTTP_MAX_CONNECTIONS", 100)),
+            max_keepalive_connections=int(os.getenv("HTTP_MAX_KEEPALIVE", 20)),
+            keepalive_expiry=float(os.getenv("HTTP_KEEPALIVE_EXPIRY", 30)),
+        )
+        self.timeout = float(os.getenv("HTTP_TIMEOUT", 60))
+        self.connect_timeout = float(os.getenv("HTTP_CONNECT_TIMEOUT", 10))
+        self._clients: Dict[str, Any] = {}
+        self.executor = BoundedExecutor()
+
+    def _http_client(self, sdk, asynchronous: bool = False):
+        """Build an HTTP client with the pool limits for the given SDK module"""
+        name = "DefaultAsyncHttpxClient" if asynchronous else "DefaultHttpxClient"
+        client_cls = getattr(sdk, name, None)
+        if client_cls is None:
+            client_cls = httpx.AsyncClient if asynchronous else httpx.Client
+        # Newer SDKs may build on an httpx fork; use that module's config types
+        http = sys.modules[next(
+            base.__module__.partition(".")[0] for base in client_cls.__mro__
+            if base.__name__ == ("AsyncClient" if asynchronous else "Client")
+        )]
+        return client_cls(
+            limits=http.Limits(**self.limits),
+            timeout=http.Timeout(self.timeout, connect=self.connect_timeout),
+        )
+
+    @property
+    def http(self):
+        """Shared plain async HTTP client, e.g. for downloading generated images"""
+        if "http" not in self._clients:
+            self._clients["http"] = self._http_client(httpx, asynchronous=True)
+        return self._clients["http"]
+
+    @property
+    def fireworks(self):
+        """Shared blocking Fireworks client, for calls with no async variant"""
+        if "fireworks" not in self._clients:
+            import fireworks.client
+            self._clients["fireworks"] = fireworks.client.Fireworks(
+                api_key=self.api_key,
+                base_url=os.getenv("FIREWORKS_BASE_URL") or None,
+                http_client=self._http_client(fireworks.client),
+            )
+        return self._clients["fireworks"]
+
+    @property
+    def fireworks_async(self):
+        """Shared async Fireworks client"""
+        if "fireworks_async" not in self._clients:
+            import fireworks.client
+            self._clients["fireworks_async"] = fireworks.client.AsyncFireworks(
+                api_key=self.api_key,
+                base_url=os.getenv("FIREWORKS_BASE_URL") or None,
+                http_client=self._http_client(fireworks.client, asynchronous=True),
+                max_retries=0,
+            )
+        return self._clients["fireworks_async"]
+
+    @property
+    def openai(self):
+        """Shared async OpenAI client"""
+        if "openai" not in self._clients:
+            import openai
+            self._clients["openai"] = openai.AsyncOpenAI(
+                api_key=os.getenv("OPENAI_API_KEY", self.api_key),
+                base_url=os.getenv("OPENAI_BASE_URL") or None,
+                http_client=self._http_client(openai, asynchronous=True),
+                max_retries=0,
+            )
+        return self._clients["openai"]
+
+    @property
+    def anthropic(self):
+        """Shared async Anthropic client"""
+        if "anthropic" not in self._clients:
+            import anthropic
+            self._clients["anthropic"] = anthropic.AsyncAnthropic(
+                api_key=os.getenv("ANTHROPIC_API_KEY", self.api_key),
+                base_url=os.getenv("ANTHROPIC_BASE_URL") or None,
+                http_client=self._http_client(anthropic, asynchronous=True),
+                max_retries=0,
+            )
+        return self._clients["anthropic"]
+
+    async def prewarm(self, names: Iterable[str]):
+        """Build the named clients and open a pooled connection to each upstream.
+
+        SDK imports run in a thread so the event loop keeps serving while
+        they load. Failures are logged and ignored; the client is simply
+        built on first use instead.
+        """
+        for name in names:
+            module = PREWARM_MODULES.get(name)
+            if module is None:
+                continue
+            try:
+                started = time.perf_counter()
+                await asyncio.to_thread(importlib.import_module, module)
+                client = getattr(self, name)
+                base_url = getattr(client, "base_url", None)
+                http = getattr(client, "_client", None)
+                if base_url is not None and hasattr(http, "aclose"):
+                    # Any response will do; this only pays the TCP and TLS handshake up front
+                    await asyncio.wait_for(http.request("HEAD", str(base_url)), self.connect_timeout)
+                logger.info(f"Pre-warmed {name} client in {time.perf_counter() - started:.2f}s")
+            except Exception as e:
+                logger.warning(f"Pre-warming {name} client failed: {e}")
+
+    async def aclose(self):
+        """Close every client and release pooled connections"""
+        for name, client in list(self._clients.items()):
+            try:
+                close = getattr(client, "aclose", None) or client.close
+                result = close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.warning(f"Error closing {name} client: {e}")
+        self._clients.clear()
+        self.executor.shutdown(wait=False)
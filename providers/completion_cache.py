@@ -0,0 +1,208 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class SqliteCacheBackend:
+    """On-disk cache backend that survives restarts, capped at max_rows (0 for no cap)"""
+
+    def __init__(self, path: str, max_rows: int = 0):
+        self.path = path
+        self.max_rows = max_rows
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS completions "
+            "(key TEXT PRIMARY KEY, chunks TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS completions_expires_at ON completions (expires_at)")
+
+    def get(self, key: str) -> Optional[Tuple[float, List[str]]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT expires_at, chunks FROM completions WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1])
+
+    def set(self, key: str, expires_at: float, chunks: List[str]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO completions (key, chunks, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(chunks), expires_at),
+            )
+
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM completions WHERE key = ?", (key,))
+
+    def purge_expired(self) -> int:
+        """Delete expired rows, then the soonest to expire beyond max_rows; returns how many"""
+        with self._lock:
+            removed = self._conn.execute(
+                "DELETE FROM completions WHERE expires_at < ?", (time.time(),)
+            ).rowcount
+            if self.max_rows:
+                # Every row gets the same TTL, so the soonest to expire are the oldest
+                removed += self._conn.execute(
+                    "DELETE FROM completions WHERE key IN "
+                    "(SELECT key FROM completions ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_rows,),
+                ).rowcount
+        return removed
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CompletionCache:
+    """Exact-match cache of streamed completions.
+
+    Entries live in an in-memory LRU bounded by entry count, total bytes
+    and TTL, with an optional sqlite backend behind it, which run() keeps
+    purged of expired and surplus rows. Hits are replayed chunk by chunk
+    so callers see the same stream shape as a live call.
+    """
+
+    def __init__(
+        self,
+        ttl: float = 3600,
+        max_entries: int = 1024,
+        max_bytes: int = 32 * 1024 * 1024,
+        backend: Optional[SqliteCacheBackend] = None,
+        replay_delay: float = 0.0,
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.backend = backend
+        self.replay_delay = replay_delay
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, List[str], int]]" = OrderedDict()
+        self._bytes = 0
+
+    @classmethod
+    def from_env(cls) -> Optional["CompletionCache"]:
+        """Build a cache from COMPLETION_CACHE_* settings, or None if disabled"""
+        if os.getenv("COMPLETION_CACHE", "true").lower() in ("0", "false", "no", "off"):
+            return None
+        path = os.getenv("COMPLETION_CACHE_PATH")
+        return cls(
+            ttl=float(os.getenv("COMPLETION_CACHE_TTL", 3600)),
+            max_entries=int(os.getenv("COMPLETION_CACHE_MAX_ENTRIES", 1024)),
+            max_bytes=int(os.getenv("COMPLETION_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+            backend=SqliteCacheBackend(
+                path, max_rows=int(os.getenv("COMPLETION_CACHE_MAX_ROWS", 100000))
+            ) if path else None,
+            replay_delay=float(os.getenv("COMPLETION_CACHE_REPLAY_DELAY", 0)),
+        )
+
+    @staticmethod
+    def make_key(provider: str, model: str, prompt: str, params: Dict[str, Any]) -> str:
+        payload = json.dumps([provider, model, prompt, params], sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _store(self, key: str, expires_at: float, chunks: List[str]):
+        size = sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        if size > self.max_bytes:
+            return
+        self._discard(key)
+        self._entries[key] = (expires_at, chunks, size)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, (_, _, evicted_size) = self._entries.popitem(last=False)
+            self._bytes -= evicted_size
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _lookup(self, key: str, touch: bool) -> Optional[List[str]]:
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] >= now:
+                if touch:
+                    self._entries.move_to_end(key)
+                return entry[1]
+            self._discard(key)
+        if self.backend is not None:
+            stored = self.backend.get(key)
+            if stored is not None:
+                expires_at, chunks = stored
+                if expires_at >= now:
+                    if touch:
+                        self._store(key, expires_at, chunks)
+                    return chunks
+                self.backend.delete(key)
+        return None
+
+    def contains(self, key: str) -> bool:
+        """Check for a live entry without counting a hit or reordering the LRU"""
+        return self._lookup(key, touch=False) is not None
+
+    def get(self, key: str) -> Optional[List[str]]:
+        chunks = self._lookup(key, touch=True)
+        if chunks is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return chunks
+
+    def get_first(self, keys: List[str]) -> Tuple[Optional[str], Optional[List[str]]]:
+        """First of keys with a live entry and its chunks, counted as one hit or miss"""
+        for key in keys:
+            chunks = self._lookup(key, touch=True)
+            if chunks is not None:
+                self.hits += 1
+                return key, chunks
+        self.misses += 1
+        return None, None
+
+    def set(self, key: str, chunks: List[str]):
+        expires_at = time.time() + self.ttl
+        self._store(key, expires_at, chunks)
+        if self.backend is not None:
+            try:
+                self.backend.set(key, expires_at, chunks)
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache write failed: {e}")
+
+    async def replay(self, chunks: List[str]) -> AsyncIterator[str]:
+        """Yield cached chunks, optionally paced to mimic a live stream"""
+        for chunk in chunks:
+            if self.replay_delay:
+                await asyncio.sleep(self.replay_delay)
+            yield chunk
+
+    async def run(self, interval: float = 300):
+        """Purge the sqlite backend now and every interval seconds until cancelled"""
+        if self.backend is None:
+            return
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.backend.purge_expired)
+                if removed:
+                    logger.info(f"Purged {removed} completion cache rows")
+            except sqlite3.Error as e:
+                logger.warning(f"Completion cache purge failed: {e}")
+            await asyncio.sleep(interval)
+
+    def close(self):
+        if self.backend is not None:
+            self.backend.close()
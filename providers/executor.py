@@ -0,0 +1,55 @@
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+
+def _release_threadsafe(loop: asyncio.AbstractEventLoop, semaphore: asyncio.Semaphore):
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # The loop has already shut down; nobody is left waiting on the semaphore
+        pass
+
+
+class BoundedExecutor:
+    """Size-limited thread pool for SDK calls that have no async variant.
+
+    Each provider also gets its own concurrency cap, so one slow backend
+    cannot take every worker thread away from the others.
+    """
+
+    def __init__(self, max_workers: int = None, per_provider_limit: int = None):
+        self.max_workers = max_workers or int(os.getenv("PROVIDER_THREADS", 16))
+        self.per_provider_limit = per_provider_limit or int(os.getenv("PROVIDER_CONCURRENCY", 4))
+        self._pool = ThreadPoolExecutor(
+            max_workers=self.max_workers, thread_name_prefix="provider"
+        )
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def _semaphore(self, provider: str) -> asyncio.Semaphore:
+        if provider not in self._semaphores:
+            self._semaphores[provider] = asyncio.Semaphore(self.per_provider_limit)
+        return self._semaphores[provider]
+
+    async def run(self, provider: str, fn: Callable, *args, **kwargs) -> Any:
+        """Run a blocking call off the event loop under the provider's cap.
+
+        Cancelling the caller drops a call that has not started yet. One
+        already running cannot be interrupted, so it keeps its slot until
+        the thread actually finishes.
+        """
+        semaphore = self._semaphore(provider)
+        await semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            future = self._pool.submit(functools.partial(fn, *args, **kwargs))
+        except BaseException:
+            semaphore.release()
+            raise
+        future.add_done_callback(lambda _: _release_threadsafe(loop, semaphore))
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self, wait: bool = True):
+        self._pool.shutdown(wait=wait, cancel_futures=True)
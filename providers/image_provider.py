@@ -1,37 +1,146 @@
 import os
+import re
+import asyncio
 import base64
-import aiohttp
 from typing import Optional, Dict, Any
 import logging
-from fireworks.client import Fireworks
+from monitoring import metrics, tracing
+from .client_pool import ClientPool
+from .completion_cache import CompletionCache, SqliteCacheBackend
+from .image_store import ImageStore
+from .semantic_cache import SemanticCache
 
 logger = logging.getLogger(__name__)
 
 class ImageProvider:
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        client_pool: ClientPool = None,
+        prompt_cache: CompletionCache = None,
+        image_store: ImageStore = None,
+        semantic_cache: SemanticCache = None,
+    ):
         self.api_key = api_key
-        self.fireworks_client = Fireworks(api_key=api_key)
+        self.semantic_cache = semantic_cache
+        self.client_pool = client_pool or ClientPool(api_key=api_key)
+        # Shares the completion cache's sqlite file when one is configured
+        cache_path = os.getenv("COMPLETION_CACHE_PATH")
+        self.prompt_cache = prompt_cache or CompletionCache(
+            ttl=float(os.getenv("IMAGE_PROMPT_CACHE_TTL", 86400)),
+            max_entries=int(os.getenv("IMAGE_PROMPT_CACHE_MAX_ENTRIES", 4096)),
+            backend=SqliteCacheBackend(cache_path) if cache_path else None,
+        )
+        self.image_store = image_store if image_store is not None else ImageStore.from_env()
+        self.width = int(os.getenv("IMAGE_WIDTH", 1024))
+        self.height = int(os.getenv("IMAGE_HEIGHT", 1024))
+        self.steps = int(os.getenv("IMAGE_STEPS", 20))
 
-    async def generate_image(self, prompt: str, model: str = None) -> Optional[Dict[str, Any]]:
+    @property
+    def fireworks_client(self):
+        return self.client_pool.fireworks
+
+    @property
+    def image_model(self) -> str:
+        return os.getenv("FIREWORKS_IMAGE_MODEL", "accounts/fireworks/models/stable-diffusion-xl-1024-v1-0")
+
+    @staticmethod
+    def normalize_prompt(text: str) -> str:
+        return re.sub(r"\s+", " ", text).strip().lower()
+
+    async def expand_prompt(self, text_prompt: str) -> Optional[Dict[str, Any]]:
+        """Turn user text into a detailed Stable Diffusion prompt, memoized"""
+        model = os.getenv("FIREWORKS_MODEL")
+        key = CompletionCache.make_key(
+            "fireworks", model, self.normalize_prompt(text_prompt), {"purpose": "image_prompt"}
+        )
+        cached = self.prompt_cache.get(key)
+        metrics.CACHE_LOOKUPS.inc("image_prompt", "miss" if cached is None else "hit")
+        if cached is not None:
+            return {"prompt": cached[0], "cached": True}
+
+        namespace = f"image_prompt:{model}"
+        if self.semantic_cache is not None:
+            match = self.semantic_cache.lookup(namespace, text_prompt, "image")
+            cached = self.prompt_cache.get(match[0]) if match else None
+            metrics.CACHE_LOOKUPS.inc("image_prompt_semantic", "miss" if cached is None else "hit")
+            if cached is not None:
+                metrics.SEMANTIC_SIMILARITY.observe(match[1], "image_prompt")
+                return {"prompt": cached[0], "cached": True, "similarity": round(match[1], 3)}
+
+        image_prompt_query = f"Create a detailed Stable Diffusion prompt for: {text_prompt}. Include style, composition, lighting, mood, and technical details."
+        
+        with metrics.timed(metrics.IMAGE_STAGE, "expand_prompt"), tracing.span("expand_prompt"):
+            response = await self.client_pool.fireworks_async.chat.completions.create(
+                model=model,
+                messages=[{"role": "user", "content": image_prompt_query}],
+                max_tokens=200
+            )
+        
+        if not response.choices:
+            return None
+        image_prompt = response.choices[0].message.content
+        self.prompt_cache.set(key, [image_prompt])
+        if self.semantic_cache is not None:
+            self.semantic_cache.add(namespace, text_prompt, key)
+        return {"prompt": image_prompt, "cached": False}
+
+    async def _image_bytes(self, image_data) -> bytes:
+        b64 = getattr(image_data, "b64_json", None)
+        if b64:
+            return base64.b64decode(b64)
+        response = await self.client_pool.http.get(image_data.url)
+        response.raise_for_status()
+        return response.content
+
+    async def generate_image(self, prompt: str, model: str = None, variant: int = 0) -> Optional[Dict[str, Any]]:
         """Generate image using Fireworks AI image models"""
         try:
-            model = model or os.getenv("FIREWORKS_IMAGE_MODEL", "accounts/fireworks/models/stable-diffusion-xl-1024-v1-0")
+            model = model or self.image_model
+            key = None
+            if self.image_store is not None:
+                key = ImageStore.make_key(
+                    prompt=prompt, model=model, width=self.width,
+                    height=self.height, steps=self.steps, variant=variant,
+                )
+                hit = self.image_store.contains(key)
+                metrics.CACHE_LOOKUPS.inc("image", "hit" if hit else "miss")
+                if hit:
+                    return {
+                        "url": self.image_store.url(key),
+                        "prompt": prompt,
+                        "model": model,
+                        "variant": variant,
+                        "cached": True,
+                        "success": True
+                    }
             
-            response = self.fireworks_client.images.generate(
-                model=model,
-                prompt=prompt,
-                width=1024,
-                height=1024,
-                steps=20,
-                n=1
-            )
+            with metrics.timed(metrics.IMAGE_STAGE, "generate"), tracing.span("generate", variant=variant):
+                response = await self.client_pool.executor.run(
+                    "fireworks_image",
+                    self.fireworks_client.images.generate,
+                    model=model,
+                    prompt=prompt,
+                    width=self.width,
+                    height=self.height,
+                    steps=self.steps,
+                    n=1
+                )
             
             if response and response.data:
                 image_data = response.data[0]
+                url = getattr(image_data, "url", None)
+                if key is not None:
+                    with metrics.timed(metrics.IMAGE_STAGE, "store"), tracing.span("store", variant=variant):
+                        data = await self._image_bytes(image_data)
+                        # The file write stays off the event loop
+                        url = await asyncio.to_thread(self.image_store.put, key, data)
                 return {
-                    "url": image_data.url,
+                    "url": url,
                     "prompt": prompt,
                     "model": model,
+                    "variant": variant,
+                    "cached": False,
                     "success": True
                 }
                 
@@ -47,21 +156,12 @@ class ImageProvider:
     async def generate_image_from_text(self, text_prompt: str) -> Optional[Dict[str, Any]]:
         """First generate image prompt from text, then create image"""
         try:
-            # Generate detailed image prompt
-            image_prompt_query = f"Create a detailed Stable Diffusion prompt for: {text_prompt}. Include style, composition, lighting, mood, and technical details."
-            
-            response = self.fireworks_client.chat.completions.create(
-                model=os.getenv("FIREWORKS_MODEL"),
-                messages=[{"role": "user", "content": image_prompt_query}],
-                max_tokens=200
-            )
-            
-            if response.choices:
-                image_prompt = response.choices[0].message.content
+            expanded = await self.expand_prompt(text_prompt)
+            if expanded:
                 # Generate actual image
-                return await self.generate_image(image_prompt)
+                return await self.generate_image(expanded["prompt"])
                 
         except Exception as e:
             logger.error(f"Image prompt generation error: {e}")
             
-        return None
\ No newline at end of file
+        return None
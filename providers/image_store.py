@@ -0,0 +1,93 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ImageStore:
+    """Content-addressed local store for generated images.
+
+    Images are keyed by a hash of everything that determines the output
+    (expanded prompt, model, size, steps, variant) and written as flat
+    files so they can be served directly by a static route. Past
+    max_bytes (0 for no limit) prune() deletes the oldest images first.
+    """
+
+    def __init__(self, root: str, url_prefix: str = "/images", max_bytes: int = 0):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/")
+        self.max_bytes = max_bytes
+        os.makedirs(root, exist_ok=True)
+
+    @classmethod
+    def from_env(cls) -> Optional["ImageStore"]:
+        root = os.getenv("IMAGE_STORE_DIR", "data/images")
+        if not root:
+            return None
+        base_url = os.getenv("PUBLIC_BASE_URL", "").rstrip("/")
+        return cls(
+            root,
+            url_prefix=f"{base_url}/images",
+            max_bytes=int(float(os.getenv("IMAGE_STORE_MAX_MB", 1024)) * 1024 * 1024),
+        )
+
+    @staticmethod
+    def make_key(**params: Any) -> str:
+        payload = json.dumps(params, sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, f"{key}.png")
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}.png"
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self.path(key))
+
+    def put(self, key: str, data: bytes) -> str:
+        """Write image bytes atomically and return their URL"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, self.path(key))
+        return self.url(key)
+
+    def prune(self) -> int:
+        """Delete the oldest images until the store fits in max_bytes; returns how many went"""
+        if not self.max_bytes:
+            return 0
+        images = []
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.endswith(".png") and entry.is_file():
+                    stat = entry.stat()
+                    images.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in images)
+        removed = 0
+        for _, size, path in sorted(images):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+            removed += 1
+        return removed
+
+    async def run(self, interval: float = 300):
+        """Prune the store now and every interval seconds until cancelled"""
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.prune)
+                if removed:
+                    logger.info(f"Pruned {removed} images from {self.root}")
+            except OSError as e:
+                logger.warning(f"Image store prune failed: {e}")
+            await asyncio.sleep(interval)
@@ -1,89 +1,599 @@
 import os
-from typing import AsyncIterator
-import aiohttp
+import time
+import asyncio
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 import json
 import logging
-from fireworks.client import Fireworks
+from contextlib import aclosing
+from .client_pool import ClientPool
+from .completion_cache import CompletionCache
 from .image_provider import ImageProvider
+from .provider_router import ProviderRouter
+from .semantic_cache import SemanticCache
+from monitoring import metrics, tracing
+from .resilience import (
+    CircuitOpenError,
+    Deadline,
+    ProviderError,
+    as_provider_error,
+    backoff_delay,
+)
+from .single_flight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_MODELS = {
+    "fireworks": ("FIREWORKS_MODEL", "accounts/fireworks/models/mixtral-8x7b-instruct"),
+    "openai": ("OPENAI_MODEL", "gpt-3.5-turbo"),
+    "anthropic": ("ANTHROPIC_MODEL", "claude-3-sonnet-20240229"),
+}
+
+# ClientPool client serving each backend's streams
+BACKEND_CLIENTS = {
+    "fireworks": "fireworks_async",
+    "openai": "openai",
+    "anthropic": "anthropic",
+}
+
 class ModelProvider:
     
-    def __init__(self, api_key: str):
+    def __init__(
+        self,
+        api_key: str,
+        client_pool: ClientPool = None,
+        cache: CompletionCache = None,
+        semantic_cache: SemanticCache = None,
+    ):
         self.api_key = api_key
-        self.provider = os.getenv("MODEL_PROVIDER", "fireworks")
-        
-        if self.provider == "fireworks":
-            self.fireworks_client = Fireworks(api_key=api_key)
-            self.image_provider = ImageProvider(api_key=api_key)
-        elif self.provider == "openai":
-            import openai
-            openai.api_key = api_key
-        elif self.provider == "anthropic":
-            import anthropic
-            self.anthropic_client = anthropic.Anthropic(api_key=api_key)
-
-    async def query_stream(self, prompt: str) -> AsyncIterator[str]:
-        if self.provider == "fireworks":
-            async for chunk in self._fireworks_stream(prompt):
-                yield chunk
-        elif self.provider == "openai":
-            async for chunk in self._openai_stream(prompt):
-                yield chunk
-        elif self.provider == "anthropic":
-            async for chunk in self._anthropic_stream(prompt):
+        # MODEL_PROVIDERS lists every usable backend; the first is the default
+        self.router = ProviderRouter.from_env()
+        self.provider = self.router.backends[0]
+        self.hedge = os.getenv("HEDGE_REQUESTS", "false").lower() in ("1", "true", "yes", "on")
+        self.max_retries = int(os.getenv("PROVIDER_MAX_RETRIES", 2))
+        self.client_pool = client_pool or ClientPool(api_key=api_key)
+        self.cache = cache if cache is not None else CompletionCache.from_env()
+        # Opt-in approximate matching on top of the exact caches
+        self.semantic_cache = semantic_cache if semantic_cache is not None else SemanticCache.from_env()
+        self.image_provider = ImageProvider(
+            api_key=api_key, client_pool=self.client_pool, semantic_cache=self.semantic_cache
+        )
+        single_flight = os.getenv("SINGLE_FLIGHT", "true").lower() not in ("0", "false", "no", "off")
+        self.flights = (
+            SingleFlight(max_lead=int(os.getenv("SINGLE_FLIGHT_MAX_LEAD", 16))) if single_flight else None
+        )
+
+    @staticmethod
+    def model_for(provider: str) -> str:
+        env_var, default = DEFAULT_MODELS[provider]
+        return os.getenv(env_var, default)
+
+    @property
+    def model(self) -> str:
+        return self.model_for(self.provider)
+
+    def _cache_key(
+        self, provider: str, prompt: str, max_tokens: int, history: List[Dict[str, str]] = None
+    ) -> str:
+        return CompletionCache.make_key(
+            provider, self.model_for(provider), prompt, {"max_tokens": max_tokens, "history": history or []}
+        )
+
+    def _semantic_namespace(self, provider: str, max_tokens: int, template: str = None) -> str:
+        return f"{provider}:{self.model_for(provider)}:{max_tokens}:{template or 'none'}"
+
+    def _similar_key(
+        self, text: str, max_tokens: int, history: List[Dict[str, str]] = None, template: str = None
+    ) -> Tuple[Optional[str], float, Optional[str]]:
+        """Cache key of a cached prompt similar to text, with its similarity and backend.
+
+        Only stateless prompts are matched approximately; history changes
+        what the right answer is.
+        """
+        if self.cache is None or self.semantic_cache is None or history or not text:
+            return None, 0.0, None
+        for provider in self.router.backends:
+            match = self.semantic_cache.lookup(self._semantic_namespace(provider, max_tokens, template), text, template)
+            if match is not None and self.cache.contains(match[0]):
+                return match[0], match[1], provider
+        return None, 0.0, None
+
+    def _cached_completion(
+        self,
+        prompt: str,
+        max_tokens: int,
+        history: Optional[List[Dict[str, str]]],
+        template: Optional[str],
+        text: str,
+    ) -> Tuple[Optional[List[str]], Dict[str, Any]]:
+        """Look prompt up exactly under every backend, then approximately by text.
+
+        Returns the cached chunks (or None) and the cache details reported
+        to clients; on a hit these include the backend that produced them.
+        """
+        if self.cache is None:
+            return None, {"cache": "disabled"}
+        started = time.monotonic()
+        keys = {self._cache_key(provider, prompt, max_tokens, history): provider for provider in self.router.backends}
+        key, cached = self.cache.get_first(list(keys))
+        metrics.CACHE_LOOKUPS.inc("completion", "miss" if cached is None else "hit")
+        details = {"cache": "miss"} if cached is None else {"cache": "hit", "provider": keys[key]}
+        if cached is None and self.semantic_cache is not None and not history:
+            similar_key, similarity, provider = self._similar_key(text, max_tokens, history, template)
+            if similar_key is not None:
+                cached = self.cache.get(similar_key)
+            metrics.CACHE_LOOKUPS.inc("semantic", "miss" if cached is None else "hit")
+            if cached is not None:
+                metrics.SEMANTIC_SIMILARITY.observe(similarity, "completion")
+                details = {"cache": "similar", "cache_similarity": round(similarity, 3), "provider": provider}
+        tracing.record("cache_lookup", started, hit=cached is not None)
+        return cached, details
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+        self.image_provider.prompt_cache.close()
+
+    async def prewarm(self):
+        """Load SDKs and open connections for every configured backend"""
+        names = [BACKEND_CLIENTS[backend] for backend in self.router.backends]
+        # Image generation still uses the blocking Fireworks client
+        await self.client_pool.prewarm(dict.fromkeys(names + ["fireworks"]))
+
+    async def query_stream(
+        self,
+        prompt: str,
+        max_tokens: int = 1000,
+        history: List[Dict[str, str]] = None,
+        hedge: bool = None,
+        deadline: Deadline = None,
+        template: str = None,
+        text: str = None,
+        served: Dict[str, Any] = None,
+    ) -> AsyncIterator[str]:
+        """Stream a completion for prompt, preceded by any prior conversation turns.
+
+        With the semantic cache enabled, text (the user's own words, without
+        the template) is matched approximately against earlier prompts that
+        used the same template.
+
+        served, if given, gets the cache outcome ("cache" and, for an
+        approximate hit, "cache_similarity") and the "provider" that
+        produced the response, set before its first chunk is yielded.
+
+        Upstream failures are raised as ProviderError rather than yielded as text.
+        """
+        hedge = self.hedge if hedge is None else hedge
+        deadline = deadline or Deadline.from_env()
+        served = {} if served is None else served
+        cached, details = self._cached_completion(prompt, max_tokens, history, template, text or prompt)
+        served.update(details)
+        if cached is not None:
+            async for chunk in self.cache.replay(cached):
                 yield chunk
+            return
+
+        def fill(flight_served: Dict[str, Any]) -> AsyncIterator[str]:
+            return self._fill(prompt, max_tokens, history, hedge, deadline, template, text or prompt, flight_served)
+
+        if self.flights is not None:
+            # Identical concurrent prompts with the same hedging and time budget share one
+            # upstream stream; the budget is measured from when the first of them started
+            request_key = self._cache_key(self.provider, prompt, max_tokens, history)
+            flight_key = f"{request_key}:{int(hedge)}:{deadline.connect}:{deadline.first_token}:{deadline.total}"
+            stream = self.flights.subscribe(flight_key, fill, served)
+        else:
+            stream = fill(served)
 
-    async def _fireworks_stream(self, prompt: str) -> AsyncIterator[str]:
         try:
-            # Cập nhật API call cho phiên bản mới
-            response = self.fireworks_client.chat.completions.create(
-                model=os.getenv("FIREWORKS_MODEL", "accounts/fireworks/models/mixtral-8x7b-instruct"),
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                max_tokens=1000
+            # aclosing: a cancelled consumer must close the upstream response now, not at GC
+            async with aclosing(stream):
+                async for chunk in stream:
+                    yield chunk
+        except ProviderError as e:
+            logger.error(f"{e.provider or self.provider} API error: {e}")
+            raise
+
+    async def complete(
+        self,
+        prompt: str,
+        max_tokens: int = 1000,
+        history: List[Dict[str, str]] = None,
+        deadline: Deadline = None,
+        template: str = None,
+        text: str = None,
+    ) -> Dict[str, Any]:
+        """Whole completion from one non-streaming upstream call.
+
+        Cheaper than query_stream when the caller only wants the final text.
+        Shares the completion cache with query_stream. Returns text, usage
+        (None when served from the cache), provider, model and cache details.
+        """
+        deadline = deadline or Deadline.from_env()
+        messages = (history or []) + [{"role": "user", "content": prompt}]
+        cached, details = self._cached_completion(prompt, max_tokens, history, template, text or prompt)
+        if cached is not None:
+            provider = details.pop("provider")
+            return {
+                "text": "".join(cached), "usage": None, "provider": provider, "model": self.model_for(provider),
+                **details,
+            }
+
+        provider = self.router.ranked(explore=True)[0]
+        try:
+            result = await self._complete_backend(provider, messages, max_tokens, deadline)
+        except ProviderError as e:
+            logger.error(f"{e.provider or provider} API error: {e}")
+            raise
+        if result["text"]:
+            self._store(provider, prompt, max_tokens, history, template, text or prompt, [result["text"]])
+        return {**result, **details}
+
+    async def _complete_backend(
+        self, provider: str, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ) -> Dict[str, Any]:
+        """One backend's non-streaming completion, retried like a stream that has not started"""
+        model = self.model_for(provider)
+        attempt = 0
+        while True:
+            if not self.router.acquire(provider):
+                raise CircuitOpenError(provider)
+            started = time.monotonic()
+            try:
+                with tracing.span("complete", provider=provider, attempt=attempt):
+                    text, usage = await deadline.wait(
+                        self._provider_complete(provider, messages, max_tokens), "total", provider
+                    )
+            except Exception as e:
+                error = as_provider_error(e, provider)
+                self.router.record_error(provider, error)
+                metrics.UPSTREAM_ERRORS.inc(provider, error.code)
+                delay = backoff_delay(attempt)
+                remaining = deadline.timeout("total")
+                if (
+                    attempt >= self.max_retries
+                    or not error.retryable
+                    or (remaining is not None and remaining <= delay)
+                ):
+                    raise error
+                attempt += 1
+                logger.warning(f"Retrying {provider} in {delay:.2f}s after: {error}")
+                await asyncio.sleep(delay)
+                continue
+            except BaseException:
+                self.router.release(provider)
+                raise
+            # Only the breaker learns from this; latency stats stay stream-based
+            self.router.record_success(provider, 0, 0)
+            metrics.COMPLETION_DURATION.observe(time.monotonic() - started, provider, model)
+            return {"text": text, "usage": usage, "provider": provider, "model": model}
+
+    async def _provider_complete(
+        self, provider: str, messages: List[Dict[str, str]], max_tokens: int
+    ) -> Tuple[str, Optional[Dict[str, int]]]:
+        """Call a backend without streaming; returns the text and its token usage"""
+        if provider in ("fireworks", "openai"):
+            with tracing.span("client_setup", provider=provider):
+                client = self.client_pool.fireworks_async if provider == "fireworks" else self.client_pool.openai
+            response = await client.chat.completions.create(
+                model=self.model_for(provider),
+                messages=messages,
+                max_tokens=max_tokens,
             )
-            
-            async for chunk in response:
-                if chunk.choices[0].delta.content is not None:
-                    yield chunk.choices[0].delta.content
+            text = (response.choices[0].message.content or "") if response.choices else ""
+            usage = getattr(response, "usage", None)
+            if usage is None:
+                return text, None
+            return text, {
+                "prompt_tokens": usage.prompt_tokens,
+                "completion_tokens": usage.completion_tokens,
+                "total_tokens": usage.total_tokens,
+            }
+        elif provider == "anthropic":
+            with tracing.span("client_setup", provider=provider):
+                client = self.client_pool.anthropic
+            response = await client.messages.create(
+                max_tokens=max_tokens,
+                messages=messages,
+                model=self.model_for("anthropic"),
+            )
+            text = "".join(getattr(block, "text", "") for block in response.content)
+            usage = response.usage
+            return text, {
+                "prompt_tokens": usage.input_tokens,
+                "completion_tokens": usage.output_tokens,
+                "total_tokens": usage.input_tokens + usage.output_tokens,
+            }
+        raise ValueError(f"Unknown model provider: {provider}")
+
+    def _store(
+        self,
+        provider: str,
+        prompt: str,
+        max_tokens: int,
+        history: Optional[List[Dict[str, str]]],
+        template: Optional[str],
+        text: str,
+        chunks: List[str],
+    ):
+        """Cache a response under the backend that produced it"""
+        if self.cache is None:
+            return
+        key = self._cache_key(provider, prompt, max_tokens, history)
+        self.cache.set(key, chunks)
+        if self.semantic_cache is not None and not history:
+            self.semantic_cache.add(self._semantic_namespace(provider, max_tokens, template), text, key)
+
+    async def _fill(
+        self,
+        prompt: str,
+        max_tokens: int,
+        history: Optional[List[Dict[str, str]]],
+        hedge: bool,
+        deadline: Deadline,
+        template: Optional[str],
+        text: str,
+        served: Dict[str, Any],
+    ) -> AsyncIterator[str]:
+        """Stream from upstream and cache the response once it completes"""
+        messages = (history or []) + [{"role": "user", "content": prompt}]
+        chunks = []
+        async with aclosing(self._upstream_stream(messages, max_tokens, hedge, deadline, served)) as stream:
+            async for chunk in stream:
+                chunks.append(chunk)
+                yield chunk
+
+        # Only complete, successful responses are cached
+        if chunks:
+            self._store(served["provider"], prompt, max_tokens, history, template, text, chunks)
 
+    def _upstream_stream(
+        self,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        hedge: bool,
+        deadline: Deadline,
+        served: Dict[str, Any] = None,
+    ) -> AsyncIterator[str]:
+        """Stream from the fastest healthy backend, hedging onto the runner-up if asked.
+
+        The backend that ends up serving is recorded in served["provider"].
+        """
+        ranked = self.router.ranked(explore=True)
+        if hedge and len(ranked) > 1:
+            return self._hedged_stream(ranked[0], ranked[1], messages, max_tokens, deadline, served)
+        return self._backend_stream(ranked[0], messages, max_tokens, deadline, served)
+
+    async def _open_stream(
+        self, provider: str, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ):
+        """Start a backend stream and wait for its first chunk.
+
+        Retries with jittered backoff, but only here: once a token has been
+        produced the response is committed to this stream.
+        """
+        attempt = 0
+        while True:
+            if not self.router.acquire(provider):
+                raise CircuitOpenError(provider)
+            started = time.monotonic()
+            stream = self._provider_stream(provider, messages, max_tokens, deadline)
+            try:
+                first_chunk = await deadline.wait(stream.__anext__(), "first_token", provider)
+                ttft = time.monotonic() - started
+                tracing.record("first_token", started, provider=provider, attempt=attempt)
+                self.router.record_first_token(provider, ttft)
+                metrics.TTFT.observe(ttft, provider, self.model_for(provider))
+                return stream, first_chunk
+            except StopAsyncIteration:
+                return stream, None
+            except Exception as e:
+                tracing.record("first_token", started, provider=provider, attempt=attempt, error=type(e).__name__)
+                await stream.aclose()
+                error = as_provider_error(e, provider)
+                self.router.record_error(provider, error)
+                metrics.UPSTREAM_ERRORS.inc(provider, error.code)
+                delay = backoff_delay(attempt)
+                remaining = deadline.timeout("first_token")
+                if (
+                    attempt >= self.max_retries
+                    or not error.retryable
+                    or (remaining is not None and remaining <= delay)
+                ):
+                    raise error
+                attempt += 1
+                logger.warning(f"Retrying {provider} in {delay:.2f}s after: {error}")
+                await asyncio.sleep(delay)
+            except BaseException:
+                # Cancelled (client gone, lost hedge): no verdict, free the breaker slot
+                self.router.release(provider)
+                await stream.aclose()
+                raise
+
+    async def _backend_stream(
+        self,
+        provider: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        deadline: Deadline,
+        served: Dict[str, Any] = None,
+    ) -> AsyncIterator[str]:
+        """Stream from one backend, feeding its latency stats and breaker to the router"""
+        model = self.model_for(provider)
+        started = time.monotonic()
+        metrics.STREAMS_IN_FLIGHT.inc("upstream")
+        try:
+            stream, first_chunk = await self._open_stream(provider, messages, max_tokens, deadline)
+        except BaseException:
+            metrics.STREAMS_IN_FLIGHT.dec("upstream")
+            raise
+        first_token_at = time.monotonic()
+        tokens = 0
+        if served is not None:
+            served["provider"] = provider
+        try:
+            if first_chunk is not None:
+                tokens += 1
+                yield first_chunk
+                while True:
+                    try:
+                        chunk = await deadline.wait(stream.__anext__(), "total", provider)
+                    except StopAsyncIteration:
+                        break
+                    tokens += 1
+                    yield chunk
         except Exception as e:
-            logger.error(f"Fireworks API error: {e}")
-            yield f"Error: {str(e)}"
+            error = as_provider_error(e, provider)
+            self.router.record_error(provider, error)
+            metrics.UPSTREAM_ERRORS.inc(provider, error.code)
+            raise error
+        except BaseException:
+            # Closed or cancelled before the end: neither success nor failure
+            self.router.release(provider)
+            raise
+        finally:
+            metrics.STREAMS_IN_FLIGHT.dec("upstream")
+            await stream.aclose()
+        finished = time.monotonic()
+        tracing.record("stream", first_token_at, finished, provider=provider, tokens=tokens)
+        self.router.record_success(provider, tokens, finished - first_token_at)
+        metrics.STREAM_DURATION.observe(finished - started, provider, model)
+        if tokens > 1 and finished > first_token_at:
+            metrics.TOKENS_PER_SECOND.observe((tokens - 1) / (finished - first_token_at), provider, model)
+
+    async def _hedged_stream(
+        self,
+        primary: str,
+        secondary: str,
+        messages: List[Dict[str, str]],
+        max_tokens: int,
+        deadline: Deadline,
+        served: Dict[str, Any] = None,
+    ) -> AsyncIterator[str]:
+        """Start secondary if primary is slow to its first token; keep whichever wins"""
+        streams = {primary: self._backend_stream(primary, messages, max_tokens, deadline)}
+        first = {primary: asyncio.ensure_future(streams[primary].__anext__())}
+        done, _ = await asyncio.wait(first.values(), timeout=self.router.hedge_delay(primary))
+        primary_failed = bool(done) and not isinstance(
+            first[primary].exception(), (type(None), StopAsyncIteration)
+        )
+        if not done or primary_failed:
+            logger.info(f"Hedging {primary} with {secondary}")
+            streams[secondary] = self._backend_stream(secondary, messages, max_tokens, deadline)
+            first[secondary] = asyncio.ensure_future(streams[secondary].__anext__())
 
-    async def _openai_stream(self, prompt: str) -> AsyncIterator[str]:
+        winner, first_chunk, error = None, None, None
         try:
-            import openai
-            response = await openai.chat.completions.create(
-                model=os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"),
-                messages=[{"role": "user", "content": prompt}],
-                stream=True,
-                max_tokens=1000
+            while first and winner is None:
+                done, _ = await asyncio.wait(first.values(), return_when=asyncio.FIRST_COMPLETED)
+                for name, task in list(first.items()):
+                    if task not in done:
+                        continue
+                    del first[name]
+                    try:
+                        first_chunk = task.result()
+                        winner = name
+                        break
+                    except StopAsyncIteration:
+                        winner = name
+                        break
+                    except Exception as e:
+                        error = e
+        finally:
+            # Cancel the loser (or everything, if we are being cancelled)
+            for task in first.values():
+                task.cancel()
+            for name, stream in streams.items():
+                if name != winner:
+                    try:
+                        await stream.aclose()
+                    except (Exception, asyncio.CancelledError):
+                        pass
+
+        if winner is None:
+            raise error
+        if served is not None:
+            served["provider"] = winner
+        if first_chunk is None:
+            return
+        yield first_chunk
+        async with aclosing(streams[winner]):
+            async for chunk in streams[winner]:
+                yield chunk
+
+    def _provider_stream(
+        self, provider: str, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ) -> AsyncIterator[str]:
+        if provider == "fireworks":
+            return self._fireworks_stream(messages, max_tokens, deadline)
+        elif provider == "openai":
+            return self._openai_stream(messages, max_tokens, deadline)
+        elif provider == "anthropic":
+            return self._anthropic_stream(messages, max_tokens, deadline)
+        raise ValueError(f"Unknown model provider: {provider}")
+
+    async def _fireworks_stream(
+        self, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ) -> AsyncIterator[str]:
+        with tracing.span("client_setup", provider="fireworks"):
+            client = self.client_pool.fireworks_async
+        # Cập nhật API call cho phiên bản mới
+        with tracing.span("connect", provider="fireworks"):
+            response = await deadline.wait(
+                client.chat.completions.create(
+                    model=self.model_for("fireworks"),
+                    messages=messages,
+                    stream=True,
+                    max_tokens=max_tokens
+                ),
+                "connect",
+                "fireworks",
             )
-            
+        
+        try:
             async for chunk in response:
-                if chunk.choices[0].delta.content is not None:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
                     yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
 
-        except Exception as e:
-            logger.error(f"OpenAI API error: {e}")
-            yield f"Error: {str(e)}"
+    async def _openai_stream(
+        self, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ) -> AsyncIterator[str]:
+        with tracing.span("client_setup", provider="openai"):
+            client = self.client_pool.openai
+        with tracing.span("connect", provider="openai"):
+            response = await deadline.wait(
+                client.chat.completions.create(
+                    model=self.model_for("openai"),
+                    messages=messages,
+                    stream=True,
+                    max_tokens=max_tokens
+                ),
+                "connect",
+                "openai",
+            )
+        
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content is not None:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await response.close()
 
-    async def _anthropic_stream(self, prompt: str) -> AsyncIterator[str]:
+    async def _anthropic_stream(
+        self, messages: List[Dict[str, str]], max_tokens: int, deadline: Deadline
+    ) -> AsyncIterator[str]:
+        with tracing.span("client_setup", provider="anthropic"):
+            client = self.client_pool.anthropic
+        manager = client.messages.stream(
+            max_tokens=max_tokens,
+            messages=messages,
+            model=self.model_for("anthropic"),
+        )
+        with tracing.span("connect", provider="anthropic"):
+            stream = await deadline.wait(manager.__aenter__(), "connect", "anthropic")
         try:
-            import anthropic
-            client = anthropic.Anthropic(api_key=self.api_key)
-            
-            with client.messages.stream(
-                max_tokens=1000,
-                messages=[{"role": "user", "content": prompt}],
-                model=os.getenv("ANTHROPIC_MODEL", "claude-3-sonnet-20240229"),
-            ) as stream:
-                async for text in stream.text_stream:
-                    yield text
-                    
-        except Exception as e:
-            logger.error(f"Anthropic API error: {e}")
-            yield f"Error: {str(e)}"
\ No newline at end of file
+            async for text in stream.text_stream:
+                yield text
+        finally:
+            await manager.__aexit__(None, None, None)
@@ -1,27 +1,153 @@
-import json
+import asyncio
+import hashlib
+import logging
 import os
-from typing import Dict, Any
+import time
+from string import Formatter
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TEMPLATES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "templates"
+)
+
+
+class CompiledTemplate:
+    """A prompt template pre-parsed once into literal and field pieces"""
+
+    def __init__(self, name: str, source: str, description: str = ""):
+        self.name = name
+        self.source = source
+        self.description = description
+        self._parts: List[Tuple[str, Optional[str]]] = [
+            (literal, field) for literal, field, _, _ in Formatter().parse(source)
+        ]
+
+    def render(self, prompt: str) -> str:
+        out = []
+        for literal, field in self._parts:
+            out.append(literal)
+            if field is not None:
+                out.append(prompt if field == "prompt" else "")
+        return "".join(out)
+
+    def format(self, prompt: str) -> str:
+        return self.render(prompt)
+
+    def __str__(self) -> str:
+        return self.source
+
+
+PASSTHROUGH = CompiledTemplate("none", "{prompt}")
+
+
+def parse_template_file(name: str, text: str) -> CompiledTemplate:
+    """Parse a template file: leading '# key: value' lines are metadata"""
+    metadata = {}
+    lines = text.splitlines()
+    while lines and lines[0].startswith("#"):
+        key, _, value = lines.pop(0).lstrip("#").partition(":")
+        metadata[key.strip().lower()] = value.strip()
+    return CompiledTemplate(name, "\n".join(lines).strip("\n"), metadata.get("description", ""))
+
 
 class PromptProvider:
-    def __init__(self):
-        self.templates = self._load_templates()
+    def __init__(self, templates_dir: str = None, reload_interval: float = None):
+        self.templates_dir = templates_dir or os.getenv("TEMPLATES_DIR", DEFAULT_TEMPLATES_DIR)
+        self.reload_interval = (
+            reload_interval if reload_interval is not None
+            else float(os.getenv("TEMPLATE_RELOAD_INTERVAL", 2))
+        )
+        self.templates: Dict[str, CompiledTemplate] = {}
+        self._mtimes: Dict[str, float] = {}
+        self._added: Dict[str, CompiledTemplate] = {}
+        self._last_scan = 0.0
+        self._reload_task: Optional[asyncio.Task] = None
+        self.etag = ""
+        self._load_templates()
 
-    def _load_templates(self) -> Dict[str, str]:
-        # Default templates
-        return {
-            "creative": "You are a creative writer. Expand on this idea: {prompt}",
-            "technical": "As a technical expert, explain: {prompt}",
-            "simple": "{prompt}",
-            "detailed": "Provide a detailed analysis of: {prompt}",
-            "image": "Create a detailed prompt for generating an image of: {prompt}. Include style, composition, lighting, and mood details.",
-            "photo": "Generate a photorealistic image description of: {prompt}. Include camera settings, lighting, and environment details."
-        }
+    def _load_templates(self):
+        """Load changed template files and drop deleted ones"""
+        templates = dict(self.templates)
+        mtimes = dict(self._mtimes)
+        seen = set()
+        try:
+            entries = list(os.scandir(self.templates_dir))
+        except FileNotFoundError:
+            logger.warning(f"Templates directory not found: {self.templates_dir}")
+            entries = []
+
+        for entry in entries:
+            name, ext = os.path.splitext(entry.name)
+            if ext != ".txt" or not entry.is_file():
+                continue
+            name = name.lower()
+            seen.add(name)
+            mtime = entry.stat().st_mtime
+            if mtimes.get(name) == mtime:
+                continue
+            try:
+                with open(entry.path, encoding="utf-8") as f:
+                    templates[name] = parse_template_file(name, f.read())
+                mtimes[name] = mtime
+            except (OSError, ValueError) as e:
+                # Keep serving the previous version of a broken template
+                logger.error(f"Failed to load template {entry.path}: {e}")
+
+        for name in set(mtimes) - seen:
+            del mtimes[name]
+            templates.pop(name, None)
+        templates.update(self._added)
+
+        self._last_scan = time.monotonic()
+        if mtimes != self._mtimes or templates.keys() != self.templates.keys():
+            # Swap in a new snapshot so readers never see a partial update
+            self.templates = templates
+            self._mtimes = mtimes
+            self.etag = self._compute_etag()
+            logger.info(f"Loaded {len(templates)} prompt templates")
 
-    async def get_template(self, template_name: str) -> str:
-        return self.templates.get(template_name, "{prompt}")
+    def _compute_etag(self) -> str:
+        digest = hashlib.sha1()
+        for name in sorted(self.templates):
+            digest.update(name.encode("utf-8"))
+            digest.update(self.templates[name].source.encode("utf-8"))
+            digest.update(self.templates[name].description.encode("utf-8"))
+        return f'"{digest.hexdigest()}"'
+
+    def maybe_reload(self):
+        """Rescan the directory in the background once the reload interval has passed"""
+        if self.reload_interval <= 0 or time.monotonic() - self._last_scan < self.reload_interval:
+            return
+        if self._reload_task is not None and not self._reload_task.done():
+            return
+        self._last_scan = time.monotonic()
+        self._reload_task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(self._load_templates)
+        )
+
+    async def get_template(self, template_name: str) -> CompiledTemplate:
+        self.maybe_reload()
+        return self.templates.get(template_name, PASSTHROUGH)
+
+    async def has_template(self, template_name: str) -> bool:
+        self.maybe_reload()
+        return template_name in self.templates
 
     async def add_template(self, name: str, template: str):
-        self.templates[name] = template
+        self._added[name] = CompiledTemplate(name, template)
+        self.templates = {**self.templates, name: self._added[name]}
+        self.etag = self._compute_etag()
 
     async def list_templates(self) -> Dict[str, str]:
-        return self.templates
+        self.maybe_reload()
+        return {name: template.source for name, template in self.templates.items()}
+
+    async def catalog(self) -> Dict[str, str]:
+        """Template names mapped to their descriptions"""
+        self.maybe_reload()
+        return {
+            name: template.description or template.source
+            for name, template in sorted(self.templates.items())
+        }
@@ -0,0 +1,126 @@
+import os
+import random
+from collections import deque
+from typing import Dict, List, Optional
+from .resilience import CircuitBreaker, ProviderError
+
+
+class BackendStats:
+    """Rolling latency and throughput statistics for one backend"""
+
+    def __init__(self, window: int = 100, alpha: float = 0.2):
+        self.ttft_samples = deque(maxlen=window)
+        self.alpha = alpha
+        self.ttft_ewma: Optional[float] = None
+        self.tokens_per_sec_ewma: Optional[float] = None
+
+    def _ewma(self, current: Optional[float], value: float) -> float:
+        return value if current is None else self.alpha * value + (1 - self.alpha) * current
+
+    def record_first_token(self, ttft: float):
+        self.ttft_samples.append(ttft)
+        self.ttft_ewma = self._ewma(self.ttft_ewma, ttft)
+
+    def record_success(self, tokens: int, stream_seconds: float):
+        if tokens and stream_seconds > 0:
+            self.tokens_per_sec_ewma = self._ewma(self.tokens_per_sec_ewma, tokens / stream_seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        if not self.ttft_samples:
+            return None
+        ordered = sorted(self.ttft_samples)
+        index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+        return ordered[index]
+
+
+class ProviderRouter:
+    """Picks the fastest healthy backend and decides when to hedge.
+
+    Backends are ranked by their rolling time-to-first-token; ones without
+    samples yet are assumed to be as fast as ROUTER_DEFAULT_TTFT so they get
+    explored. A ROUTER_EXPLORE_RATE share of picks goes to a random
+    non-leader, so a backend that was once slow keeps getting fresh samples
+    instead of being starved. Each backend has a circuit breaker; open
+    circuits are skipped.
+    """
+
+    def __init__(self, backends: List[str]):
+        self.backends = backends
+        self.stats: Dict[str, BackendStats] = {name: BackendStats() for name in backends}
+        self.breakers: Dict[str, CircuitBreaker] = {name: CircuitBreaker.from_env() for name in backends}
+        self.default_ttft = float(os.getenv("ROUTER_DEFAULT_TTFT", 1.0))
+        self.explore_rate = float(os.getenv("ROUTER_EXPLORE_RATE", 0.05))
+        self.hedge_percentile = float(os.getenv("HEDGE_PERCENTILE", 95))
+        self.hedge_default_delay = float(os.getenv("HEDGE_DELAY", 2.0))
+        self.hedge_min_samples = int(os.getenv("HEDGE_MIN_SAMPLES", 10))
+
+    @classmethod
+    def from_env(cls) -> "ProviderRouter":
+        names = os.getenv("MODEL_PROVIDERS") or os.getenv("MODEL_PROVIDER", "fireworks")
+        return cls([name.strip() for name in names.split(",") if name.strip()])
+
+    def healthy(self, name: str) -> bool:
+        return self.breakers[name].available()
+
+    def acquire(self, name: str) -> bool:
+        """Reserve a call on the backend's circuit breaker"""
+        return self.breakers[name].try_acquire()
+
+    def release(self, name: str):
+        """Return a reservation that ended with neither success nor error"""
+        self.breakers[name].release()
+
+    def ranked(self, explore: bool = False) -> List[str]:
+        """Healthy backends fastest first, falling back to all if none are healthy.
+
+        With explore, an explore_rate share of calls puts a random
+        non-leader first; the leader then comes second, ready to be hedged to.
+        """
+        candidates = [name for name in self.backends if self.healthy(name)] or list(self.backends)
+        ranked = sorted(
+            candidates,
+            key=lambda name: self.stats[name].ttft_ewma
+            if self.stats[name].ttft_ewma is not None else self.default_ttft,
+        )
+        if explore and len(ranked) > 1 and random.random() < self.explore_rate:
+            ranked.insert(0, ranked.pop(random.randrange(1, len(ranked))))
+        return ranked
+
+    def hedge_delay(self, name: str) -> float:
+        """How long to wait for a first token before starting a second backend"""
+        stats = self.stats[name]
+        if len(stats.ttft_samples) < self.hedge_min_samples:
+            return self.hedge_default_delay
+        return stats.percentile(self.hedge_percentile)
+
+    def record_first_token(self, name: str, ttft: float):
+        self.stats[name].record_first_token(ttft)
+
+    def record_success(self, name: str, tokens: int, stream_seconds: float):
+        self.breakers[name].record_success()
+        self.stats[name].record_success(tokens, stream_seconds)
+
+    def record_error(self, name: str, error: ProviderError):
+        """Count timeouts, network errors, 429 and 5xx against the breaker.
+
+        Anything else (a 400, 401 or 422) is the request's fault, not the
+        backend's, so it only frees the reservation.
+        """
+        if error.retryable:
+            self.breakers[name].record_failure()
+        else:
+            self.release(name)
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Breaker state and latency stats per backend, for /health"""
+        return {
+            name: {
+                "healthy": self.healthy(name),
+                "circuit": self.breakers[name].state,
+                "ttft_ewma": stats.ttft_ewma,
+                "ttft_p50": stats.percentile(50),
+                "ttft_p95": stats.percentile(95),
+                "tokens_per_sec": stats.tokens_per_sec_ewma,
+            }
+            for name, stats in self.stats.items()
+        }
@@ -0,0 +1,190 @@
+import asyncio
+import os
+import random
+import time
+from typing import Any, Awaitable, Optional
+
+
+class ProviderError(Exception):
+    """An upstream failure reported to clients as a structured ERROR event"""
+
+    code = "upstream_error"
+
+    def __init__(self, message: str, provider: str = None, retryable: bool = False, code: str = None):
+        super().__init__(message)
+        self.message = message
+        self.provider = provider
+        self.retryable = retryable
+        if code:
+            self.code = code
+
+    def to_dict(self) -> dict:
+        return {
+            "message": self.message,
+            "code": self.code,
+            "provider": self.provider,
+            "retryable": self.retryable,
+        }
+
+
+class CircuitOpenError(ProviderError):
+    code = "circuit_open"
+
+    def __init__(self, provider: str):
+        super().__init__(f"{provider} is unavailable (circuit open)", provider=provider)
+
+
+class DeadlineExceeded(ProviderError):
+    code = "deadline_exceeded"
+
+    def __init__(self, phase: str, provider: str = None):
+        super().__init__(f"Deadline exceeded waiting for {phase}", provider=provider, retryable=True)
+        self.phase = phase
+
+
+def as_provider_error(error: Exception, provider: str) -> ProviderError:
+    """Normalize an SDK exception, marking rate limits, 5xx and network errors retryable"""
+    if isinstance(error, ProviderError):
+        if error.provider is None:
+            error.provider = provider
+        return error
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    if status is not None:
+        retryable = status == 429 or status >= 500
+    else:
+        retryable = isinstance(error, (ConnectionError, TimeoutError, OSError)) or any(
+            name in type(error).__name__ for name in ("Connection", "Timeout")
+        )
+    return ProviderError(str(error) or type(error).__name__, provider=provider, retryable=retryable)
+
+
+def backoff_delay(attempt: int, base: float = 0.2, cap: float = 5.0) -> float:
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Closed -> open after repeated failures -> half-open probe -> closed.
+
+    While open every call fails fast. After reset_timeout a limited number
+    of probe calls are let through; one success closes the circuit and a
+    failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30, half_open_max: int = 1):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max = half_open_max
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probes = 0
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreaker":
+        return cls(
+            failure_threshold=int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5)),
+            reset_timeout=float(os.getenv("BREAKER_RESET_TIMEOUT", 30)),
+            half_open_max=int(os.getenv("BREAKER_HALF_OPEN_MAX", 1)),
+        )
+
+    def _refresh(self):
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+            self._probes = 0
+
+    def available(self) -> bool:
+        """Whether a call would currently be let through, without reserving it"""
+        self._refresh()
+        if self.state == self.HALF_OPEN:
+            return self._probes < self.half_open_max
+        return self.state == self.CLOSED
+
+    def try_acquire(self) -> bool:
+        """Reserve a call; in half-open state this takes one of the probe slots"""
+        if not self.available():
+            return False
+        if self.state == self.HALF_OPEN:
+            self._probes += 1
+        return True
+
+    def release(self):
+        """Give back a call that ended without a verdict, e.g. one that was cancelled.
+
+        Without this a cancelled half-open probe would hold its slot forever
+        and the breaker could never close or reopen.
+        """
+        if self.state == self.HALF_OPEN and self._probes > 0:
+            self._probes -= 1
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probes = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self._probes = 0
+
+
+class Deadline:
+    """Per-request time budget for the connect, first-token and total phases"""
+
+    def __init__(self, connect: float = None, first_token: float = None, total: float = None):
+        self.started = time.monotonic()
+        self.connect = connect
+        self.first_token = first_token
+        self.total = total
+
+    @classmethod
+    def from_env(cls, connect: float = None, first_token: float = None, total: float = None) -> "Deadline":
+        return cls(
+            connect=connect or float(os.getenv("DEADLINE_CONNECT", 10)),
+            first_token=first_token or float(os.getenv("DEADLINE_FIRST_TOKEN", 30)),
+            total=total or float(os.getenv("DEADLINE_TOTAL", 120)),
+        )
+
+    def remaining(self) -> Optional[float]:
+        if self.total is None:
+            return None
+        return self.total - (time.monotonic() - self.started)
+
+    def timeout(self, phase: str) -> Optional[float]:
+        """Seconds left for phase, capped by the total budget"""
+        remaining = self.remaining()
+        if phase == "connect":
+            budget = self.connect
+        elif phase == "first_token":
+            budget = None if self.first_token is None else self.first_token - (time.monotonic() - self.started)
+        else:
+            budget = None
+        if budget is None:
+            return remaining
+        return budget if remaining is None else min(budget, remaining)
+
+    async def wait(self, awaitable: Awaitable, phase: str, provider: str = None) -> Any:
+        timeout = self.timeout(phase)
+        if timeout is None:
+            return await awaitable
+        if timeout <= 0:
+            if asyncio.iscoroutine(awaitable):
+                awaitable.close()
+            raise DeadlineExceeded(phase, provider)
+        try:
+            if hasattr(asyncio, "timeout"):
+                # Python 3.11+: awaits in this task, so an outer cancel is never
+                # swallowed by a chunk that happens to arrive at the same moment
+                async with asyncio.timeout(timeout):
+                    return await awaitable
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(phase, provider)
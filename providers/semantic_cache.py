@@ -0,0 +1,198 @@
+import json
+import logging
+import os
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Largest prime below 2**32, so permuted hashes fit in uint32
+_PRIME = 4294967291
+_WORD = re.compile(r"\w+")
+# Filler words that rarely change what a prompt asks for
+STOP_WORDS = frozenset(
+    "a an the of for to in on at by with and or is are be me my please some".split()
+)
+
+
+def _numpy():
+    # Imported on first use so startup does not pay for NumPy unless the cache is enabled
+    import numpy
+    return numpy
+
+
+def prompt_features(text: str) -> Set[str]:
+    """Order-insensitive features of a prompt: its words plus their character trigrams.
+
+    Casing, punctuation, whitespace, word order, stop words and plural "s"
+    do not change the set; trigrams keep small spelling differences similar.
+    """
+    words = [
+        word[:-1] if len(word) > 3 and word.endswith("s") and not word.endswith("ss") else word
+        for word in _WORD.findall(text.lower()) if word not in STOP_WORDS
+    ]
+    features = set(words)
+    for word in words:
+        padded = f" {word} "
+        features.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+
+class SemanticCache:
+    """Approximate index from prompt text to exact cache keys.
+
+    Prompts are reduced to MinHash signatures whose agreement estimates the
+    Jaccard similarity of their feature sets. Signatures are split into LSH
+    bands so a lookup only scores prompts that share at least one band,
+    and those candidates are scored together with NumPy. Namespaces keep
+    different models and templates apart, and each template can have its
+    own similarity threshold. The index is bounded by max_entries (LRU)
+    and ttl.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.85,
+        thresholds: Optional[Dict[str, float]] = None,
+        max_entries: int = 100000,
+        ttl: float = 3600,
+        num_perm: int = 64,
+        bands: int = 16,
+        seed: int = 1,
+    ):
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        np = _numpy()
+        self.threshold = threshold
+        self.thresholds = thresholds or {}
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.num_perm = num_perm
+        self.bands = bands
+        self._band_width = num_perm // bands * 4
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, _PRIME, num_perm, dtype=np.uint64)[:, None]
+        # Grown by doubling up to max_entries rows
+        self._signatures = np.zeros((min(max_entries, 1024), num_perm), dtype=np.uint32)
+        self._slots: List[Optional[Tuple[str, str, float]]] = []
+        self._free: List[int] = []
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._by_value: Dict[Tuple[str, str], int] = {}
+        self._buckets: Dict[Tuple[str, int, bytes], Set[int]] = {}
+
+    @classmethod
+    def from_env(cls) -> Optional["SemanticCache"]:
+        """Build the cache from SEMANTIC_CACHE_* settings; it is off unless SEMANTIC_CACHE is set"""
+        if os.getenv("SEMANTIC_CACHE", "false").lower() not in ("1", "true", "yes", "on"):
+            return None
+        try:
+            _numpy()
+        except ImportError:
+            logger.warning("SEMANTIC_CACHE is enabled but NumPy is not installed; disabling it")
+            return None
+        return cls(
+            threshold=float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.85)),
+            thresholds=json.loads(os.getenv("SEMANTIC_CACHE_THRESHOLDS", "{}")),
+            max_entries=int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", 100000)),
+            ttl=float(os.getenv("SEMANTIC_CACHE_TTL", 3600)),
+            num_perm=int(os.getenv("SEMANTIC_CACHE_PERMUTATIONS", 64)),
+            bands=int(os.getenv("SEMANTIC_CACHE_BANDS", 16)),
+        )
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    def threshold_for(self, template: Optional[str]) -> float:
+        return self.thresholds.get(template or "none", self.threshold)
+
+    def signature(self, text: str):
+        """MinHash signature of text, or None if it has no words"""
+        features = prompt_features(text)
+        if not features:
+            return None
+        np = _numpy()
+        hashes = np.fromiter(
+            (zlib.crc32(feature.encode()) for feature in features), dtype=np.uint64, count=len(features)
+        )
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1).astype(np.uint32)
+
+    def _band_keys(self, namespace: str, signature) -> Iterable[Tuple[str, int, bytes]]:
+        raw = signature.tobytes()
+        width = self._band_width
+        return [(namespace, band, raw[band * width:(band + 1) * width]) for band in range(self.bands)]
+
+    def _remove(self, slot: int):
+        namespace, value, _ = self._slots[slot]
+        for band_key in self._band_keys(namespace, self._signatures[slot]):
+            bucket = self._buckets.get(band_key)
+            if bucket is not None:
+                bucket.discard(slot)
+                if not bucket:
+                    del self._buckets[band_key]
+        del self._by_value[(namespace, value)]
+        del self._lru[slot]
+        self._slots[slot] = None
+        self._free.append(slot)
+
+    def _allocate(self) -> int:
+        if self._free:
+            return self._free.pop()
+        if len(self._slots) >= self.max_entries:
+            self._remove(next(iter(self._lru)))
+            return self._free.pop()
+        slot = len(self._slots)
+        if slot == len(self._signatures):
+            np = _numpy()
+            grown = np.zeros((min(self.max_entries, slot * 2), self.num_perm), dtype=np.uint32)
+            grown[:slot] = self._signatures
+            self._signatures = grown
+        self._slots.append(None)
+        return slot
+
+    def add(self, namespace: str, text: str, value: str):
+        """Index text under namespace, pointing at value (typically an exact cache key)"""
+        signature = self.signature(text)
+        if signature is None:
+            return
+        existing = self._by_value.get((namespace, value))
+        if existing is not None:
+            self._remove(existing)
+        slot = self._allocate()
+        self._signatures[slot] = signature
+        self._slots[slot] = (namespace, value, time.time() + self.ttl)
+        self._lru[slot] = None
+        self._by_value[(namespace, value)] = slot
+        for band_key in self._band_keys(namespace, signature):
+            self._buckets.setdefault(band_key, set()).add(slot)
+
+    def lookup(self, namespace: str, text: str, template: str = None) -> Optional[Tuple[str, float]]:
+        """Most similar indexed value in namespace as (value, similarity), if above the threshold"""
+        signature = self.signature(text)
+        if signature is None:
+            return None
+        candidates: Set[int] = set()
+        for band_key in self._band_keys(namespace, signature):
+            bucket = self._buckets.get(band_key)
+            if bucket:
+                candidates |= bucket
+        if not candidates:
+            return None
+
+        np = _numpy()
+        slots = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+        scores = (self._signatures[slots] == signature).mean(axis=1)
+        best = int(scores.argmax())
+        similarity = float(scores[best])
+        slot = int(slots[best])
+        if similarity < self.threshold_for(template):
+            return None
+        _, value, expires_at = self._slots[slot]
+        if expires_at < time.time():
+            self._remove(slot)
+            return None
+        self._lru.move_to_end(slot)
+        return value, similarity
@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """One upstream stream and the chunks it has produced so far"""
+
+    def __init__(self):
+        self.chunks: List[str] = []
+        # Whatever the upstream reports about itself, e.g. which backend served it
+        self.info: Dict[str, Any] = {}
+        self.done = False
+        self.error: Optional[BaseException] = None
+        # Chunks taken so far by each subscriber
+        self.cursors: Dict[object, int] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+        self.consumed = asyncio.Event()
+
+    @property
+    def subscribers(self) -> int:
+        return len(self.cursors)
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def notify_consumed(self):
+        self.consumed.set()
+        self.consumed = asyncio.Event()
+
+
+class SingleFlight:
+    """Coalesces identical in-flight streams onto a single upstream call.
+
+    The first subscriber for a key starts the upstream stream in a
+    background task. Later subscribers replay the chunks already produced
+    and then follow the live tail, each with its own cursor so a slow
+    reader never holds back the others. The upstream read stays at most
+    max_lead chunks ahead of the fastest subscriber, so a flight whose
+    readers all stall stops reading upstream just like a single stream.
+    The upstream call is cancelled once every subscriber has gone away.
+    """
+
+    def __init__(self, max_lead: int = 16):
+        self.max_lead = max(1, max_lead)
+        self._flights: Dict[str, _Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    async def _run(self, key: str, flight: _Flight, stream: AsyncIterator[str]):
+        try:
+            async for chunk in stream:
+                flight.chunks.append(chunk)
+                flight.notify()
+                while len(flight.chunks) - max(flight.cursors.values(), default=0) >= self.max_lead:
+                    await flight.consumed.wait()
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+
+    async def subscribe(
+        self,
+        key: str,
+        factory: Callable[[Dict[str, Any]], AsyncIterator[str]],
+        info: Dict[str, Any] = None,
+    ) -> AsyncIterator[str]:
+        """Yield the stream for key, starting it with factory(flight_info) if nobody has yet.
+
+        The upstream fills in flight_info; it is copied into info before
+        each chunk is yielded.
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = _Flight()
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(key, flight, factory(flight.info)))
+        else:
+            logger.debug(f"Joining in-flight stream {key[:12]}")
+
+        token = object()
+        flight.cursors[token] = 0
+        cursor = 0
+        try:
+            while True:
+                if cursor < len(flight.chunks):
+                    chunk = flight.chunks[cursor]
+                    cursor += 1
+                    flight.cursors[token] = cursor
+                    flight.notify_consumed()
+                    if info is not None:
+                        info.update(flight.info)
+                    yield chunk
+                    continue
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await flight.changed.wait()
+        finally:
+            del flight.cursors[token]
+            flight.notify_consumed()
+            if flight.subscribers == 0 and not flight.done:
+                # Nobody is listening any more; stop paying for the upstream
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                flight.task.cancel()
@@ -0,0 +1,159 @@
+import logging
+import os
+import random
+import signal
+import time
+from typing import Callable, Dict, Optional
+
+import uvicorn
+
+from monitoring.shared_metrics import SharedMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class WorkerSupervisor:
+    """Pre-fork multi-worker server.
+
+    The parent binds the listening socket, runs preload (imports, templates)
+    and then forks the workers, so they start with that work already done
+    and share its memory copy-on-write. Each worker runs its own uvicorn
+    server and event loop on the inherited socket; anything holding
+    threads, connections or an event loop is created after the fork, in
+    the app's lifespan.
+
+    Workers share local state through sqlite files in WAL mode: the
+    completion cache (COMPLETION_CACHE_PATH), session history
+    (SESSION_STORE=sqlite) and metrics (METRICS_SHARED_PATH), which /metrics
+    on any worker sums across all of them. Admission limits, single-flight
+    and resumable streams remain per worker.
+
+    SIGTERM or SIGINT stops the workers gracefully: they stop accepting,
+    let in-flight streams finish for up to drain_timeout seconds and then
+    cancel the rest. Workers that die are restarted.
+    """
+
+    def __init__(
+        self,
+        app,
+        host: str = "0.0.0.0",
+        port: int = 8000,
+        workers: int = None,
+        drain_timeout: float = 30,
+        preload: Callable[[], None] = None,
+    ):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.drain_timeout = drain_timeout
+        self.preload = preload
+        self.restart_delay = 1.0
+        self._children: Dict[int, int] = {}
+        self._started: Dict[int, float] = {}
+        self._stopping = False
+        self._kill_at: Optional[float] = None
+
+    @classmethod
+    def from_env(cls, app, host: str, port: int, preload: Callable[[], None] = None) -> "WorkerSupervisor":
+        return cls(
+            app,
+            host=host,
+            port=port,
+            # 0 means one worker per core
+            workers=int(os.getenv("WORKERS", 0)),
+            drain_timeout=float(os.getenv("WORKER_DRAIN_TIMEOUT", 30)),
+            preload=preload,
+        )
+
+    @staticmethod
+    def shared_state_defaults():
+        """Point per-process stores at shared sqlite files unless configured otherwise"""
+        os.environ.setdefault("METRICS_SHARED_PATH", "data/metrics.db")
+        if os.getenv("COMPLETION_CACHE", "true").lower() not in ("0", "false", "no", "off"):
+            os.environ.setdefault("COMPLETION_CACHE_PATH", "data/completions.db")
+        os.environ.setdefault("SESSION_STORE", "sqlite")
+        os.environ.setdefault("SESSION_DB_PATH", "data/sessions.db")
+        for name in ("METRICS_SHARED_PATH", "COMPLETION_CACHE_PATH", "SESSION_DB_PATH"):
+            path = os.getenv(name)
+            if path:
+                os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        SharedMetrics.reset(os.environ["METRICS_SHARED_PATH"])
+
+    def _spawn(self, worker_id: int):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = worker_id
+            self._started[worker_id] = time.monotonic()
+            return
+
+        # Worker: uvicorn installs its own SIGINT/SIGTERM handlers
+        signal.signal(signal.SIGINT, signal.SIG_DFL)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        os.environ["WORKER_ID"] = str(worker_id)
+        random.seed()
+        code = 0
+        try:
+            uvicorn.Server(self.config).run(sockets=[self.socket])
+        except BaseException as e:
+            logger.error(f"Worker {worker_id} failed: {e}")
+            code = 1
+        finally:
+            os._exit(code)
+
+    def _stop(self, signum, frame):
+        if not self._stopping:
+            logger.info(f"Draining {len(self._children)} workers (up to {self.drain_timeout:.0f}s)")
+            self._stopping = True
+            self._kill_at = time.monotonic() + self.drain_timeout + 5
+        for pid in list(self._children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self):
+        self.shared_state_defaults()
+        self.config = uvicorn.Config(
+            self.app, host=self.host, port=self.port, timeout_graceful_shutdown=self.drain_timeout
+        )
+        self.socket = self.config.bind_socket()
+        if self.preload is not None:
+            self.preload()
+
+        signal.signal(signal.SIGINT, self._stop)
+        signal.signal(signal.SIGTERM, self._stop)
+        logger.info(f"Starting {self.workers} workers on {self.host}:{self.port}")
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                if self._kill_at is not None and time.monotonic() > self._kill_at:
+                    logger.warning(f"Killing {len(self._children)} workers that did not drain in time")
+                    for child in list(self._children):
+                        try:
+                            os.kill(child, signal.SIGKILL)
+                        except ProcessLookupError:
+                            pass
+                    self._kill_at = None
+                time.sleep(0.2)
+                continue
+
+            worker_id = self._children.pop(pid)
+            if self._stopping:
+                continue
+            code = os.waitstatus_to_exitcode(status)
+            logger.warning(f"Worker {worker_id} (pid {pid}) exited with {code}; restarting")
+            # Don't spin on a worker that crashes during startup
+            if time.monotonic() - self._started[worker_id] < 5:
+                time.sleep(self.restart_delay)
+            if not self._stopping:
+                self._spawn(worker_id)
+
+        self.socket.close()
+        logger.info("All workers stopped")
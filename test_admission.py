@@ -0,0 +1,16 @@
+from api.admission import AdmissionController
+
+
+def test_client_limit_is_opt_in(monkeypatch):
+    monkeypatch.delenv("ADMISSION_CLIENT_RATE", raising=False)
+    admission = AdmissionController.from_env()
+    for _ in range(100):
+        admission.check_rate(client="10.0.0.1")
+
+
+def test_client_id_behind_trusted_proxy():
+    admission = AdmissionController(trusted_proxies=["10.0.0.1"])
+    assert admission.client_id("10.0.0.1", "203.0.113.9, 198.51.100.4") == "198.51.100.4"
+    assert admission.client_id("10.0.0.1", None) == "10.0.0.1"
+    # Only a trusted peer may speak for its clients
+    assert admission.client_id("192.0.2.7", "203.0.113.9") == "192.0.2.7"
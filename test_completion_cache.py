@@ -0,0 +1,19 @@
+import os
+import tempfile
+import time
+
+from providers.completion_cache import SqliteCacheBackend
+
+
+def test_purge_drops_expired_and_surplus_rows():
+    backend = SqliteCacheBackend(os.path.join(tempfile.mkdtemp(), "cache.db"), max_rows=3)
+    now = time.time()
+    backend.set("expired", now - 1, ["x"])
+    for i in range(5):
+        backend.set(f"live{i}", now + 60 + i, ["x"])
+
+    assert backend.purge_expired() == 3
+    assert backend.get("expired") is None
+    # The three that expire last are kept
+    assert [backend.get(f"live{i}") is not None for i in range(5)] == [False, False, True, True, True]
+    backend.close()
@@ -0,0 +1,197 @@
+import asyncio
+import json
+import os
+import tempfile
+
+import httpx
+from fastapi import FastAPI
+
+from agents.intent_router import IntentRouter
+from api.admission import AdmissionController
+from api.endpoints import router
+from api.streaming import SSEResponseHandler, StreamRegistry
+from providers.prompt_provider import PromptProvider
+
+
+class RecordingAgent:
+    """Stands in for PromptAgent, answering with the session each item ran in"""
+
+    def intent(self, prompt, template_name=None):
+        return "text"
+
+    def provider_name(self, prompt, template_name=None):
+        return "fireworks"
+
+    async def assist(self, session, query, handler):
+        stream = handler.create_text_stream("AI_RESPONSE")
+        await stream.emit_chunk(repr(session.session_id))
+        await handler.complete()
+
+
+def _app(agent) -> FastAPI:
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.state.agent = agent
+    app.state.admission = AdmissionController()
+    app.state.streams = StreamRegistry()
+    return app
+
+
+def test_batch_items_do_not_use_session_history():
+    async def main():
+        transport = httpx.ASGITransport(app=_app(RecordingAgent()))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            response = await client.post("/api/batch", json={
+                "session_id": "user-1", "prompts": [{"prompt": "a"}, {"prompt": "b"}],
+            })
+        return [json.loads(line) for line in response.text.splitlines()]
+
+    results = asyncio.run(main())
+    assert sorted(result["index"] for result in results) == [0, 1]
+    assert all(result["response"] == "None" for result in results)
+
+
+class ImageAgent:
+    """Routes like PromptAgent; image requests yield one image and one failed variant"""
+
+    class prompt_provider:
+        @staticmethod
+        async def has_template(name):
+            return True
+
+    def route(self, prompt, template_name=None):
+        return IntentRouter().classify(prompt, template_name)
+
+    async def assist(self, session, query, handler):
+        await handler.emit_json("IMAGE_GENERATED", {"image_url": "/images/a.png", "variant": 0})
+        await handler.emit_error("IMAGE_ERROR", {"message": "Image generation failed: variant 1"})
+        if query.timing:
+            await handler.emit_json("TIMING", {"total_ms": 1.0, "spans": [{"name": "image_variants"}]})
+        await handler.complete()
+
+    async def respond(self, session, query):
+        raise AssertionError("an image template must not be answered as text")
+
+
+def test_chat_routes_on_template_and_reports_failed_variants():
+    async def main():
+        transport = httpx.ASGITransport(app=_app(ImageAgent()))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await client.post("/api/chat", json={
+                "prompt": "a quiet harbour", "template_name": "image", "image_count": 2, "timing": True,
+            })
+
+    response = asyncio.run(main())
+    assert response.status_code == 200
+    body = response.json()
+    assert [image["variant"] for image in body["images"]] == [0]
+    assert body["errors"] == [{"type": "IMAGE_ERROR", "message": "Image generation failed: variant 1"}]
+    assert body["template_used"] == "image"
+    assert body["timing"]["spans"] == [{"name": "image_variants"}]
+
+
+class CountingAgent(RecordingAgent):
+    """Streams a fixed answer and counts how many generations it started"""
+
+    def __init__(self):
+        self.calls = 0
+
+    async def assist(self, session, query, handler):
+        self.calls += 1
+        stream = handler.create_text_stream("AI_RESPONSE")
+        for word in ["one", "two", "three", "four"]:
+            await stream.emit_chunk(word)
+        await handler.complete()
+
+
+def _events(body: str):
+    """(id, event type) for each SSE frame"""
+    events = []
+    for frame in body.strip().split("\n\n"):
+        fields = dict(line.split(": ", 1) for line in frame.splitlines())
+        events.append((fields["id"], json.loads(fields["data"])["type"]))
+    return events
+
+
+def test_last_event_id_resumes_mid_stream():
+    agent = CountingAgent()
+
+    async def main():
+        transport = httpx.ASGITransport(app=_app(agent))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/api/stream", params={"prompt": "count", "frames": "token"})
+            stream_id = first.headers["x-stream-id"]
+            resumed = await client.get(
+                "/api/stream", params={"prompt": "count", "frames": "token"},
+                headers={"Last-Event-ID": f"{stream_id}:2"},
+            )
+        return stream_id, _events(first.text), _events(resumed.text), resumed.headers["x-stream-id"]
+
+    stream_id, first, resumed, resumed_id = asyncio.run(main())
+    assert agent.calls == 1
+    assert resumed_id == stream_id
+    assert resumed == first[2:]
+    assert resumed[-1][1] == "DONE"
+
+
+def test_last_event_id_after_abandonment_generates_again():
+    agent = CountingAgent()
+    app = _app(agent)
+
+    async def main():
+        handler = app.state.streams.register(SSEResponseHandler(frame_format="token", resume_grace=0.01))
+
+        async def hanging():
+            await handler.create_text_stream("AI_RESPONSE").emit_chunk("partial")
+            await asyncio.sleep(3600)
+
+        handler.start(hanging())
+        events = handler.events()
+        await events.__anext__()
+        # The only client leaves and nobody resumes within the grace period
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        recorded = [event for event in handler._events if event[1] == "ERROR"]
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            resumed = await client.get(
+                "/api/stream", params={"prompt": "count"},
+                headers={"Last-Event-ID": f"{handler.stream_id}:1"},
+            )
+        return handler.stream_id, recorded, resumed
+
+    stream_id, recorded, resumed = asyncio.run(main())
+    assert [data["code"] for _, _, data, _ in recorded] == ["stream_abandoned"]
+    assert resumed.headers["x-stream-id"] != stream_id
+    assert agent.calls == 1
+    assert _events(resumed.text)[-1][1] == "DONE"
+
+
+class TemplateAgent:
+    def __init__(self, prompt_provider):
+        self.prompt_provider = prompt_provider
+
+
+def test_templates_answer_304_until_they_change():
+    directory = tempfile.mkdtemp()
+    with open(os.path.join(directory, "poem.txt"), "w", encoding="utf-8") as f:
+        f.write("# description: Short poems\nWrite a poem about {prompt}")
+    provider = PromptProvider(directory, reload_interval=0)
+
+    async def main():
+        transport = httpx.ASGITransport(app=_app(TemplateAgent(provider)))
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            first = await client.get("/api/templates")
+            etag = first.headers["etag"]
+            cached = await client.get("/api/templates", headers={"If-None-Match": etag})
+            await provider.add_template("haiku", "A haiku about {prompt}")
+            changed = await client.get("/api/templates", headers={"If-None-Match": etag})
+        return first, cached, changed
+
+    first, cached, changed = asyncio.run(main())
+    assert first.json() == {"templates": {"poem": "Short poems"}}
+    assert (cached.status_code, cached.headers["etag"], cached.content) == (304, first.headers["etag"], b"")
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != first.headers["etag"]
+    assert "haiku" in changed.json()["templates"]
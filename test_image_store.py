@@ -0,0 +1,15 @@
+import os
+import tempfile
+
+from providers.image_store import ImageStore
+
+
+def test_prune_removes_oldest_images_past_the_byte_cap():
+    store = ImageStore(tempfile.mkdtemp(), max_bytes=250)
+    for i in range(4):
+        store.put(f"image{i}", b"x" * 100)
+        os.utime(store.path(f"image{i}"), (1000 + i, 1000 + i))
+
+    assert store.prune() == 2
+    assert [store.contains(f"image{i}") for i in range(4)] == [False, False, True, True]
+    assert store.prune() == 0
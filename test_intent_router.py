@@ -0,0 +1,47 @@
+import pytest
+
+from agents.intent_router import IntentRouter
+
+router = IntentRouter()
+
+
+@pytest.mark.parametrize("prompt", [
+    # Prompts the original substring matcher sent to image generation
+    "draw a cat",
+    "Draw me a dragon",
+    "a drawing of a cat",
+    "photo of a cat",
+    "photograph of a cat",
+    "photographs of the coast at dusk",
+    "photorealistic portrait of an astronaut",
+    "visualize a city at night",
+    "visualise a city at night",
+    "generate image of a lighthouse",
+    "generate images of lighthouses",
+    "create an image of a forest",
+    "make a picture of my dog",
+    "an image of a red car",
+    "picture of a sunset",
+])
+def test_image_prompts(prompt):
+    assert router.classify(prompt).intent == "image"
+
+
+@pytest.mark.parametrize("prompt", [
+    "How do I make a withdrawal from my savings account?",
+    "Explain photosynthesis",
+    "What is a photon?",
+    "Write a poem about the sea",
+])
+def test_text_prompts(prompt):
+    assert router.classify(prompt).intent == "text"
+
+
+def test_template_tag_decides_intent():
+    route = router.classify("@photo a quiet harbour")
+    assert route == ("image", "photo", "a quiet harbour")
+
+
+def test_explicit_template_decides_intent():
+    assert router.classify("a quiet harbour", "image") == ("image", "image", "a quiet harbour")
+    assert router.classify("draw up a contract", "poem").intent == "text"
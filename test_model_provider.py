@@ -0,0 +1,37 @@
+import asyncio
+
+from providers.completion_cache import CompletionCache
+from providers.model_provider import ModelProvider
+
+
+def test_response_is_attributed_to_the_backend_that_served_it(monkeypatch):
+    monkeypatch.setenv("MODEL_PROVIDERS", "fireworks,openai")
+    monkeypatch.setenv("SEMANTIC_CACHE", "false")
+    provider = ModelProvider(api_key="test", cache=CompletionCache())
+    # The router prefers the second backend
+    provider.router.stats["openai"].ttft_ewma = 0.01
+    provider.router.stats["fireworks"].ttft_ewma = 1.0
+
+    async def openai(messages, max_tokens, deadline):
+        yield "from openai"
+
+    provider._openai_stream = openai
+
+    async def main():
+        served = {}
+        chunks = [chunk async for chunk in provider.query_stream("hi", 16, served=served)]
+        return chunks, served
+
+    chunks, served = asyncio.run(main())
+    assert chunks == ["from openai"]
+    assert served == {"cache": "miss", "provider": "openai"}
+    # One cache lookup per request
+    assert (provider.cache.hits, provider.cache.misses) == (0, 1)
+    assert provider.cache.contains(provider._cache_key("openai", "hi", 16))
+    assert not provider.cache.contains(provider._cache_key("fireworks", "hi", 16))
+
+    # A repeat is served from the cache and still reports the backend that produced it
+    chunks, served = asyncio.run(main())
+    assert (chunks, served) == (["from openai"], {"cache": "hit", "provider": "openai"})
+    result = asyncio.run(provider.complete("hi", 16))
+    assert (result["provider"], result["cache"]) == ("openai", "hit")
@@ -0,0 +1,68 @@
+import asyncio
+import json
+
+from api.admission import AdmissionController
+from api.multiplex import MultiplexConnection
+
+
+class FakeWebSocket:
+    """Feeds scripted ASGI receive events and records sent text frames"""
+
+    client = None
+    headers = {}
+
+    def __init__(self, frames):
+        self.frames = list(frames) + [{"type": "websocket.disconnect"}]
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def receive(self):
+        # Let the writer task flush replies between messages
+        await asyncio.sleep(0.01)
+        return self.frames.pop(0)
+
+    async def send_text(self, text):
+        self.sent.append(json.loads(text))
+
+
+def test_malformed_messages_get_errors_and_keep_the_socket_open():
+    websocket = FakeWebSocket([
+        {"type": "websocket.receive", "bytes": b"\x00\x01"},
+        {"type": "websocket.receive", "text": "not json"},
+        {"type": "websocket.receive", "text": json.dumps({"op": "cancel", "id": [1]})},
+        {"type": "websocket.receive", "text": json.dumps({"op": "cancel", "id": "unknown"})},
+        {"type": "websocket.receive", "text": json.dumps({"op": "nope", "id": "a"})},
+    ])
+    # Malformed messages are rejected before the agent is involved
+    asyncio.run(MultiplexConnection(websocket, None, AdmissionController()).run())
+
+    assert [(message["id"], message["type"]) for message in websocket.sent] == [
+        (None, "ERROR"), (None, "ERROR"), (None, "ERROR"), ("a", "ERROR"),
+    ]
+    assert websocket.sent[2]["data"] == {"message": "Messages need a string id"}
+
+
+class HangingAgent:
+    """Keeps every request running until the socket closes"""
+
+    def intent(self, prompt, template_name=None):
+        return "text"
+
+    async def assist(self, session, query, handler):
+        await asyncio.sleep(3600)
+
+
+def test_requests_that_cannot_start_end_with_rejected():
+    websocket = FakeWebSocket([
+        {"type": "websocket.receive", "text": json.dumps({"op": "prompt", "id": "no-prompt"})},
+        {"type": "websocket.receive", "text": json.dumps({"op": "prompt", "id": "bad", "prompt": "hi", "frames": "x"})},
+        {"type": "websocket.receive", "text": json.dumps({"op": "prompt", "id": "live", "prompt": "hi"})},
+        {"type": "websocket.receive", "text": json.dumps({"op": "prompt", "id": "live", "prompt": "again"})},
+    ])
+    asyncio.run(MultiplexConnection(websocket, HangingAgent(), AdmissionController()).run())
+
+    rejected = [(message["id"], message["data"]["reason"]) for message in websocket.sent if message["type"] == "REJECTED"]
+    assert rejected == [("no-prompt", "invalid_request"), ("bad", "invalid_request"), ("live", "duplicate_id")]
+    assert not any(message["type"] == "ERROR" for message in websocket.sent)
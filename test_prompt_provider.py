@@ -0,0 +1,46 @@
+import os
+import tempfile
+
+from providers.prompt_provider import PromptProvider, parse_template_file
+
+
+def _write(directory: str, name: str, text: str, mtime: float):
+    path = os.path.join(directory, f"{name}.txt")
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.utime(path, (mtime, mtime))
+
+
+def test_description_lines_are_metadata():
+    template = parse_template_file("poem", "# description: Short poems\n# author: x\n\nWrite a poem about {prompt}\n")
+    assert template.description == "Short poems"
+    assert template.source == "Write a poem about {prompt}"
+    assert template.render("the sea") == "Write a poem about the sea"
+
+
+def test_reload_parses_only_changed_files():
+    directory = tempfile.mkdtemp()
+    _write(directory, "a", "A {prompt}", 1000)
+    _write(directory, "b", "B {prompt}", 1000)
+    provider = PromptProvider(directory, reload_interval=0)
+    unchanged, etag = provider.templates["b"], provider.etag
+
+    _write(directory, "a", "A2 {prompt}", 2000)
+    provider._load_templates()
+    assert provider.templates["a"].source == "A2 {prompt}"
+    # Same mtime, so b was not read again
+    assert provider.templates["b"] is unchanged
+    assert provider.etag != etag
+
+
+def test_reload_drops_deleted_files():
+    directory = tempfile.mkdtemp()
+    _write(directory, "a", "A {prompt}", 1000)
+    _write(directory, "b", "B {prompt}", 1000)
+    provider = PromptProvider(directory, reload_interval=0)
+    etag = provider.etag
+
+    os.remove(os.path.join(directory, "b.txt"))
+    provider._load_templates()
+    assert sorted(provider.templates) == ["a"]
+    assert provider.etag != etag
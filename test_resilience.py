@@ -0,0 +1,123 @@
+import asyncio
+import time
+
+from providers.completion_cache import CompletionCache
+from providers.model_provider import ModelProvider
+from providers.provider_router import ProviderRouter
+from providers.resilience import CircuitBreaker, Deadline
+
+
+def _half_open(breaker: CircuitBreaker):
+    breaker.state = breaker.OPEN
+    breaker.opened_at = time.monotonic() - breaker.reset_timeout - 1
+
+
+def _provider(monkeypatch) -> ModelProvider:
+    monkeypatch.setenv("MODEL_PROVIDERS", "fireworks")
+    monkeypatch.setenv("SEMANTIC_CACHE", "false")
+    return ModelProvider(api_key="test", cache=CompletionCache(max_entries=0))
+
+
+def test_release_frees_half_open_probe():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=30, half_open_max=1)
+    _half_open(breaker)
+    assert breaker.try_acquire()
+    assert not breaker.try_acquire()
+    breaker.release()
+    assert breaker.try_acquire()
+
+
+def test_cancelled_probe_before_first_token(monkeypatch):
+    provider = _provider(monkeypatch)
+    breaker = provider.router.breakers["fireworks"]
+    _half_open(breaker)
+
+    async def hanging(messages, max_tokens, deadline):
+        await asyncio.sleep(3600)
+        yield "never"
+
+    provider._fireworks_stream = hanging
+
+    async def main():
+        stream = provider._backend_stream("fireworks", [], 8, Deadline())
+        task = asyncio.ensure_future(stream.__anext__())
+        await asyncio.sleep(0.01)
+        assert not breaker.available()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert breaker.state == breaker.HALF_OPEN
+    assert breaker.available()
+
+
+def test_probe_closed_mid_stream(monkeypatch):
+    provider = _provider(monkeypatch)
+    breaker = provider.router.breakers["fireworks"]
+    _half_open(breaker)
+
+    async def endless(messages, max_tokens, deadline):
+        while True:
+            yield "token"
+            await asyncio.sleep(0)
+
+    provider._fireworks_stream = endless
+
+    async def main():
+        stream = provider._backend_stream("fireworks", [], 8, Deadline())
+        assert await stream.__anext__() == "token"
+        assert not breaker.available()
+        # What a disconnecting client or a losing hedge does to the generator
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert breaker.available()
+
+
+class StatusError(Exception):
+    def __init__(self, status_code):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+
+
+def test_only_upstream_failures_open_the_breaker(monkeypatch):
+    provider = _provider(monkeypatch)
+    monkeypatch.setattr(provider, "max_retries", 0)
+    breaker = provider.router.breakers["fireworks"]
+    status = 400
+
+    async def failing(messages, max_tokens, deadline):
+        raise StatusError(status)
+        yield
+
+    provider._fireworks_stream = failing
+
+    async def fail_times(count):
+        for _ in range(count):
+            try:
+                await provider._open_stream("fireworks", [], 8, Deadline())
+            except Exception:
+                pass
+
+    # A bad request says nothing about the backend's health
+    asyncio.run(fail_times(breaker.failure_threshold + 1))
+    assert breaker.state == breaker.CLOSED
+    status = 503
+    asyncio.run(fail_times(breaker.failure_threshold))
+    assert breaker.state == breaker.OPEN
+
+
+def test_router_keeps_exploring_slow_backends(monkeypatch):
+    monkeypatch.setenv("ROUTER_EXPLORE_RATE", "0.5")
+    router = ProviderRouter(["fast", "slow"])
+    router.record_first_token("fast", 0.1)
+    router.record_first_token("slow", 5.0)
+
+    leaders = [router.ranked(explore=True)[0] for _ in range(200)]
+    assert 0 < leaders.count("slow") < 200
+    # Without explore the order is the plain latency ranking
+    assert all(router.ranked() == ["fast", "slow"] for _ in range(20))
@@ -0,0 +1,34 @@
+import asyncio
+import os
+import tempfile
+import time
+
+from agents.session_store import MemorySessionStore, SessionStore, SqliteSessionStore
+
+
+def test_sessions_keep_at_most_four_characters_per_budget_token():
+    path = os.path.join(tempfile.mkdtemp(), "sessions.db")
+    for backend in (MemorySessionStore(max_chars=400), SqliteSessionStore(path, max_chars=400)):
+        store = SessionStore(backend, token_budget=100)
+
+        async def main():
+            for i in range(5):
+                await store.record("user-1", f"q{i}", str(i) * 150)
+            return backend.get_turns("user-1")
+
+        turns = asyncio.run(main())
+        # Oldest turns go first once the session passes 400 characters
+        assert turns == [("user", "q3"), ("assistant", "3" * 150), ("user", "q4"), ("assistant", "4" * 150)]
+        backend.close()
+
+
+def test_sqlite_evicts_idle_sessions_by_last_access():
+    backend = SqliteSessionStore(os.path.join(tempfile.mkdtemp(), "sessions.db"), idle_ttl=60)
+    backend.extend("old", [("user", "a"), ("assistant", "b")])
+    backend.extend("new", [("user", "c"), ("assistant", "d")])
+    backend._conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = 'old'", (time.time() - 120,))
+
+    backend.evict_idle()
+    assert backend.get_turns("old") == []
+    assert backend.get_turns("new") == [("user", "c"), ("assistant", "d")]
+    backend.close()
@@ -0,0 +1,33 @@
+import asyncio
+
+from providers.single_flight import SingleFlight
+
+
+def test_flight_is_paced_by_fastest_subscriber():
+    reads = []
+
+    async def upstream(info):
+        for i in range(100):
+            reads.append(i)
+            yield str(i)
+
+    async def main():
+        flights = SingleFlight(max_lead=4)
+        fast = flights.subscribe("key", upstream)
+        slow = flights.subscribe("key", upstream)
+        assert await fast.__anext__() == "0"
+        assert await slow.__anext__() == "0"
+        await asyncio.sleep(0.05)
+        # Both readers stalled after one chunk: the upstream read stops max_lead ahead
+        assert len(reads) == 1 + 4
+        for _ in range(10):
+            await fast.__anext__()
+        await asyncio.sleep(0.05)
+        assert len(reads) == 11 + 4
+        rest = [chunk async for chunk in slow]
+        await fast.aclose()
+        return rest
+
+    rest = asyncio.run(main())
+    assert rest == [str(i) for i in range(1, 100)]
+    assert len(reads) == 100
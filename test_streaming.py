@@ -0,0 +1,123 @@
+import asyncio
+
+from api.streaming import SSEResponseHandler
+
+
+def _handler(**kwargs) -> SSEResponseHandler:
+    return SSEResponseHandler(frame_format="token", resume_grace=0, **kwargs)
+
+
+def test_producer_waits_for_slowest_subscriber():
+    async def main():
+        handler = _handler(max_queue_size=4, max_events=4)
+
+        async def produce():
+            for i in range(20):
+                await handler.emit_text_block("TEXT", str(i))
+
+        fast_events = handler.events()
+        slow_events = handler.events()
+        # Attach both before anything is produced
+        fast_first = asyncio.ensure_future(fast_events.__anext__())
+        slow_first = asyncio.ensure_future(slow_events.__anext__())
+        await asyncio.sleep(0)
+        handler.start(produce())
+
+        await fast_first
+        for _ in range(4):
+            await fast_events.__anext__()
+        await asyncio.sleep(0.05)
+        # The slow reader is at seq 1, so the producer stops max_queue_size past it
+        assert handler._next_seq - 1 == 1 + handler.max_queue_size
+        await fast_events.aclose()
+
+        slow = [(await slow_first)[2]]
+        async for seq, type, data in slow_events:
+            slow.append(data)
+        await slow_events.aclose()
+        return slow
+
+    slow = asyncio.run(main())
+    assert slow[:20] == [str(i) for i in range(20)]
+
+
+def test_evicted_subscriber_gets_error():
+    async def main():
+        handler = _handler(max_queue_size=2, max_events=4)
+
+        async def produce():
+            for i in range(10):
+                await handler.emit_text_block("TEXT", str(i))
+            await handler.complete()
+
+        await handler.start(produce())
+        received = [event async for event in handler.events(last_seq=1)]
+        return received
+
+    received = asyncio.run(main())
+    assert len(received) == 1
+    seq, type, data = received[0]
+    assert (seq, type, data["code"]) == (1, "ERROR", "stream_lagged")
+
+
+def test_detached_stream_pauses_during_resume_grace():
+    async def main():
+        handler = SSEResponseHandler(frame_format="token", resume_grace=5, max_queue_size=8)
+
+        async def produce():
+            for i in range(1000):
+                await handler.emit_text_block("TEXT", str(i))
+            await handler.complete()
+
+        handler.start(produce())
+        events = handler.events()
+        for _ in range(3):
+            await events.__anext__()
+        await events.aclose()
+        await asyncio.sleep(0.2)
+        produced = handler._next_seq - 1
+        handler.cancel()
+        return produced
+
+    # Paced by the departed reader's cursor instead of draining the upstream
+    assert asyncio.run(main()) == 3 + 8
+
+
+def _chunks(handler: SSEResponseHandler, frame_format: str = None, pause_after: int = None):
+    """Text frames a reader sees for deltas a..f, optionally pausing mid-stream"""
+    async def main():
+        stream = handler.create_text_stream("AI_RESPONSE")
+
+        async def produce():
+            for i, delta in enumerate("abcdef"):
+                if i == pause_after:
+                    await asyncio.sleep(0.3)
+                await stream.emit_chunk(delta)
+            await handler.complete()
+
+        handler.start(produce())
+        return [data async for _, type, data in handler.events(frame_format=frame_format) if type == "AI_RESPONSE_CHUNK"]
+
+    return asyncio.run(main())
+
+
+def test_first_delta_is_sent_alone_and_later_ones_merge():
+    handler = SSEResponseHandler(resume_grace=0, coalesce_window=0.1, coalesce_bytes=2048)
+    assert _chunks(handler) == ["a", "bcdef"]
+
+
+def test_coalescing_stops_at_the_byte_limit():
+    handler = SSEResponseHandler(resume_grace=0, coalesce_window=0.1, coalesce_bytes=2)
+    assert _chunks(handler) == ["a", "bc", "de", "f"]
+
+
+def test_coalescing_window_flushes_before_a_pause():
+    handler = SSEResponseHandler(resume_grace=0, coalesce_window=0.05, coalesce_bytes=2048)
+    # d..f arrive after the window of b..c has closed
+    assert _chunks(handler, pause_after=3) == ["a", "bc", "def"]
+
+
+def test_token_frames_are_never_merged():
+    assert _chunks(SSEResponseHandler(frame_format="token", resume_grace=0, coalesce_window=0.1)) == list("abcdef")
+    # A coalescing stream can still be followed one delta at a time
+    assert _chunks(SSEResponseHandler(resume_grace=0, coalesce_window=0.1), frame_format="token") == list("abcdef")